@@ -2,7 +2,7 @@ from main import *
 
 # Input parameters for experiment
 well_volume = 25 # microliters
-ctc = 9.1 # mm
+ctc = 9.1 # mm, as measured on our plates (the 96-well plate profile uses the 9.00 mm standard)
 z_lift = 15 # mm
 num_rows = 0
 num_columns = 0
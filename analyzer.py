@@ -0,0 +1,316 @@
+import math
+import mmap
+import os
+import re
+from config import *
+from tools import Tool,make_tools
+
+"""
+Streaming G-code analyzer.
+
+Recomputes the statistics of G.summary_report (travel and extrusion distance,
+extruded volume and print time) from any .gcode file, generated or edited by
+hand. The file is memory-mapped and read in fixed-size chunks, so memory use
+does not depend on the file size. Each chunk is decoded once and a regex over
+it picks out the lines with a command; comment and blank lines never reach
+Python code. The accounting itself runs move by move in Python, so analysis is
+CPU-bound, far below disk speed: about 140k moves (15 MB of G-code with full
+diagnostics) per second on the machine of the benchmarks.
+
+The accounting follows G exactly: positions are kept in motor steps, targets
+are rounded to the nearest step, M92 changes the steps/mm without touching the
+step position, and volume is only counted when E goes past the furthest
+position reached so far (the syringe cannot retract material), using the
+cross-section of the selected syringe. G92 sets coordinates without moving;
+the furthest E position moves with the E coordinate. T<n> switches tools as G.select_tool
+does: every tool has its own syringe, volume and furthest E position, and the
+tool change time is added to the print time.
+"""
+
+CHUNK_SIZE = 1 << 24 # bytes
+_COMMAND_LINES = re.compile(r'^[ \t]*([^;\s][^;\n]*)',re.M) # the command of every line that has one
+
+class GcodeAnalyzer(object):
+	def __init__(self,syringe="BD-1ml",steps_per_mm=None,initial_feedrate=100.0,relative=False,segment_length=ARC_SEGMENT_LENGTH,tools=None,tool_change_time=TOOL_CHANGE_TIME):
+		"""
+		Parameters
+		-----------
+		syringe : str (default: "BD-1ml")
+			Syringe profile name (see hardware.py), sets the volume per mm of E
+			(of every tool when tools is None)
+		steps_per_mm : tuple (default: None)
+			Steps/mm of the X,Y,Z,E axes until the file sets them with M92, by
+			default those of the PRINTER profile
+		initial_feedrate : float (default: 100.0)
+			Feedrate (mm/min) until the file sets one
+		relative : bool (default: False)
+			Positioning mode until the file sends G90/G91 (firmware starts absolute)
+		segment_length : float (default: ARC_SEGMENT_LENGTH)
+			Arc segment length used by the firmware for G2/G3 (mm)
+		tools : list (default: None)
+			Per-extruder syringes, as for G (see tools.make_tools). Tool 0 is
+			active at the start; T commands for tools not listed use syringe.
+		tool_change_time : float (default: TOOL_CHANGE_TIME)
+			Time (s) added to the print time by every tool change
+		"""
+		self.syringe = syringe
+		self.tools = make_tools(1,syringe,TIP,tools)
+		self.active_tool = 0
+		self.tool_change_time = tool_change_time
+		self.syringe_cross_section = self.tools[0].syringe_cross_section # uL/mm
+		if steps_per_mm is None:
+			steps_per_mm = printer_profile().steps_per_mm
+		self.mm_to_steps = dict(zip(AXES,steps_per_mm))
+		self.steps_to_mm = dict((axes,1./v) for axes,v in self.mm_to_steps.items())
+		self.speed = initial_feedrate
+		self.is_relative = relative
+		self.segment_length = segment_length
+		self.position = dict((axes,0) for axes in AXES) # steps
+		self.travel_distance = 0.0 # mm
+		self.extrusion_distance = 0.0 # mm
+		self.max_e_position = 0 # steps
+		self.extrusion_volume = 0.0 # uL
+		self._tool_volume_mark = 0.0 # extrusion_volume when the active tool was selected
+		self.print_time = 0.0 # s
+		self.lines = 0
+		self.moves = 0
+		self.unknown = 0 # lines with commands the analyzer ignores
+
+	# ---------- Parsing ---------- #
+	def feed_line(self,line):
+		""" Process one line of G-code """
+		self.lines += 1
+		i = line.find(';')
+		if i >= 0:
+			line = line[:i]
+		self._command(line)
+
+	def _command(self,line):
+		# one line without its comment
+		words = line.split()
+		if not words:
+			return
+		if words[0][0] == 'N':
+			# line number (and checksum) from a host
+			words = words[1:]
+			if words and '*' in words[-1]:
+				words[-1] = words[-1].split('*')[0]
+			if not words:
+				return
+		cmd = words[0].upper()
+		if cmd == 'G1' or cmd == 'G0':
+			self._linear(self._args(words))
+		elif cmd == 'G2' or cmd == 'G3':
+			self._arc(self._args(words),cmd == 'G2')
+		elif cmd == 'G91':
+			self.is_relative = True
+		elif cmd == 'G90':
+			self.is_relative = False
+		elif cmd[0] == 'T' and cmd[1:].isdigit():
+			self.select_tool(int(cmd[1:]))
+		elif cmd == 'M92':
+			for axes,value in self._args(words).items():
+				if axes in self.mm_to_steps:
+					self.mm_to_steps[axes] = value
+					self.steps_to_mm[axes] = 1./value
+		elif cmd == 'G92':
+			self._set_position(self._args(words))
+		else:
+			self.unknown += 1
+
+	def _args(self,words):
+		args = {}
+		for word in words[1:]:
+			if len(word) > 1:
+				args[word[0].upper()] = float(word[1:])
+		return args
+
+	def _target(self,axes,value):
+		destination = value + self.position[axes]*self.steps_to_mm[axes] if self.is_relative else value
+		return int(round(destination*self.mm_to_steps[axes]))
+
+	def _extrude(self,target):
+		# extruded material cannot be retracted: only count E beyond the furthest point so far
+		if target > self.max_e_position:
+			self.extrusion_volume += (target-self.max_e_position)*self.steps_to_mm[EXTRUSION_AXES[0]]*self.syringe_cross_section
+			self.max_e_position = target
+
+	def _set_position(self,args):
+		# G92: the named axes (all of them if none) take a new coordinate, nothing moves
+		eaxis = EXTRUSION_AXES[0]
+		for axes in AXES if not any(axes in args for axes in AXES) else args:
+			if axes not in self.position:
+				continue
+			target = int(round(args.get(axes,0.0)*self.mm_to_steps[axes]))
+			if axes == eaxis:
+				# the furthest point reached moves with the coordinate system
+				self.max_e_position += target - self.position[axes]
+			self.position[axes] = target
+
+	# ---------- Tools ---------- #
+	def _store_tool(self):
+		tool = self.tools[self.active_tool]
+		tool.e_position = self.position[EXTRUSION_AXES[0]]
+		tool.max_e_position = self.max_e_position
+		tool.extrusion_volume += self.extrusion_volume - self._tool_volume_mark
+		self._tool_volume_mark = self.extrusion_volume
+
+	def select_tool(self,index):
+		""" T command: same accounting as G.select_tool """
+		if index == self.active_tool:
+			return
+		self._store_tool()
+		while len(self.tools) <= index:
+			self.tools.append(Tool(len(self.tools),self.syringe,TIP))
+		tool = self.tools[index]
+		# the tool resumes its retraction where it left it
+		self.max_e_position = self.position[EXTRUSION_AXES[0]] + tool.max_e_position - tool.e_position
+		self.active_tool = index
+		self.syringe_cross_section = tool.syringe_cross_section
+		self.print_time += self.tool_change_time
+
+	def tool_volumes(self):
+		""" Volume (uL) delivered by every tool """
+		self._store_tool()
+		return [tool.extrusion_volume for tool in self.tools]
+
+	def _linear(self,args):
+		if 'F' in args:
+			self.speed = args['F']
+		position = self.position
+		steps_to_mm = self.steps_to_mm
+		mm_to_steps = self.mm_to_steps
+		relative = self.is_relative
+		xyzdistance = 0.0
+		edistance = 0.0
+		moved = False
+		for axes in AXES:
+			if axes not in args:
+				continue
+			moved = True
+			# same as _target
+			destination = args[axes] + position[axes]*steps_to_mm[axes] if relative else args[axes]
+			target = int(round(destination*mm_to_steps[axes]))
+			diff = target - position[axes]
+			if axes in MOTION_AXES:
+				xyzdistance += (diff*steps_to_mm[axes])**2
+			else:
+				edistance = abs(diff*steps_to_mm[axes])
+				self._extrude(target)
+			position[axes] = target
+		if not moved:
+			return
+		self.moves += 1
+		xyzdistance = math.sqrt(xyzdistance)
+		if xyzdistance != 0.0:
+			self.print_time += 60.*xyzdistance/self.speed
+			self.travel_distance += xyzdistance
+		elif edistance != 0.0:
+			self.print_time += 60.*edistance/self.speed
+		if edistance != 0.0:
+			self.extrusion_distance += edistance
+
+	def _arc(self,args,clockwise):
+		import arcs
+		if 'F' in args:
+			self.speed = args['F']
+		x0 = self.position[AXES[0]]*self.steps_to_mm[AXES[0]]
+		y0 = self.position[AXES[1]]*self.steps_to_mm[AXES[1]]
+		i = args.get('I',0.0)
+		j = args.get('J',0.0)
+		radius = math.hypot(i,j)
+		start_angle = math.degrees(math.atan2(-j,-i))
+		end_angle = None
+		for axes in AXES[:2]:
+			if axes in args:
+				self.position[axes] = self._target(axes,args[axes])
+		x1 = self.position[AXES[0]]*self.steps_to_mm[AXES[0]]
+		y1 = self.position[AXES[1]]*self.steps_to_mm[AXES[1]]
+		if (x1,y1) != (x0,y0):
+			end_angle = math.degrees(math.atan2(y1-(y0+j),x1-(x0+i)))
+		sweep = arcs.sweep_angle(start_angle,end_angle,'CW' if clockwise else 'CCW')
+		path_length = float(arcs.arc_length(radius,sweep,self.segment_length))
+		eaxis = EXTRUSION_AXES[0]
+		if eaxis in args:
+			target = self._target(eaxis,args[eaxis])
+			self.extrusion_distance += abs((target-self.position[eaxis])*self.steps_to_mm[eaxis])
+			self._extrude(target)
+			self.position[eaxis] = target
+		self.moves += 1
+		self.travel_distance += path_length
+		self.print_time += 60.*path_length/self.speed
+
+	# ---------- Input ---------- #
+	def feed(self,lines):
+		""" Process an iterable of lines """
+		for line in lines:
+			self.feed_line(line)
+		return self
+
+	def _feed_text(self,text):
+		# whole lines at once: only those with a command reach Python
+		self.lines += text.count('\n') + (0 if text.endswith('\n') else 1)
+		command = self._command
+		for line in _COMMAND_LINES.findall(text):
+			command(line)
+
+	def analyze_file(self,path,chunk_size=CHUNK_SIZE):
+		""" Process a file through a memory map, chunk_size bytes at a time """
+		size = os.path.getsize(path)
+		if size == 0:
+			return self
+		with open(path,'rb') as f:
+			mm = mmap.mmap(f.fileno(),0,access=mmap.ACCESS_READ)
+			try:
+				tail = b''
+				for start in range(0,size,chunk_size):
+					chunk = tail + mm[start:start+chunk_size]
+					end = chunk.rfind(b'\n') + 1
+					tail = chunk[end:]
+					self._feed_text(chunk[:end].decode('ascii','replace'))
+				if tail:
+					self._feed_text(tail.decode('ascii','replace'))
+			finally:
+				mm.close()
+		return self
+
+	# ---------- Reports ---------- #
+	def summary(self):
+		return {'travel_distance':self.travel_distance,'extrusion_distance':self.extrusion_distance,
+			'extrusion_volume':self.extrusion_volume,'max_e_position':self.max_e_position,
+			'print_time':self.print_time,'lines':self.lines,'moves':self.moves,'tool_volumes':self.tool_volumes()}
+
+	def report(self,digits=4):
+		""" The same lines as G.summary_report """
+		args = ' '.join('{0}{1:.{digits}f}'.format(axes,self.position[axes]*self.steps_to_mm[axes],digits=digits) for axes in AXES)
+		if self.print_time > 60.0:
+			minutes,seconds = divmod(self.print_time,60.0)
+			duration = '{0} min {1:.{digits}f} s'.format(int(minutes),seconds,digits=digits)
+		else:
+			duration = '{0:.{digits}f} s'.format(self.print_time,digits=digits)
+		lines = [';Current location (mm): ' + args,
+			';Total travel distance: {:.{digits}f} mm'.format(self.travel_distance,digits=digits),
+			';Total extrusion distance: {:.{digits}f} mm'.format(self.extrusion_distance,digits=digits),
+			';Total extruded volume: {} uL'.format(self.extrusion_volume)]
+		if len(self.tools) > 1:
+			for k,volume in enumerate(self.tool_volumes()):
+				lines.append(';Tool {0} extruded volume: {1:.{digits}f} uL'.format(k,volume,digits=digits))
+		return lines + [';Total print time: ' + duration]
+
+def analyze(path,chunk_size=CHUNK_SIZE,**kwargs):
+	""" Analyze a G-code file, other keyword arguments as for GcodeAnalyzer """
+	return GcodeAnalyzer(**kwargs).analyze_file(path,chunk_size)
+
+if __name__ == "__main__":
+	import argparse
+	parser = argparse.ArgumentParser(description='Recompute travel, extrusion and time statistics of G-code files.')
+	parser.add_argument('files',nargs='+')
+	parser.add_argument('--syringe',default="BD-1ml",choices=sorted(SYRINGE_DIAMETER))
+	parser.add_argument('--tools',nargs='+',metavar='SYRINGE',choices=sorted(SYRINGE_DIAMETER),help='syringe of every tool (T0, T1...)')
+	parser.add_argument('--digits',type=int,default=4)
+	options = parser.parse_args()
+	tools = [{'syringe':name} for name in options.tools] if options.tools else None
+	for path in options.files:
+		print(path)
+		for line in analyze(path,syringe=options.syringe,tools=tools).report(options.digits):
+			print(line)
@@ -0,0 +1,76 @@
+import math
+from collections import OrderedDict
+import numpy as np
+from config import *
+
+"""
+Arc geometry for circular moves.
+
+Firmware does not move along a true circle: it splits G2/G3 into straight
+segments of (about) ARC_SEGMENT_LENGTH mm, like Marlin's MM_PER_ARC_SEGMENT.
+These helpers reproduce that linearization, so travel distance, print time and
+extrusion are computed along the path the head really takes, and can also
+produce the chords themselves to emit arcs as plain G1 moves.
+
+Angles are in degrees, measured counterclockwise from +X, from the centre of
+the arc to the head.
+"""
+
+CHORD_CACHE_SIZE = 4096 # unit chord tables kept, the least recently used are dropped
+_UNIT_CHORDS = OrderedDict()
+
+def sweep_angle(start_angle,end_angle=None,direction='CW'):
+	""" Signed sweep (radians) from start to end; None or equal angles mean a full circle """
+	if direction not in ('CW','CCW'):
+		raise RuntimeError('Direction must be CW or CCW.')
+	if end_angle is None:
+		sweep = 0.0
+	else:
+		sweep = math.radians(end_angle - start_angle) % (2*math.pi)
+	if direction == 'CW':
+		sweep = sweep - 2*math.pi if sweep > 0.0 else -2*math.pi
+	elif sweep == 0.0:
+		sweep = 2*math.pi
+	return sweep
+
+def segment_count(radius,sweep,segment_length=ARC_SEGMENT_LENGTH):
+	""" Number of straight segments the firmware uses for an arc (at least one) """
+	segments = np.floor(np.abs(sweep)*np.abs(radius)/segment_length)
+	return np.maximum(segments,1).astype(np.int64)
+
+def arc_length(radius,sweep,segment_length=ARC_SEGMENT_LENGTH):
+	""" Length of the linearized arc (sum of its chords), vectorized over radius """
+	n = segment_count(radius,sweep,segment_length)
+	return n*2.*np.abs(radius)*np.sin(np.abs(sweep)/(2.*n))
+
+def unit_chords(n,start_angle,sweep):
+	""" Cached (n,2) chord displacements of a unit-radius arc split into n segments """
+	key = (int(n),start_angle,sweep)
+	chords = _UNIT_CHORDS.pop(key,None)
+	if chords is None:
+		theta = math.radians(start_angle) + sweep*np.arange(n+1)/float(n)
+		points = np.column_stack((np.cos(theta),np.sin(theta)))
+		chords = np.diff(points,axis=0)
+		if abs(abs(sweep) - 2*math.pi) < 1e-12:
+			# close full circles exactly
+			chords[-1] = -chords[:-1].sum(axis=0)
+		chords.setflags(write=False)
+		if len(_UNIT_CHORDS) >= CHORD_CACHE_SIZE:
+			_UNIT_CHORDS.popitem(last=False)
+	_UNIT_CHORDS[key] = chords # most recently used last
+	return chords
+
+def chord_deltas(radius,start_angle,sweep,segment_length=ARC_SEGMENT_LENGTH):
+	""" (n,2) relative XY moves that follow the linearized arc """
+	n = int(segment_count(radius,sweep,segment_length))
+	return radius*unit_chords(n,start_angle,sweep)
+
+def ring_chords(radii,start_angle,sweep,segment_length=ARC_SEGMENT_LENGTH):
+	""" Chords of several concentric arcs at once
+
+	Returns the stacked (sum(n),2) chord moves and the number of chords of every arc.
+	"""
+	radii = np.asarray(radii,dtype=float)
+	counts = segment_count(radii,sweep,segment_length)
+	chords = np.concatenate([r*unit_chords(n,start_angle,sweep) for r,n in zip(radii.tolist(),counts.tolist())])
+	return chords,counts
@@ -0,0 +1,505 @@
+import numpy as np
+from config import *
+import gcode_format
+from diagnostics import filament_width,AGGREGATE,FULL
+
+"""
+Vectorized batch moves for the G object (see G.move_many).
+
+The step targets follow exactly the same arithmetic as the scalar path in
+G._update_current_position, including the relative-positioning recurrence
+destination = move + position*steps_to_mm. That recurrence is solved by
+assuming every move rounds independently, then re-checking the assumption with
+the exact formula and repairing from the first disagreement.
+"""
+
+def _round(values):
+	# match the builtin round() of the running interpreter
+	if round(0.5) == 0:
+		return np.round(values) # Python 3: round half to even
+	return np.sign(values)*np.floor(np.abs(values)+0.5) # Python 2: round half away from zero
+
+def _relative_targets(moves,start,mm_to_steps,steps_to_mm):
+	""" Return the step position after each relative move """
+	n = len(moves)
+	targets = np.empty(n,dtype=np.int64)
+	guess = start + np.cumsum(_round(moves*mm_to_steps).astype(np.int64))
+	i = 0
+	position = start
+	while i < n:
+		previous = np.empty(n-i,dtype=np.int64)
+		previous[0] = position
+		previous[1:] = guess[i:n-1]
+		exact = _round((moves[i:] + previous*steps_to_mm)*mm_to_steps).astype(np.int64)
+		wrong = np.nonzero(exact != guess[i:])[0]
+		if len(wrong) == 0:
+			targets[i:] = guess[i:]
+			break
+		j = i + wrong[0]
+		# everything before j was consistent, and j itself is now exact
+		targets[i:j+1] = exact[:wrong[0]+1]
+		position = int(targets[j])
+		guess[j+1:] = position + np.cumsum(_round(moves[j+1:]*mm_to_steps).astype(np.int64))
+		i = j + 1
+	return targets
+
+def quantize_relative(g,axis,moves,origin=None):
+	""" Snap a sequence of relative moves to whole steps without accumulating error
+
+	The cumulative path is rounded to steps once, so each returned move is an
+	exact number of steps and the end point is within half a step of the
+	requested one (rounding every small move on its own, as the relative
+	positioning model does, would bias long runs of short moves). A path sent
+	in several batches passes origin, the unrounded position (mm) where the
+	previous batch was meant to end, so the rounding does not add up from one
+	batch to the next.
+	"""
+	m = g.mm_to_steps[axis]
+	start = g._get_position(axis)
+	if origin is None:
+		origin = start*g.steps_to_mm[axis]
+	targets = _round((origin + np.cumsum(moves))*m).astype(np.int64)
+	return np.diff(np.concatenate(([start],targets)))/float(m)
+
+def plan_moves(g,x=None,y=None,z=None,e=None,extrusionunit='mm',speed=None):
+	""" Compute the per-move steps and statistics of a batch without touching g
+
+	speed optionally gives a per-move feedrate (mm/min) instead of g.speed.
+	Returns a dict with the per-axis step targets, the user values (in mm) of the
+	moved axes, per-move travel/extrusion distances, extruded volumes and times.
+	"""
+	values = {}
+	for axes,v in zip(AXES,(x,y,z,e)):
+		if v is not None:
+			values[axes] = np.atleast_1d(np.asarray(v,dtype=float))
+	if not values:
+		raise RuntimeError('No axis given to move_many.')
+	n = max(len(v) for v in values.values())
+	for axes in values:
+		if len(values[axes]) == 1 and n > 1:
+			values[axes] = np.repeat(values[axes],n)
+		elif len(values[axes]) != n:
+			raise RuntimeError('All axis arrays given to move_many must have the same length.')
+	if AXES[3] in values and extrusionunit in ('uL','ul'):
+		values[AXES[3]] = values[AXES[3]]/g.syringe_cross_section # mm
+
+	targets = {}
+	diffs = {}
+	for axes in AXES:
+		start = g._get_position(axes)
+		if axes not in values:
+			targets[axes] = np.full(n,start,dtype=np.int64)
+			diffs[axes] = np.zeros(n,dtype=np.int64)
+			continue
+		m = g.mm_to_steps[axes]
+		s = g.steps_to_mm[axes]
+		if g.is_relative:
+			col = _relative_targets(values[axes],start,m,s)
+		else:
+			col = _round(values[axes]*m).astype(np.int64)
+		targets[axes] = col
+		diffs[axes] = np.diff(np.concatenate(([start],col)))
+
+	xyzdistance = np.zeros(n)
+	for axes in MOTION_AXES:
+		if axes in values:
+			xyzdistance += (diffs[axes]*g.steps_to_mm[axes])**2
+	xyzdistance = np.sqrt(xyzdistance)
+	eaxis = EXTRUSION_AXES[0]
+	edistance = np.abs(diffs[eaxis]*g.steps_to_mm[eaxis])
+	# volume is only counted when E goes past the furthest position reached so far
+	reached = np.maximum.accumulate(np.concatenate(([g.max_e_position],targets[eaxis])))
+	ediff = np.diff(reached)
+	extruded_volume = ediff*g.steps_to_mm[eaxis]*g.syringe_cross_section # uL
+	speed = np.full(n,float(g.speed)) if speed is None else np.asarray(speed,dtype=float)
+	move_time = np.where(xyzdistance != 0.0,60.*xyzdistance/speed,60.*edistance/speed)
+
+	return {'n':n,'values':values,'targets':targets,'diffs':diffs,'xyzdistance':xyzdistance,
+		'edistance':edistance,'extruded_volume':extruded_volume,'move_time':move_time,'speed':speed,
+		'max_e_position':int(reached[-1])}
+
+# ---------- Fixed-point rendering ---------- #
+# Floats are turned into exact integers q = |value|*10**digits, rounded the way
+# '%.*f' rounds them; the decimal digits of q are looked up 4 at a time in a
+# table and copied into a byte matrix holding the lines (NUL bytes fill the
+# unused columns). This renders the same text as % about 3 times faster. Tables
+# with a value % would not render this way (inf, nan, 10**digits times the
+# value past 2**52) go back to %.
+
+_QUADS = None
+
+def _quads():
+	# '0000' to '9999' as 4 ASCII bytes packed in one uint32 each
+	global _QUADS
+	if _QUADS is None:
+		text = ''.join(['%04d' % i for i in range(10000)]).encode('ascii')
+		_QUADS = np.frombuffer(text,dtype=np.uint8).copy().view(np.uint32)
+	return _QUADS
+
+def fixed_column(values,digits):
+	""" Exact (negative, q) fixed-point pair of a float column, or None if q would exceed 2**52 """
+	values = np.asarray(values,dtype=float)
+	y = np.abs(values)*10.**digits
+	if len(y) and not (y.max() < 2.**52): # also catches nan
+		return None
+	q = np.rint(y)
+	# rint rounds the (inexact) product; where it lies close to a tie, ask %
+	tie = np.flatnonzero(np.abs(np.abs(y-q)-0.5) <= 4*np.spacing(y))
+	q = q.astype(np.int64)
+	for i in tie.tolist():
+		q[i] = int(('%.*f' % (digits,abs(values[i]))).replace('.',''))
+	return np.signbit(values),q
+
+def _decimal(q,groups):
+	# the last 4*groups digits of every q as a (rows, 4*groups) array of ASCII codes
+	quads = np.empty((len(q),groups),dtype=np.int64)
+	for k in range(groups-1,0,-1):
+		rest = q // 10000
+		quads[:,k] = q - rest*10000
+		q = rest
+	quads[:,0] = q
+	return _quads()[quads].view(np.uint8)
+
+def fixed_matrix(literals,fields,digits,minimal=False):
+	""" The lines of render_fixed as a (rows, width) byte matrix
+
+	Every row holds one line and its newline, padded with NUL bytes (see
+	matrix_text).
+	"""
+	rows = len(fields[0][1]) if fields else 0
+	if rows == 0:
+		return np.zeros((0,0),dtype=np.uint8)
+	scale = 10**digits
+	fraction = 1 + digits if digits else 0 # '.' and the decimals
+	starts = [] # start of every literal and field in the line
+	width = 0
+	widths = [] # integer digits of every field
+	for literal,(negative,q) in zip(literals,fields):
+		starts.append(width)
+		width += len(literal)
+		widths.append(len(str(int(q.max()) // scale)))
+		width += 1 + widths[-1] + fraction
+	starts.append(width)
+	width += len(literals[-1]) + 1
+	out = np.zeros((rows,width),dtype=np.uint8) # NUL bytes are dropped at the end
+	for start,literal in zip(starts,literals):
+		if literal:
+			out[:,start:start+len(literal)] = np.frombuffer(literal.encode('ascii'),dtype=np.uint8)
+	out[:,-1] = ord('\n')
+	for start,literal,integer_width,(negative,q) in zip(starts,literals,widths,fields):
+		position = start + len(literal)
+		out[:,position] = np.where(negative & (q != 0) if minimal else negative,ord('-'),0)
+		groups = (integer_width+digits+3) // 4
+		number = _decimal(q,groups)
+		column = np.arange(4*groups)
+		units = 4*groups - digits # column of the units digit, plus one
+		# drop the leading zeros of the integer part (keeping the units)
+		used = np.ones(rows,dtype=np.int64)
+		for power in range(1,integer_width):
+			used += q >= scale*10**power
+		number *= column >= (units-used)[:,None]
+		out[:,position+1:position+1+integer_width] = number[:,units-integer_width:units]
+		if digits:
+			point = position + 1 + integer_width
+			if minimal:
+				zeros = np.zeros(rows,dtype=np.int64) # trailing zeros of the decimals
+				for power in range(1,digits+1):
+					zeros += q % 10**power == 0
+				number *= column < (4*groups-zeros)[:,None]
+				out[:,point] = np.where(zeros < digits,ord('.'),0)
+			else:
+				out[:,point] = ord('.')
+			out[:,point+1:point+1+digits] = number[:,units:]
+	return out
+
+def matrix_text(matrix):
+	""" The text of a byte matrix of lines, without its NUL bytes """
+	out = matrix.ravel()
+	text = out[out != 0].tobytes()
+	if not isinstance(text,str): # Python 3
+		text = text.decode('ascii')
+	return text
+
+def render_fixed(literals,fields,digits,minimal=False):
+	""" Lines literals[0] field0 literals[1] field1 ... literals[-1], one per row
+
+	fields are (negative, q) fixed-point columns with digits decimals (see
+	fixed_column); every number is rendered like '%.*f' % (digits, value), or
+	with trailing zeros stripped like gcode_format.strip_zeros when minimal.
+	"""
+	if not fields or len(fields[0][1]) == 0:
+		return []
+	return matrix_text(fixed_matrix(literals,fields,digits,minimal)).split('\n')[:-1]
+
+# comment templates of the scalar path (G._update_current_position), as %-templates
+_RATE = ";Extr. rate: %.{0}f mm/min (%.{0}f uL/s | %.{0}f mL/min)"
+_AREA = ";Extr. volume: %.{0}f uL| Filament area: %.{0}f mm^2"
+_WIDTH = ";Filament width (elliptical assumption): %.{0}f mm"
+_VOLUME = ";Extr. volume %.{0}f uL"
+
+# moves planned, rendered and written at a time by move_many (bounds the memory)
+BATCH_CHUNK = 65536
+
+def diagnostic_lines(g,i,plan):
+	""" The extrusion comment lines the scalar path writes before move i """
+	d = g.output_digits
+	xyzdistance = plan['xyzdistance'][i]
+	edistance = plan['edistance'][i]
+	extruded_volume = plan['extruded_volume'][i]
+	if edistance == 0.0:
+		return []
+	move_time = plan['move_time'][i]
+	espeed = 60.*edistance/move_time # mm/min
+	flowrate = espeed*g.syringe_cross_section/60. # uL/s
+	lines = [_RATE.format(d) % (espeed,flowrate,60.*flowrate/1000.)]
+	if xyzdistance != 0.0:
+		filamentarea = extruded_volume / xyzdistance # mm^2
+		filamentwidth = filament_width(extruded_volume,xyzdistance,g.layer_height) # mm (assumes ellipse)
+		lines.append(_AREA.format(d) % (extruded_volume,filamentarea))
+		lines.append(_WIDTH.format(d) % (filamentwidth,))
+	else:
+		lines.append(_VOLUME.format(d) % (extruded_volume,))
+	return lines
+
+def _matrix(tpl,digits,*columns):
+	# fixed_matrix of one line per row of the NumPy columns, tpl holding a
+	# '%.<digits>f' per column; None if a value needs %
+	fields = [fixed_column(column,digits) for column in columns]
+	if any(field is None for field in fields):
+		return None
+	return fixed_matrix(tpl.split('%.{}f'.format(digits)),fields,digits)
+
+def _table(tpl,digits,*columns):
+	# the lines of _matrix, with % when the fixed-point path does not apply
+	matrix = _matrix(tpl,digits,*columns)
+	if matrix is None:
+		flat = np.column_stack(columns).ravel().tolist() if len(columns) > 1 else columns[0].tolist()
+		return gcode_format.format_table(tpl,flat,len(columns[0]))
+	if not len(matrix):
+		return []
+	return matrix_text(matrix).split('\n')[:-1]
+
+def diagnostic_values(g,plan):
+	""" The numbers of the extrusion comment lines of a batch
+
+	Returns (extruding, laid, rate, area, volume, width): the indices of the
+	extruding moves, which of them also move XYZ, and the columns of their
+	rate line (all extruding moves), volume and area line (laid ones), volume
+	line (the others) and filament width line (laid ones).
+	"""
+	extruding = np.flatnonzero(plan['edistance'] != 0.0)
+	xyzdistance = plan['xyzdistance'][extruding]
+	extruded_volume = plan['extruded_volume'][extruding]
+	# same operations, in the same order, as the scalar path
+	espeed = 60.*plan['edistance'][extruding]/plan['move_time'][extruding] # mm/min
+	flowrate = espeed*g.syringe_cross_section/60. # uL/s
+	laid = xyzdistance != 0.0
+	filamentarea = extruded_volume[laid] / xyzdistance[laid] # mm^2
+	filamentwidth = filament_width(extruded_volume[laid],xyzdistance[laid],g.layer_height) # mm (assumes ellipse)
+	return (extruding,laid,(espeed,flowrate,60.*flowrate/1000.),(extruded_volume[laid],filamentarea),
+		(extruded_volume[~laid],),(filamentwidth,))
+
+def _templates(digits):
+	return [tpl.format(digits) for tpl in (_RATE,_AREA,_VOLUME,_WIDTH)]
+
+def diagnostic_columns(g,plan):
+	""" The extrusion comment lines of a whole batch, rendered column by column
+
+	Returns (extruding, laid, rate, volume, width): the indices of the extruding
+	moves, which of them also move XYZ, their first and second comment lines,
+	and the third line (filament width) of the laid ones.
+	"""
+	d = g.output_digits
+	extruding,laid,rate,area,volume,width = diagnostic_values(g,plan)
+	rate_tpl,area_tpl,volume_tpl,width_tpl = _templates(d)
+	second = np.empty(len(extruding),dtype=object)
+	second[laid] = _objects(_table(area_tpl,d,*area))
+	second[~laid] = _objects(_table(volume_tpl,d,*volume))
+	return extruding,laid,_table(rate_tpl,d,*rate),second,_table(width_tpl,d,*width)
+
+def diagnostic_text(g,plan,moves):
+	""" The text of the move lines of a batch with their comment lines before them
+
+	moves is the fixed_matrix of the move lines. The comment lines are rendered
+	into the same byte matrix, each kind in its own columns and only on the rows
+	of the moves that have it, so dropping the NUL bytes interleaves them (the
+	area and volume lines never share a row, so they share columns). Returns
+	(text, number of lines), or None if a value needs %.
+	"""
+	d = g.output_digits
+	extruding,laid,rate,area,volume,width = diagnostic_values(g,plan)
+	rate,area,volume,width = [_matrix(tpl,d,*columns) for tpl,columns in zip(_templates(d),(rate,area,volume,width))]
+	if rate is None or area is None or volume is None or width is None:
+		return None
+	second = max(area.shape[1],volume.shape[1])
+	widths = (rate.shape[1],second,width.shape[1],moves.shape[1])
+	starts = np.cumsum((0,)+widths)
+	out = np.zeros((len(moves),starts[-1]),dtype=np.uint8)
+	out[extruding,:starts[1]] = rate
+	out[extruding[laid],starts[1]:starts[1]+area.shape[1]] = area
+	out[extruding[~laid],starts[1]:starts[1]+volume.shape[1]] = volume
+	out[extruding[laid],starts[2]:starts[3]] = width
+	out[:,starts[3]:] = moves
+	return matrix_text(out),len(moves)+2*len(extruding)+len(width)
+
+def _objects(strings):
+	# NumPy would turn a list of str into a fixed-width unicode array
+	out = np.empty(len(strings),dtype=object)
+	out[:] = strings
+	return out
+
+def _layout(n,extruding,laid):
+	# index of every move line, and of the first comment line of the extruding
+	# moves, once the 2 or 3 comment lines are put before them
+	counts = np.ones(n,dtype=np.int64)
+	counts[extruding] += 2 + laid
+	end = np.cumsum(counts)
+	return end-1,end[extruding]-counts[extruding]
+
+def _interleave(lines,extruding,laid,rate,volume,width):
+	# put the comment lines of every extruding move just before its line
+	if not len(extruding):
+		return lines
+	moves,first = _layout(len(lines),extruding,laid)
+	out = np.empty(len(lines)+2*len(extruding)+len(width),dtype=object)
+	out[moves] = _objects(lines)
+	out[first] = _objects(rate)
+	out[first+1] = volume
+	out[first[laid]+2] = _objects(width)
+	return out.tolist()
+
+def aggregate_diagnostics(g,plan):
+	""" Add the flow rate and filament width of every extruding move to g.flow_statistics """
+	extruding = plan['edistance'] != 0.0
+	flowrate = 60.*plan['edistance'][extruding]/plan['move_time'][extruding]*g.syringe_cross_section/60. # uL/s
+	laid = extruding & (plan['xyzdistance'] != 0.0)
+	width = filament_width(plan['extruded_volume'][laid],plan['xyzdistance'][laid],g.layer_height)
+	g.flow_statistics.add_many(flowrate,width)
+
+def step_column(steps,steps_per_mm,digits):
+	""" Exact (negative, q) fixed-point pair of a column of step counts in mm (see gcode_format.format_steps)
+
+	Returns None if the fixed-point product would overflow int64.
+	"""
+	steps = np.asarray(steps,dtype=np.int64)
+	numerator,divisor = gcode_format._step_scale(steps_per_mm,digits)
+	magnitude = np.abs(steps)
+	if len(steps) and int(magnitude.max())*numerator >= 2**62:
+		return None
+	product = magnitude*numerator
+	q = product // divisor
+	r = product - q*divisor
+	q += (2*r > divisor) | ((2*r == divisor) & (q % 2 == 1)) # round half to even
+	return steps < 0,q
+
+def _move_matrix(g,plan,moved):
+	# fixed_matrix of the G1 lines of a planned batch, None if a value needs %
+	d = g.output_digits
+	literals = ['G1 '+moved[0]] + [' '+axes for axes in moved[1:]] + ['']
+	if g.step_coordinates:
+		columns = [plan['diffs' if g.is_relative else 'targets'][axes] for axes in moved]
+		fields = [step_column(column,g.mm_to_steps[axes],d) for axes,column in zip(moved,columns)]
+	else:
+		fields = [fixed_column(plan['values'][axes],d) for axes in moved]
+	if any(field is None for field in fields):
+		return None
+	return fixed_matrix(literals,fields,d,g.minimal_output)
+
+def _move_rows(g,plan,moved):
+	# the G1 lines of a planned batch with %
+	d = g.output_digits
+	if g.step_coordinates:
+		columns = [plan['diffs' if g.is_relative else 'targets'][axes] for axes in moved]
+		return ['G1 '+gcode_format.format_step_args(moved,row,[g.mm_to_steps[axes] for axes in moved],d,g.minimal_output)
+			for row in zip(*[column.tolist() for column in columns])]
+	return gcode_format.format_rows(moved,[plan['values'][axes].tolist() for axes in moved],d,g.minimal_output,'G1 ')
+
+def move_lines(g,plan):
+	""" Render the G1 lines (with diagnostics) of a planned batch
+
+	Returns (text, number of lines), the lines ending in a newline, when every
+	number could be rendered in fixed point, else the list of lines.
+	"""
+	moved = tuple(axes for axes in AXES if axes in plan['values'])
+	if g._diagnostic_level == AGGREGATE:
+		aggregate_diagnostics(g,plan)
+	matrix = _move_matrix(g,plan,moved)
+	if matrix is not None:
+		if g._diagnostic_level < FULL:
+			return matrix_text(matrix),len(matrix)
+		block = diagnostic_text(g,plan,matrix)
+		if block is not None:
+			return block
+		lines = matrix_text(matrix).split('\n')[:-1]
+	else:
+		lines = _move_rows(g,plan,moved)
+	if g._diagnostic_level < FULL:
+		return lines
+	return _interleave(lines,*diagnostic_columns(g,plan))
+
+def record_moves(g,plan):
+	""" Append a planned batch to the toolpath g is recording """
+	moved = tuple(axes for axes in AXES if axes in plan['values'])
+	columns = [plan['diffs'][axes] for axes in moved]
+	if g._diagnostic_level < FULL:
+		if g._diagnostic_level == AGGREGATE:
+			aggregate_diagnostics(g,plan)
+		g._toolpath.move_many(moved,columns,g.speed)
+		return
+	# the comments become raw rows, at the same places as in the text output
+	extruding,laid,rate,volume,width = diagnostic_columns(g,plan)
+	_,first = _layout(plan['n'],extruding,laid)
+	positions = np.concatenate((first,first+1,first[laid]+2))
+	g._toolpath.move_many(moved,columns,g.speed,(positions,rate+volume.tolist()+width))
+
+def _chunks(x,y,z,e):
+	# the batch as per-axis arrays of the same length, cut into BATCH_CHUNK moves
+	values = [None if v is None else np.atleast_1d(np.asarray(v,dtype=float)) for v in (x,y,z,e)]
+	given = [v for v in values if v is not None]
+	if not given:
+		raise RuntimeError('No axis given to move_many.')
+	n = max(len(v) for v in given)
+	for v in given:
+		if len(v) != 1 and len(v) != n:
+			raise RuntimeError('All axis arrays given to move_many must have the same length.')
+	for first in range(0,n,BATCH_CHUNK):
+		yield [None if v is None else (v if len(v) == 1 else v[first:first+BATCH_CHUNK]) for v in values],min(BATCH_CHUNK,n-first)
+
+def move_many(g,x=None,y=None,z=None,e=None,extrusionunit='mm'):
+	""" Apply a batch of moves to g and emit them, BATCH_CHUNK moves at a time
+
+	Returns the number of moves.
+	"""
+	n = 0
+	for (cx,cy,cz,ce),size in _chunks(x,y,z,e):
+		# scalars are repeated to the size of the chunk
+		cx,cy,cz,ce = [None if v is None else (np.repeat(v,size) if len(v) == 1 else v) for v in (cx,cy,cz,ce)]
+		plan = plan_moves(g,cx,cy,cz,ce,extrusionunit)
+		if g._toolpath is not None:
+			record_moves(g,plan)
+			lines = None
+		else:
+			lines = move_lines(g,plan)
+		commit_plan(g,plan)
+		if isinstance(lines,list):
+			g.write_lines(lines)
+		elif lines is not None:
+			g.write_block(*lines)
+		n += plan['n']
+	return n
+
+def _accumulate(total,values):
+	# add in move order (np.cumsum adds sequentially), so the totals are
+	# identical to the scalar path
+	return float(np.cumsum(np.concatenate(([total],values)))[-1])
+
+def commit_plan(g,plan):
+	""" Apply the positions and statistics of a planned batch to g (emits nothing) """
+	for axes in AXES:
+		g._current_position[axes] = int(plan['targets'][axes][-1])
+	g.max_e_position = max(g.max_e_position,plan['max_e_position'])
+	g.extrusion_volume = _accumulate(g.extrusion_volume,plan['extruded_volume'])
+	g.travel_distance = _accumulate(g.travel_distance,plan['xyzdistance'])
+	g.extrusion_distance = _accumulate(g.extrusion_distance,plan['edistance'])
+	g.print_time = _accumulate(g.print_time,plan['move_time'])
+	g._history.record_many(plan['targets'],plan['speed'])
@@ -0,0 +1,19 @@
+"""
+Benchmark suite for the G object.
+
+Synthetic workloads that mirror how the generator is used (small relative
+moves, well plate dispense runs, large discs, mixed arc/line programs) are
+timed with the default G configuration and with history='off', their peak
+memory and output size measured, and the results compared with the baselines
+stored in benchmarks/baselines.json. Timings are gated as ratios taken in the
+same run (batch vs scalar, default history vs history='off'); absolute
+throughput only when the baselines were recorded on the same machine.
+
+Run from the repository root:
+	python -m benchmarks                  # compare with the baselines
+	python -m benchmarks --save           # record new baselines
+	python -m benchmarks small_moves disc # only some workloads
+
+The exit status is 1 when a workload or ratio regresses by more than the
+threshold.
+"""
@@ -0,0 +1,29 @@
+from __future__ import print_function
+import argparse
+import sys
+from benchmarks import runner
+from benchmarks.workloads import WORKLOADS
+
+parser = argparse.ArgumentParser(prog='python -m benchmarks',description='Run the G benchmarks and compare them with the baselines.')
+parser.add_argument('workloads',nargs='*',help='workloads to run (default: all): '+', '.join(sorted(WORKLOADS)))
+parser.add_argument('--scale',type=float,default=1.0,help='workload size factor (baselines only apply at the same scale)')
+parser.add_argument('--repeat',type=int,default=3,help='timed runs per workload (the fastest is kept)')
+parser.add_argument('--threshold',type=float,default=runner.THRESHOLD,help='allowed relative regression')
+parser.add_argument('--baselines',default=runner.BASELINE_PATH,help='baseline JSON file')
+parser.add_argument('--configuration',dest='configurations',action='append',choices=sorted(runner.CONFIGURATIONS),help='only run this G configuration (repeatable, default: all)')
+parser.add_argument('--save',action='store_true',help='store the results as the new baselines')
+parser.add_argument('--no-memory',dest='memory',action='store_false',help='skip the tracemalloc run')
+options = parser.parse_args()
+
+results = runner.run(options.workloads,options.scale,options.repeat,options.memory,log=print,configurations=options.configurations)
+for line in runner.format_ratios(runner.ratios(results)):
+	print(line)
+if options.save:
+	baselines = runner.update_baselines(runner.load_baselines(options.baselines),results)
+	runner.save_baselines(baselines,options.baselines)
+	print('Baselines saved to {}'.format(options.baselines))
+	sys.exit(0)
+regressions = runner.compare(results,runner.load_baselines(options.baselines),options.threshold)
+for message in regressions:
+	print('REGRESSION '+message)
+sys.exit(1 if regressions else 0)
@@ -0,0 +1,171 @@
+import json
+import os
+import platform
+import time
+try:
+	import tracemalloc
+except ImportError: # Python 2
+	tracemalloc = None
+from main import G
+from sinks import NullSink
+from benchmarks.workloads import WORKLOADS
+
+"""
+Benchmark runner: measure workloads and compare them with stored baselines.
+
+Each workload is run `repeat` times on a fresh G writing to a NullSink, once
+per configuration (the defaults, and history='off'), and the fastest run is
+kept. Peak memory is measured in one extra run under tracemalloc, so tracing
+does not slow down the timed runs.
+
+Wall-clock throughput depends on the machine, so the regression gate is on
+ratios measured in the same process: the batch speedup (small_moves_batch vs
+small_moves) and the cost of the position history (defaults vs history='off').
+Absolute throughput is only compared when the baselines were recorded on the
+same machine.
+"""
+
+BASELINE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)),'baselines.json')
+THRESHOLD = 0.25 # allowed relative regression
+MEMORY_SLACK = 65536 # bytes of peak memory growth always tolerated (allocator noise)
+
+CONFIGURATIONS = {
+	'default':{},
+	'history_off':{'history':'off'},
+}
+BATCH_RATIOS = (('small_moves_batch','small_moves'),) # (batch workload, scalar workload)
+
+_clock = getattr(time,'perf_counter',time.time)
+
+def machine():
+	""" Identifies the machine the absolute timings were measured on """
+	return '{} {} {} Python {}'.format(platform.node(),platform.machine(),platform.processor(),platform.python_version())
+
+def key(name,configuration):
+	return '{}/{}'.format(name,configuration)
+
+def _run_once(build,scale,configuration):
+	sink = NullSink()
+	g = G(output=sink,**CONFIGURATIONS[configuration])
+	start = _clock()
+	units = build(g,scale)
+	g.summary_report()
+	return _clock() - start,units,sink
+
+def run_workload(name,scale=1.0,repeat=3,memory=True,configuration='default'):
+	""" Measure one workload in one configuration, returns a dict of its metrics """
+	build = WORKLOADS[name]
+	best = None
+	for _ in range(repeat):
+		elapsed,units,sink = _run_once(build,scale,configuration)
+		if best is None or elapsed < best:
+			best = elapsed
+	result = {'scale':scale,'units':units,'seconds':best,'units_per_second':units/best,
+		'output_lines':sink.lines,'output_bytes':sink.bytes,'peak_memory':None}
+	if memory and tracemalloc is not None:
+		tracemalloc.start()
+		try:
+			_run_once(build,scale,configuration)
+			result['peak_memory'] = tracemalloc.get_traced_memory()[1]
+		finally:
+			tracemalloc.stop()
+	return result
+
+def run(names=None,scale=1.0,repeat=3,memory=True,log=None,configurations=None):
+	""" Measure several workloads (all of them by default) in every configuration
+
+	Returns a dict of metrics keyed by 'workload/configuration'.
+	"""
+	results = {}
+	for name in sorted(WORKLOADS) if not names else names:
+		if name not in WORKLOADS:
+			raise RuntimeError('Unknown workload: {}'.format(name))
+		for configuration in sorted(CONFIGURATIONS) if not configurations else configurations:
+			if configuration not in CONFIGURATIONS:
+				raise RuntimeError('Unknown configuration: {}'.format(configuration))
+			results[key(name,configuration)] = run_workload(name,scale,repeat,memory,configuration)
+			if log is not None:
+				log(format_result(key(name,configuration),results[key(name,configuration)]))
+	return results
+
+def ratios(results):
+	""" Throughput ratios measured in the same run, keyed by name
+
+	'<batch>/<configuration>' is the batch speedup over the scalar workload,
+	'<workload>/history' the throughput with the default history over
+	history='off'. Ratios whose workloads were not both run are left out.
+	"""
+	found = {}
+	def ratio(name,a,b):
+		if a in results and b in results and results[a]['scale'] == results[b]['scale']:
+			found[name] = results[a]['units_per_second']/results[b]['units_per_second']
+	for batch,scalar in BATCH_RATIOS:
+		for configuration in CONFIGURATIONS:
+			ratio(key(batch,configuration),key(batch,configuration),key(scalar,configuration))
+	for name in WORKLOADS:
+		ratio(key(name,'history'),key(name,'default'),key(name,'history_off'))
+	return found
+
+def format_result(name,result):
+	memory = '-' if result['peak_memory'] is None else '{:.1f} kB'.format(result['peak_memory']/1e3)
+	return '{0:<30} {1:>10.3f} s {2:>12.0f} units/s {3:>12} bytes  peak {4}'.format(
+		name,result['seconds'],result['units_per_second'],result['output_bytes'],memory)
+
+def format_ratios(found):
+	return ['{0:<30} {1:>10.2f}x'.format(name,value) for name,value in sorted(found.items())]
+
+def load_baselines(path=BASELINE_PATH):
+	""" The stored baselines: {'machine':..., 'results':{...}, 'ratios':{...}} """
+	if not os.path.exists(path):
+		return {'machine':None,'results':{},'ratios':{}}
+	with open(path) as f:
+		return json.load(f)
+
+def save_baselines(baselines,path=BASELINE_PATH):
+	with open(path,'w') as f:
+		json.dump(baselines,f,indent=2,sort_keys=True)
+		f.write('\n')
+
+def update_baselines(baselines,results):
+	""" Merge new results (and their ratios) into the baselines of this machine """
+	if baselines.get('machine') != machine():
+		# timings from another machine are not comparable with these
+		for result in baselines['results'].values():
+			result['seconds'] = result['units_per_second'] = None
+	baselines['machine'] = machine()
+	baselines['results'].update(results)
+	baselines['ratios'].update(ratios(results))
+	return baselines
+
+def compare(results,baselines,threshold=THRESHOLD):
+	""" Return a list of regression messages (empty when nothing regressed)
+
+	A ratio (batch speedup, history cost) regresses when it drops by more than
+	threshold (relative), and so does the throughput of a workload when the
+	baselines were recorded on this machine. Peak memory and output size regress
+	when they grow by more than threshold. Baselines measured at another scale
+	are skipped.
+	"""
+	regressions = []
+	same_machine = baselines.get('machine') == machine()
+	stored = baselines.get('results',{})
+	scales = dict((name,result['scale']) for name,result in results.items())
+	for name,value in sorted(ratios(results).items()):
+		base = baselines.get('ratios',{}).get(name)
+		measured = key(name.split('/')[0],'default')
+		if base is None or stored.get(measured,{}).get('scale') != scales.get(measured):
+			continue
+		if value < base*(1.-threshold):
+			regressions.append('{0}: ratio {1:.2f}x vs baseline {2:.2f}x'.format(name,value,base))
+	for name,result in sorted(results.items()):
+		base = stored.get(name)
+		if base is None or base.get('scale') != result['scale']:
+			continue
+		if same_machine and base.get('units_per_second') is not None and result['units_per_second'] < base['units_per_second']*(1.-threshold):
+			regressions.append('{0}: throughput {1:.0f} units/s vs baseline {2:.0f}'.format(name,result['units_per_second'],base['units_per_second']))
+		for metric,slack in (('peak_memory',MEMORY_SLACK),('output_bytes',0)):
+			if result[metric] is None or base.get(metric) is None:
+				continue
+			if result[metric] > base[metric]*(1.+threshold) + slack:
+				regressions.append('{0}: {1} {2} vs baseline {3}'.format(name,metric,result[metric],base[metric]))
+	return regressions
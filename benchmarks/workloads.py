@@ -0,0 +1,79 @@
+import math
+from config import *
+
+"""
+Benchmark workloads. Every workload is build(g, scale) and returns the number
+of work units it generated (moves, wells, rings...), used for the throughput.
+scale shrinks or grows the workload for quick runs.
+"""
+
+def small_moves(g,scale=1.0):
+	""" 1M small relative moves, one G.move call each """
+	n = int(1000000*scale)
+	for i in range(n):
+		g.move(x=0.01 if i % 2 == 0 else -0.01,e=0.001)
+	return n
+
+def small_moves_batch(g,scale=1.0):
+	""" The same 1M small relative moves through G.move_many """
+	n = int(1000000*scale)
+	x = [0.01 if i % 2 == 0 else -0.01 for i in range(n)]
+	g.move_many(x=x,e=[0.001]*n)
+	return n
+
+def _dispense_plate(g,plate,scale,plates=20,well_volume=25,z_lift=15,travel_rate=1000,rates=(1,5,10)):
+	# well after well, in the style of 96wellDepositionExperiment.py (serpentine rows)
+	rows,columns = WELL_PLATE_LAYOUT[plate]
+	ctc = WELL_PLATE_PITCH[plate]
+	wells = 0
+	for _ in range(max(1,int(round(plates*scale)))):
+		for row in range(rows):
+			direction = -1 if row % 2 == 0 else 1
+			for column in range(columns):
+				g.set_feedrate(rates[wells % len(rates)],extrusionunit='mL/min')
+				g.move(e=well_volume,extrusionunit='uL')
+				g.set_feedrate(travel_rate)
+				g.move(z=-z_lift)
+				if column != columns-1:
+					g.move(x=direction*ctc)
+				elif row != rows-1:
+					g.move(y=-ctc)
+				g.move(z=z_lift)
+				g.print_blank_line()
+				wells += 1
+		# back to A1 for the next plate
+		g.move(x=(columns-1)*ctc if rows % 2 == 1 else 0.0,y=(rows-1)*ctc)
+	return wells
+
+def plate_96(g,scale=1.0):
+	""" Full 96-well dispense plates (20 of them) """
+	return _dispense_plate(g,'96-well plate',scale)
+
+def plate_384(g,scale=1.0):
+	""" Full 384-well dispense plates (20 of them) """
+	return _dispense_plate(g,'384-well plate',scale)
+
+def disc(g,scale=1.0):
+	""" print_disc with thousands of rings """
+	rings = int(3000*scale)
+	step = 0.1
+	g.print_disc(1.+step*(rings-1),1.,step,0.2)
+	return rings
+
+def mixed(g,scale=1.0):
+	""" Alternating circular_move and move calls """
+	n = int(20000*scale)
+	for i in range(n):
+		g.circular_move(2.+(i % 10)*0.5,e=0.5)
+		g.move(x=0.3,y=-0.2,e=0.05)
+		g.move(z=0.1 if i % 2 == 0 else -0.1)
+	return n
+
+WORKLOADS = {
+	'small_moves':small_moves,
+	'small_moves_batch':small_moves_batch,
+	'plate_96':plate_96,
+	'plate_384':plate_384,
+	'disc':disc,
+	'mixed':mixed,
+}
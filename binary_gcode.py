@@ -0,0 +1,276 @@
+import math
+import struct
+from config import *
+from toolpath import (Toolpath,AXIS_BITS,OP_RAW,OP_MOVE,OP_ARC_CW,OP_ARC_CCW,OP_FEED,OP_RELATIVE,OP_ABSOLUTE,OP_STEPS)
+
+"""
+Compact binary encoding of a Toolpath (see toolpath.py).
+
+Every row becomes one opcode byte followed by its operands:
+- the low three bits are the toolpath op code, the others flag a new string, a
+  new feedrate or new arc offsets
+- moves add one byte with the mask of the axes they specify, then one integer
+  per axis (so a G1 X Y E is two bytes plus three integers)
+- axis deltas are integer motor steps, zigzag + varint encoded: the small
+  relative moves of a program take one or two bytes per axis
+- feedrates and arc offsets are float64, changed only when they differ from the
+  previous value (a feedrate that did not change costs nothing)
+- text lines (comments, headers) go through a string table, so a line that was
+  already seen costs its index only
+
+The header keeps the start state of the toolpath (position, steps/mm, mode,
+feedrate and tool) and the output format (digits, minimal), so decode_lines
+gives back exactly the text G would have written.
+
+File layout: MAGIC, header, records, END.
+
+The binary program is about 5 to 10 times smaller than the text, not an order
+of magnitude across the board: 5.2 kB vs 28.0 kB for 96 wells of the plate_96
+benchmark (5.4x), 33.0 kB vs 343.1 kB for the mixed arc/line benchmark at
+scale 0.05 (10.4x). Compressed with zlib the gap mostly closes (0.7 kB vs
+0.8 kB and 1.2 kB vs 3.6 kB): on disk, a .gcode.gz is often good enough.
+"""
+
+MAGIC = b'GCB2'
+# record flags on top of the op codes (low three bits)
+_NEW_STRING = 8 # OP_RAW with a new string (vs. a reference to the table)
+_NEW_FEED = 16 # the row carries a new feedrate
+_NEW_I = 32 # the arc carries a new I offset
+_NEW_J = 64 # the arc carries a new J offset
+_END = 128 # end of the records, outside every op code and flag combination
+
+_DOUBLE = struct.Struct('<d')
+
+# ---------- Primitives ---------- #
+def _zigzag(value):
+	return (value << 1) if value >= 0 else ((-value << 1) - 1)
+
+def _unzigzag(value):
+	return (value >> 1) if not value & 1 else -((value+1) >> 1)
+
+def _varint(out,value):
+	while value > 0x7f:
+		out.append((value & 0x7f) | 0x80)
+		value >>= 7
+	out.append(value)
+
+def _string(out,text):
+	data = text.encode('utf-8')
+	_varint(out,len(data))
+	out.extend(data)
+
+class _Reader(object):
+	def __init__(self,data):
+		self.data = bytearray(data)
+		self.pos = 0
+
+	def byte(self):
+		value = self.data[self.pos]
+		self.pos += 1
+		return value
+
+	def varint(self):
+		data = self.data
+		pos = self.pos
+		shift = 0
+		value = 0
+		while True:
+			b = data[pos]
+			pos += 1
+			value |= (b & 0x7f) << shift
+			if b < 0x80:
+				break
+			shift += 7
+		self.pos = pos
+		return value
+
+	def double(self):
+		value = _DOUBLE.unpack_from(bytes(self.data[self.pos:self.pos+8]))[0]
+		self.pos += 8
+		return value
+
+	def string(self):
+		n = self.varint()
+		text = bytes(self.data[self.pos:self.pos+n]).decode('utf-8')
+		self.pos += n
+		return text
+
+# ---------- Encoding ---------- #
+def encode(toolpath,digits=4,minimal=False):
+	""" Encode a toolpath to bytes """
+	out = bytearray(MAGIC)
+	_varint(out,digits)
+	out.append(1 if minimal else 0)
+	for axes in AXES:
+		_varint(out,_zigzag(toolpath.start_position[axes]))
+		out.extend(_DOUBLE.pack(toolpath.start_steps_per_mm[axes]))
+	out.append({None:2,True:1,False:0}[toolpath.start_relative])
+	out.extend(_DOUBLE.pack(float('nan') if toolpath.start_speed is None else toolpath.start_speed))
+	_varint(out,toolpath.start_tool)
+	strings = {}
+	feed = None
+	i = j = 0.0
+	delta = [toolpath.delta[axes] for axes in AXES]
+	bits = [AXIS_BITS[axes] for axes in AXES]
+	for k in range(len(toolpath.op)):
+		op = toolpath.op[k]
+		f = toolpath.feed[k]
+		flag = 0
+		if f != feed and (feed is not None or not math.isnan(f)):
+			flag = _NEW_FEED
+		if op == OP_RAW:
+			text = toolpath.extra[toolpath.aux[k]]
+			index = strings.get(text)
+			if index is None:
+				strings[text] = len(strings)
+				out.append(op | _NEW_STRING | flag)
+				_string(out,text)
+			else:
+				out.append(op | flag)
+				_varint(out,index)
+		elif op == OP_MOVE or op == OP_ARC_CW or op == OP_ARC_CCW:
+			mask = toolpath.mask[k]
+			arc = op != OP_MOVE
+			# arcs also say whether I and J changed
+			if arc:
+				out.append(op | flag | (_NEW_I if toolpath.i[k] != i else 0) | (_NEW_J if toolpath.j[k] != j else 0))
+			else:
+				out.append(op | flag)
+			out.append(mask)
+			for n,b in enumerate(bits):
+				if mask & b:
+					_varint(out,_zigzag(delta[n][k]))
+			if arc:
+				if toolpath.i[k] != i:
+					i = toolpath.i[k]
+					out.extend(_DOUBLE.pack(i))
+				if toolpath.j[k] != j:
+					j = toolpath.j[k]
+					out.extend(_DOUBLE.pack(j))
+		elif op == OP_STEPS:
+			values,comment = toolpath.extra[toolpath.aux[k]]
+			out.append(op | flag)
+			mask = 0
+			for axes in values:
+				mask |= AXIS_BITS[axes]
+			out.append(mask)
+			for axes in AXES:
+				if axes in values:
+					out.extend(_DOUBLE.pack(values[axes]))
+			if comment is None:
+				out.append(0)
+			else:
+				out.append(1)
+				_string(out,comment)
+		else: # OP_FEED, OP_RELATIVE, OP_ABSOLUTE
+			out.append(op | flag)
+		if flag:
+			feed = f
+			out.extend(_DOUBLE.pack(f))
+	out.append(_END)
+	return bytes(out)
+
+def write(toolpath,target,digits=4,minimal=False):
+	""" Encode a toolpath to a path (gzip-compressed if it ends in .gz) or a binary stream """
+	data = encode(toolpath,digits,minimal)
+	if hasattr(target,'write'):
+		target.write(data)
+	else:
+		with _open(target,'wb') as f:
+			f.write(data)
+	return len(data)
+
+# ---------- Decoding ---------- #
+def decode(data):
+	""" Decode bytes to (toolpath, digits, minimal) """
+	if bytes(bytearray(data)[:len(MAGIC)]) != MAGIC:
+		raise RuntimeError('Not a binary G-code stream.')
+	r = _Reader(data)
+	r.pos = len(MAGIC)
+	digits = r.varint()
+	minimal = r.byte() == 1
+	position = {}
+	steps_per_mm = {}
+	for axes in AXES:
+		position[axes] = _unzigzag(r.varint())
+		steps_per_mm[axes] = r.double()
+	relative = {2:None,1:True,0:False}[r.byte()]
+	speed = r.double()
+	speed = None if math.isnan(speed) else speed
+	tool = r.varint()
+	toolpath = Toolpath(position,steps_per_mm,relative,speed,tool)
+	strings = []
+	feed = float('nan')
+	i = j = 0.0
+	while True:
+		code = r.byte()
+		if code == _END:
+			break
+		op = code & 7
+		if op == OP_RAW:
+			if code & _NEW_STRING:
+				text = r.string()
+				strings.append(text)
+			else:
+				text = strings[r.varint()]
+			row = (OP_RAW,0,None,0.0,0.0,text)
+		elif op == OP_MOVE or op == OP_ARC_CW or op == OP_ARC_CCW:
+			mask = r.byte()
+			deltas = {}
+			for axes in AXES:
+				if mask & AXIS_BITS[axes]:
+					deltas[axes] = _unzigzag(r.varint())
+			if op != OP_MOVE:
+				if code & _NEW_I:
+					i = r.double()
+				if code & _NEW_J:
+					j = r.double()
+			row = (op,mask,deltas,i if op != OP_MOVE else 0.0,j if op != OP_MOVE else 0.0,None)
+		elif op == OP_STEPS:
+			mask = r.byte()
+			values = {}
+			for axes in AXES:
+				if mask & AXIS_BITS[axes]:
+					values[axes] = r.double()
+			comment = r.string() if r.byte() == 1 else None
+			row = (OP_STEPS,0,None,0.0,0.0,(values,comment))
+		else:
+			row = (op,0,None,0.0,0.0,None)
+		if code & _NEW_FEED:
+			feed = r.double()
+		toolpath._append(row[0],feed,row[1],row[2],row[3],row[4],row[5])
+	return toolpath,digits,minimal
+
+def read(source):
+	""" Decode a path (gzip-compressed if it ends in .gz) or a binary stream """
+	if hasattr(source,'read'):
+		return decode(source.read())
+	with _open(source,'rb') as f:
+		return decode(f.read())
+
+def decode_lines(source):
+	""" The G-code text lines of a binary program (path, stream or bytes) """
+	if isinstance(source,(bytes,bytearray)):
+		toolpath,digits,minimal = decode(source)
+	else:
+		toolpath,digits,minimal = read(source)
+	return toolpath.lines(digits,minimal)
+
+def _open(path,mode):
+	if path.endswith('.gz'):
+		import gzip
+		return gzip.open(path,mode)
+	return open(path,mode)
+
+if __name__ == "__main__":
+	import argparse
+	import sys
+	parser = argparse.ArgumentParser(description='Decode a binary G-code program (.gcb or .gcb.gz) to text.')
+	parser.add_argument('file')
+	parser.add_argument('-o','--output',help='text file to write (default: stdout)')
+	options = parser.parse_args()
+	out = open(options.output,'w') if options.output else sys.stdout
+	for line in decode_lines(options.file):
+		out.write(line+'\n')
+	if options.output:
+		out.close()
@@ -0,0 +1,108 @@
+import copy
+from history import PositionHistory
+
+"""
+Snapshots and forks of a G, to generate program variants without starting over.
+
+A snapshot holds the whole state of a generator: position, max_e_position,
+counters, modal state (positioning mode, feedrate, steps/mm, active tool) and
+the output written so far. The small mutable parts (position and steps/mm
+dicts, tools, flow statistics) are copied; they have a fixed size (the flow
+statistics are eight running totals, not the moves), so copying them costs
+the same at any point of the program. The position history and the
+output of a MemorySink are shared by reference, since they are only ever
+appended to (see history.py and sinks.py). Taking a snapshot, restoring it or
+forking a 500k-line program therefore costs the same as for an empty one.
+
+A toolpath being recorded is the exception: the snapshot only keeps it and its
+length (recording only appends rows), but restoring or forking copies the rows
+recorded up to the snapshot (as typed arrays), so it costs time proportional
+to the toolpath. Output written to a file can be rewound (the file is
+truncated) but not forked: a fork of such a generator needs its own output.
+Instrumentation is not carried over to forks.
+
+Example
+-------
+g = G(output=MemorySink())
+layout.compile(g)
+checkpoint = g.snapshot()
+g.move(e=-2) # variant A: retract
+a = g.output.getvalue()
+g.restore(checkpoint)
+b = g.fork() # variant B from the same point, g is left untouched
+b.move(z=-15)
+"""
+
+# state handled separately from the plain attributes
+_SPECIAL = ('_history','output','_toolpath','instrumentation','profile')
+
+def _copy_value(key,value):
+	if key in ('_current_position','mm_to_steps','steps_to_mm'):
+		return dict(value)
+	if key == 'tools':
+		return [copy.copy(tool) for tool in value]
+	if key == 'flow_statistics':
+		return value.copy()
+	return value
+
+class Snapshot(object):
+	"""State of a G at one point of its program"""
+	def __init__(self,g):
+		cls = type(g)
+		# instance attributes that shadow methods are instrumentation wrappers
+		self.state = dict((key,_copy_value(key,value)) for key,value in g.__dict__.items()
+			if key not in _SPECIAL and not hasattr(cls,key))
+		self.history = g._history.snapshot()
+		# rows recorded after the snapshot are appended past the mark
+		self.toolpath = (g._toolpath,g._toolpath.mark()) if g._toolpath is not None else None
+		self.sink = g.output
+		try:
+			self.output = g.output.snapshot()
+		except RuntimeError:
+			self.output = None # the sink cannot be rewound, forks need their own
+
+	def _apply(self,g):
+		for key,value in self.state.items():
+			g.__dict__[key] = _copy_value(key,value)
+		g._history.restore(self.history)
+		if self.toolpath is not None:
+			toolpath,mark = self.toolpath
+			g._toolpath = toolpath.copy(mark)
+		else:
+			g._toolpath = None
+
+def restore(g,snapshot):
+	""" Bring g back to a snapshot taken on it """
+	if snapshot.sink is not g.output:
+		raise RuntimeError('The snapshot was taken on another output.')
+	if snapshot.output is None:
+		raise RuntimeError('{} cannot be rewound.'.format(type(g.output).__name__))
+	snapshot._apply(g)
+	g.output.restore(snapshot.output)
+
+def fork(g,output=None,snapshot=None):
+	""" A new G continuing from the current state of g (or from a snapshot of it)
+	Parameters
+	-----------
+	g : G
+		Generator to branch from
+	output : Sink (default: None)
+		Output of the fork. By default a fork of the output of g, which shares
+		the lines written so far (MemorySink and NullSink only); a given sink
+		only receives what the fork writes from now on.
+	snapshot : Snapshot (default: None)
+		Branch from this snapshot of g instead of its current state
+	"""
+	if snapshot is None:
+		snapshot = Snapshot(g)
+	if output is None:
+		if snapshot.output is None:
+			raise RuntimeError('{} cannot be forked: give the branch its own output.'.format(type(snapshot.sink).__name__))
+		output = snapshot.sink.fork(snapshot.output)
+	branch = type(g).__new__(type(g))
+	branch._history = PositionHistory(g._history.axes,g._history.mode,g._history.maxlen)
+	snapshot._apply(branch)
+	branch.output = output
+	branch.instrumentation = None
+	branch.profile = None
+	return branch
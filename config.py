@@ -1,15 +1,19 @@
 import math
+import sys
+import hardware
 # Configuration file
 # Set some basic print characteristics up here
 MOTION_AXES = ['X','Y','Z']
 EXTRUSION_AXES = ['E']
 # All axes
 AXES = tuple(MOTION_AXES + EXTRUSION_AXES)
-# number of steps per mm for X,Y,Z,E axes
-DEFAULT_AXIS_STEPS_PER_MM = (80.0,80.0,400.0,3540)
-MOTOR_STEP_ANGLE = 1.8 # in degree
-MICROSTEPPING = 16
-STEPS_PER_REVOLUTION =int(MICROSTEPPING*360/MOTOR_STEP_ANGLE)
+# Hardware profiles (syringes, tips, printers, pipets, well plates) are read
+# from the data files in profiles/, see hardware.py
+PRINTER = "default"
+PLANNER_LOOKAHEAD = 16 # number of moves in the firmware planner buffer
+ARC_SEGMENT_LENGTH = 1.0 # mm, length of the segments the firmware splits G2/G3 into
+TOOL_CHANGE_TIME = 10.0 # s, estimated duration of a tool change (T command)
+DISPENSE_RATE = 1.0 # mL/min, dispense rate of well specs without one (the slowest rate of 96wellDepositionExperiment.py)
 
 # Choose tip type
 TIP = "JG24-1.25TTX"
@@ -17,14 +21,10 @@ TIP = "JG24-1.25TTX"
 # Choose well plate 
 WELL_PLATE = "48-well plate"
 
-# Calculated statistics
-# Minimum travel distance for each axes
-MM_PER_STEP = tuple([1./axes for axes in DEFAULT_AXIS_STEPS_PER_MM])
-
-# Syringe and tip database (dictionaries)
-SYRINGE_DIAMETER = {"BD-1ml":4.78,"BD-3ml":8.66,"BD-5ml":12.06,"BD-10ml":14.5} # mm
-SYRINGE_WASTE_SPACE = {"BD-1ml":0.07,"BD-3ml":0.07,"BD-5ml":0.075,"BD-10ml":0.10} # ml
-TIP_ID = {"JG24-1.25TTX":0.330,"JG22-1.25TTX":0.430} # mm
+# Syringe and tip database (read-only name -> value tables over profiles/)
+SYRINGE_DIAMETER = hardware.ProfileTable('syringes','diameter') # mm
+SYRINGE_WASTE_SPACE = hardware.ProfileTable('syringes','waste_volume') # ml
+TIP_ID = hardware.ProfileTable('tips','inner_diameter') # mm
 """To calculate the void volume of a tip
 # 1. Weigh out 1 ml of water (record density)
 # 2. Weigh out the tip
@@ -33,19 +33,57 @@ TIP_ID = {"JG24-1.25TTX":0.330,"JG22-1.25TTX":0.430} # mm
 # 5. Calculate the difference and subtract the weight of the tip
 # 6. Divide by the density of the water to calculate the volume in the tip
 """
-TIP_VOID_VOLUME = {"JG24-1.25TTX":0.15,"JG22-1.25TTX":0.13} # ml
-
-# Well plate dimensions
+TIP_VOID_VOLUME = hardware.ProfileTable('tips','void_volume') # ml
 
+# Well plate dimensions (ANSI/SLAS footprint, 127.76 x 85.48 mm)
+WELL_PLATE_LAYOUT = hardware.ProfileTable('plates',('rows','columns')) # rows, columns
+WELL_PLATE_PITCH = hardware.ProfileTable('plates','pitch') # mm, centre to centre
+WELL_PLATE_A1_OFFSET = hardware.ProfileTable('plates','a1_offset') # mm, A1 centre from the left and top edges
+WELL_PLATE_DEPTH = hardware.ProfileTable('plates','depth') # mm
 
-# Tip calculated dimensions
-TIP_CROSS_SECTIONAL_DIAMETER = TIP_ID[TIP] # mm
-TIP_CROSS_SECTIONAL_AREA = math.pi*(TIP_CROSS_SECTIONAL_DIAMETER/2)**2 # uL/mm
 
 # Environmental parameters
 SAP = 14.692 # psi
 
 # Vessel printing
 PIPET = "VWR-1ml"
-PIPET_OD = {"VWR-1ml":4.9} # mm
+PIPET_OD = hardware.ProfileTable('pipets','outer_diameter') # mm
+
+# Printer and tip constants, read from the profiles on first use
+def printer_profile():
+	""" Profile of PRINTER: steps/mm, microstepping, step angle, planner limits (see hardware.py) """
+	return hardware.printer(PRINTER)
+
+def tip_profile():
+	""" Profile of TIP """
+	return hardware.tip(TIP)
+
+# constants of earlier versions, computed when they are first looked up
+_DERIVED = {
+	'DEFAULT_AXIS_STEPS_PER_MM':lambda: printer_profile().steps_per_mm, # steps/mm of the X,Y,Z,E axes
+	'MOTOR_STEP_ANGLE':lambda: printer_profile().step_angle, # degree
+	'MICROSTEPPING':lambda: printer_profile().microstepping,
+	'STEPS_PER_REVOLUTION':lambda: printer_profile().steps_per_revolution,
+	'DEFAULT_MAX_ACCELERATION':lambda: printer_profile().max_acceleration, # mm/s^2
+	'DEFAULT_MAX_JERK':lambda: printer_profile().max_jerk, # mm/s
+	'MM_PER_STEP':lambda: printer_profile().mm_per_step, # minimum travel distance of each axis
+	'TIP_CROSS_SECTIONAL_DIAMETER':lambda: tip_profile().inner_diameter, # mm
+	'TIP_CROSS_SECTIONAL_AREA':lambda: tip_profile().cross_section, # mm^2
+}
+
+def __getattr__(name):
+	# module attributes looked up lazily (Python 3.7+)
+	if name in _DERIVED:
+		return _DERIVED[name]()
+	raise AttributeError("module 'config' has no attribute '{}'".format(name))
+
+def __dir__():
+	return sorted(set(globals()) | set(_DERIVED))
+
+if sys.version_info < (3,7): # no module __getattr__: compute them now
+	for _name,_value in _DERIVED.items():
+		globals()[_name] = _value()
 
+# everything import * exported before, and the derived constants (resolved by
+# __getattr__ when they are imported)
+__all__ = sorted(set(name for name in globals() if not name.startswith('_')) | set(_DERIVED))
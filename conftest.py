@@ -0,0 +1,47 @@
+import pytest
+from main import G
+from sinks import MemorySink
+
+"""
+Shared fixtures of the test suite.
+
+make_g builds a G writing to a MemorySink (unless output is given) and runs
+program steps on it; program is a sample program going through moves in mm
+and uL, a disc, an arc, absolute positioning, redundant feedrates and mode
+toggles, collinear moves, a square and a retraction.
+"""
+
+def sample_program(g):
+	g.move(e=5)
+	g.move(x=5,y=5,e=1.01,extrusionunit='uL')
+	g.print_disc(5,1,0.5,0.1)
+	g.arc_move(3,0,90,e=0.3)
+	g.absolute()
+	g.move(x=1,y=2,e=3)
+	g.relative()
+	g.absolute()
+	g.relative()
+	g.set_feedrate(5,'mL/min')
+	g.set_feedrate(5,'mL/min')
+	g.move(y=1,e=0.2)
+	g.move(y=1,e=0.2)
+	g.set_feedrate(1000)
+	g.print_square(10,0.2)
+	g.move(e=-2)
+
+def generator(*steps,**options):
+	""" A G (on a new MemorySink by default) after running steps, callables taking the G """
+	if 'output' not in options:
+		options['output'] = MemorySink()
+	g = G(**options)
+	for step in steps:
+		step(g)
+	return g
+
+@pytest.fixture
+def program():
+	return sample_program
+
+@pytest.fixture
+def make_g():
+	return generator
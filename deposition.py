@@ -0,0 +1,271 @@
+import math
+import numpy as np
+from config import *
+import arcs
+
+"""
+Deposition simulator: where the material of a program ends up.
+
+The recorded position history of a G (in motor steps) is replayed as the path
+the head really takes: linear moves are straight segments, circular moves are
+split into the chords the firmware uses (see arcs.py), rebuilt from the arc
+geometry kept in the history. The volume every move extrudes is computed like G
+does it (only E beyond the furthest position reached counts, so a retraction
+followed by the same push does not deposit twice; every tool has its own
+syringe and its own furthest position, see tools.py) and spread along its path
+in proportion to length.
+
+The path is then sampled at half the grid resolution and the samples are
+accumulated into a 2D (X, Y) or 3D (X, Y, Z) grid with one bincount, so a
+program of millions of moves is checked in a few seconds. Coordinates are in
+mm from where G started (the tip over A1 for plate programs), with the
+machine's axis directions (negative Z is up).
+
+Example
+-------
+g = G(output=NullSink())
+layout.compile(g)
+result = simulate(g,resolution=0.5)
+print(result.well_volumes(layout))
+result.save('plate.npz')
+"""
+
+# samples are buffered by batches of this size while they are accumulated
+SAMPLE_BATCH = 1000000
+
+def path_segments(history,steps_to_mm,segment_length=ARC_SEGMENT_LENGTH):
+	""" Straight segments followed between the recorded positions
+	Parameters
+	-----------
+	history : HistoryView
+		Position history of a G (g.position_history)
+	steps_to_mm : dict
+		mm per step of every axis (g.steps_to_mm)
+	segment_length : float (default: ARC_SEGMENT_LENGTH)
+		Length of the chords circular moves are split into (mm)
+
+	Returns (start, end, move): (n,3) XYZ start and end points (mm) and, for
+	every segment, the index of the recorded position that ends its move.
+	"""
+	positions = np.column_stack([np.asarray(history[axes],dtype=float)*steps_to_mm[axes] for axes in MOTION_AXES])
+	n = len(positions)
+	if n < 2:
+		return np.zeros((0,3)),np.zeros((0,3)),np.zeros(0,dtype=np.int64)
+	counts = np.ones(n,dtype=np.int64)
+	counts[0] = 0
+	index,i,j,sweep = [np.asarray(values) for values in history.arcs()]
+	index = index.astype(np.int64)
+	keep = index > 0 # the first position has no start point to rebuild the arc from
+	index,i,j,sweep = index[keep],i[keep].astype(float),j[keep].astype(float),sweep[keep].astype(float)
+	radius = np.hypot(i,j)
+	if len(index):
+		counts[index] = arcs.segment_count(radius,sweep,segment_length)
+	move = np.repeat(np.arange(n),counts)
+	end = positions[move]
+	if len(index):
+		# chord points of every arc, except its last one which is the recorded end
+		first = np.cumsum(counts)-counts
+		step = np.arange(len(move)) - first[move] + 1 # 1..count within the move
+		arc_of = np.full(n,-1,dtype=np.int64)
+		arc_of[index] = np.arange(len(index))
+		rows = np.nonzero((arc_of[move] >= 0) & (step < counts[move]))[0]
+		k = arc_of[move[rows]]
+		origin = positions[index-1]
+		centre = origin[:,:2] + np.column_stack((i,j))
+		a0 = np.arctan2(-j,-i)
+		t = step[rows]/counts[index][k].astype(float)
+		angle = a0[k] + sweep[k]*t
+		end[rows,0] = centre[k,0] + radius[k]*np.cos(angle)
+		end[rows,1] = centre[k,1] + radius[k]*np.sin(angle)
+		end[rows,2] = origin[k,2] + (positions[index[k],2]-origin[k,2])*t
+	start = np.vstack((positions[:1],end[:-1]))
+	return start,end,move
+
+def move_tools(history):
+	""" Tool that made every recorded move (see PositionHistory.tools) """
+	index,tools = history.tools()
+	n = len(history[AXES[0]])
+	tool = np.full(n,tools[0],dtype=np.int64)
+	for first,number in zip(index[1:],tools[1:]):
+		tool[first:] = number
+	return tool
+
+def move_volumes(history,steps_to_mm,cross_section):
+	""" Volume (uL) extruded by every recorded move (0 for the first position)
+	Parameters
+	-----------
+	history : HistoryView
+		Position history of a G (g.position_history)
+	steps_to_mm : dict
+		mm per step of every axis (g.steps_to_mm)
+	cross_section : float or list
+		Syringe cross-section (uL/mm), or one per tool (indexed by tool number)
+
+	E is one axis shared by the tools, but a syringe only pushes while its tool
+	is active: every tool counts the E moves it made on its own plunger, from
+	which only the advances past its furthest point extrude (as G.select_tool).
+	"""
+	e = np.asarray(history[EXTRUSION_AXES[0]],dtype=np.int64)
+	if len(e) == 0:
+		return np.zeros(0)
+	ediff = np.diff(e)
+	tool = move_tools(history)[1:]
+	volumes = np.zeros(len(e))
+	for number in np.unique(tool).tolist():
+		moves = np.flatnonzero(tool == number)
+		plunger = np.cumsum(ediff[moves])
+		reached = np.maximum.accumulate(np.concatenate(([0],plunger)))
+		section = cross_section[number] if hasattr(cross_section,'__getitem__') else cross_section
+		volumes[moves+1] = np.diff(reached)*steps_to_mm[EXTRUSION_AXES[0]]*section
+	return volumes
+
+class Deposition(object):
+	"""Deposited volume on a regular grid"""
+	def __init__(self,volume,origin,resolution,total_volume,outside_volume):
+		self.volume = volume # uL per cell
+		self.origin = origin # mm, corner of the first cell
+		self.resolution = resolution # mm
+		self.total_volume = total_volume # uL extruded by the program
+		self.outside_volume = outside_volume # uL that fell outside the grid
+
+	@property
+	def dims(self):
+		return self.volume.ndim
+
+	def coordinates(self):
+		""" Cell centres (mm) along every axis of the grid """
+		return [self.origin[k] + self.resolution*(np.arange(size)+0.5) for k,size in enumerate(self.volume.shape)]
+
+	def occupancy(self,threshold=0.0):
+		""" Cells that received more than threshold uL """
+		return self.volume > threshold
+
+	def region_volume(self,low,high):
+		""" Volume (uL) in the cells whose centres lie within low <= x < high (per axis, mm) """
+		selection = []
+		for k,centres in enumerate(self.coordinates()):
+			if k < len(low):
+				selection.append((centres >= low[k]) & (centres < high[k]))
+			else:
+				selection.append(np.ones(len(centres),dtype=bool))
+		return float(self.volume[np.ix_(*selection)].sum())
+
+	def well_volumes(self,layout,wells=None):
+		""" Volume (uL) landed in every well of a plate Layout (a pitch-wide square around its centre)
+		Parameters
+		-----------
+		layout : Layout
+			Plate layout the program was compiled from (see plate_layout.py)
+		wells : list (default: None)
+			Wells to measure, by default the assigned ones
+		"""
+		if wells is None:
+			wells = [well for well,_ in layout.assignments]
+		half = layout.plate.pitch/2.
+		volumes = {}
+		for well in wells:
+			x,y = layout.offset(well)
+			volumes[well] = self.region_volume((x-half,y-half),(x+half,y+half))
+		return volumes
+
+	def save(self,path):
+		""" Write the grid and its frame to a compressed .npz file """
+		np.savez_compressed(path,volume=self.volume,origin=np.asarray(self.origin),resolution=self.resolution,
+			total_volume=self.total_volume,outside_volume=self.outside_volume)
+
+def load(path):
+	""" Read a Deposition written by Deposition.save """
+	data = np.load(path)
+	return Deposition(data['volume'],tuple(data['origin'].tolist()),float(data['resolution']),float(data['total_volume']),float(data['outside_volume']))
+
+def simulate(g,resolution=0.5,dims=2,bounds=None,segment_length=ARC_SEGMENT_LENGTH,cross_section=None):
+	""" Rasterize the volume extruded by a program
+	Parameters
+	-----------
+	g : G
+		Generator with a 'full' or 'ring' position history
+	resolution : float (default: 0.5)
+		Cell size (mm)
+	dims : int (default: 2)
+		2 for an X, Y grid, 3 for X, Y, Z
+	bounds : sequence of (low, high) (default: None)
+		Extent of the grid (mm) along each axis, by default the extruding path
+	segment_length : float (default: ARC_SEGMENT_LENGTH)
+		Length of the chords of circular moves (mm)
+	cross_section : float or list (default: None)
+		Syringe cross-section (uL/mm), or one per tool, by default the ones of
+		the tools of g
+
+	The step sizes in use at the end of the program are used for the whole history.
+	"""
+	if dims not in (2,3):
+		raise RuntimeError('The deposition grid has 2 or 3 dimensions.')
+	if resolution <= 0.0:
+		raise RuntimeError('Grid resolution must be positive.')
+	history = g.position_history
+	if len(history[AXES[0]]) == 0:
+		raise RuntimeError('The position history is off: nothing to simulate.')
+	if cross_section is None:
+		cross_section = [tool.syringe_cross_section for tool in g.tools]
+	volumes = move_volumes(history,g.steps_to_mm,cross_section)
+	total = float(volumes.sum())
+	start,end,move = path_segments(history,g.steps_to_mm,segment_length)
+	start = start[:,:dims]
+	end = end[:,:dims]
+	# volume of every segment, in proportion to its share of the move's path
+	length = np.sqrt(((end-start)**2).sum(axis=1))
+	move_length = np.bincount(move,weights=length,minlength=len(volumes))
+	segments_per_move = np.bincount(move,minlength=len(volumes))
+	with np.errstate(divide='ignore',invalid='ignore'):
+		share = np.where(move_length[move] > 0.0,length/move_length[move],1.0/segments_per_move[move])
+	seg_volume = volumes[move]*share
+	extruding = seg_volume > 0.0
+	start = start[extruding]
+	end = end[extruding]
+	length = length[extruding]
+	seg_volume = seg_volume[extruding]
+
+	if bounds is None:
+		if len(seg_volume):
+			low = np.minimum(start.min(axis=0),end.min(axis=0)) - resolution
+			high = np.maximum(start.max(axis=0),end.max(axis=0)) + resolution
+		else:
+			low = np.zeros(dims)
+			high = np.full(dims,resolution)
+	else:
+		if len(bounds) != dims:
+			raise RuntimeError('Bounds must give (low, high) for {} axes.'.format(dims))
+		low = np.array([float(b[0]) for b in bounds])
+		high = np.array([float(b[1]) for b in bounds])
+	shape = tuple(np.maximum(1,np.ceil((high-low)/resolution)).astype(np.int64).tolist())
+	grid = np.zeros(int(np.prod(shape)))
+
+	# samples every half cell along each segment
+	samples = np.maximum(1,np.ceil(length/(0.5*resolution))).astype(np.int64)
+	inside_volume = 0.0
+	first = 0
+	while first < len(samples):
+		# take as many segments as fit in one batch of samples (at least one)
+		cumulative = np.cumsum(samples[first:first+SAMPLE_BATCH])
+		last = first + max(1,int(np.searchsorted(cumulative,SAMPLE_BATCH,side='right')))
+		count = samples[first:last]
+		seg = np.repeat(np.arange(first,last),count)
+		offset = np.cumsum(count)-count
+		t = (np.arange(len(seg)) - np.repeat(offset,count) + 0.5)/np.repeat(count,count)
+		points = start[seg] + (end[seg]-start[seg])*t[:,None]
+		weights = seg_volume[seg]/np.repeat(count,count)
+		cells = np.floor((points-low)/resolution).astype(np.int64)
+		inside = np.all((cells >= 0) & (cells < np.array(shape)),axis=1)
+		flat = np.ravel_multi_index(tuple(cells[inside].T),shape)
+		grid += np.bincount(flat,weights=weights[inside],minlength=len(grid))
+		inside_volume += float(weights[inside].sum())
+		first = last
+	return Deposition(grid.reshape(shape),tuple(low.tolist()),resolution,total,total-inside_volume)
+
+if __name__ == "__main__":
+	from main import G
+	from sinks import NullSink
+	g = G(output=NullSink(),diagnostics='off')
+	g.print_disc(10,2,0.5,0.2)
+	result = simulate(g,resolution=0.25)
+	print('{0} cells | {1:.3f} uL deposited | {2:.3f} uL outside'.format(result.volume.shape,result.volume.sum(),result.outside_volume))
@@ -0,0 +1,103 @@
+import math
+
+"""
+Diagnostic verbosity of the G object.
+
+Levels, from quietest to most verbose:
+- 'off'       : no diagnostic comments at all, summary_report writes nothing
+- 'summary'   : only the summary_report at the end of the program
+- 'aggregate' : summary_report plus streaming min/max/mean of the flow rate and
+                filament width of every extruding move (no per-move comments)
+- 'full'      : the extrusion rate, volume and filament comments before every
+                extruding move, the flow rate of every feedrate change and the
+                size of circular paths (the original output)
+
+Below 'aggregate' the per-move flow rate and filament width are not computed at
+all, and below 'full' no diagnostic line is formatted.
+"""
+
+DIAGNOSTIC_LEVELS = ('off','summary','aggregate','full')
+OFF,SUMMARY,AGGREGATE,FULL = range(len(DIAGNOSTIC_LEVELS))
+
+def diagnostic_level(name):
+	""" Numeric level of a diagnostics name """
+	if name not in DIAGNOSTIC_LEVELS:
+		raise RuntimeError('Diagnostics must be one of {}.'.format(', '.join(DIAGNOSTIC_LEVELS)))
+	return DIAGNOSTIC_LEVELS.index(name)
+
+class RunningStatistic(object):
+	""" Streaming count, min, max and mean of a quantity """
+	def __init__(self):
+		self.count = 0
+		self.total = 0.0
+		self.minimum = None
+		self.maximum = None
+
+	def add(self,value):
+		self.count += 1
+		self.total += value
+		if self.minimum is None or value < self.minimum:
+			self.minimum = value
+		if self.maximum is None or value > self.maximum:
+			self.maximum = value
+
+	def add_many(self,values):
+		""" Add an array of values (NumPy) """
+		if len(values) == 0:
+			return
+		self.count += len(values)
+		for v in values.tolist():
+			self.total += v
+		low = float(values.min())
+		high = float(values.max())
+		if self.minimum is None or low < self.minimum:
+			self.minimum = low
+		if self.maximum is None or high > self.maximum:
+			self.maximum = high
+
+	@property
+	def mean(self):
+		return self.total/self.count if self.count else None
+
+	def copy(self):
+		other = RunningStatistic()
+		other.count,other.total,other.minimum,other.maximum = self.count,self.total,self.minimum,self.maximum
+		return other
+
+class FlowStatistics(object):
+	""" Aggregates of the extruding moves: flow rate (uL/s) and filament width (mm) """
+	def __init__(self):
+		self.flow_rate = RunningStatistic()
+		self.filament_width = RunningStatistic()
+
+	def add(self,flowrate,filamentwidth=None):
+		self.flow_rate.add(flowrate)
+		if filamentwidth is not None:
+			self.filament_width.add(filamentwidth)
+
+	def add_many(self,flowrate,filamentwidth):
+		self.flow_rate.add_many(flowrate)
+		self.filament_width.add_many(filamentwidth)
+
+	def copy(self):
+		""" An independent copy (a few numbers, whatever the number of moves) """
+		other = FlowStatistics()
+		other.flow_rate = self.flow_rate.copy()
+		other.filament_width = self.filament_width.copy()
+		return other
+
+	def lines(self,digits=4):
+		""" Comment lines for summary_report """
+		lines = []
+		for label,unit,stat in ((';Flow rate','uL/s',self.flow_rate),(';Filament width','mm',self.filament_width)):
+			if stat.count == 0:
+				lines.append('{0}: no moves'.format(label))
+				continue
+			lines.append('{0} ({1}): min {2:.{digits}f} | mean {3:.{digits}f} | max {4:.{digits}f} over {5} moves'.format(
+				label,unit,stat.minimum,stat.mean,stat.maximum,stat.count,digits=digits))
+		return lines
+
+def filament_width(extruded_volume,path_length,layer_height):
+	""" Width (mm) of the filament laid along path_length, assuming an elliptical section """
+	filamentarea = extruded_volume / path_length # mm^2
+	return 4*filamentarea / math.pi / layer_height
@@ -0,0 +1,157 @@
+import asyncio
+import os
+import time
+from serial_host import checksum,configure_terminal,open_fd
+
+"""
+Simulated Marlin-style printer on a pseudo-terminal, to test SerialHost locally.
+
+The printer listens on the master side of a pty; a host opens `port` (the
+slave side) like a real serial port. It checks line numbers and checksums the
+way Marlin does (Error / Resend / ok), answers "ok" as soon as a command fits
+in its command queue of buffer_size entries, and executes one queued command
+every command_time seconds. Replies can be delayed by latency seconds to
+model the transit time of a USB serial link. The time the queue spends empty
+while the program is still being sent is reported as starvation.
+
+Example
+-------
+async def main():
+	async with FakePrinter(command_time=0.002,corrupt_lines=(10,)) as printer:
+		connection = await open_serial(printer.port)
+		stats = await SerialHost(connection,window=4).send(open('plate.gcode'))
+		print(stats,printer.starved_time)
+"""
+
+class FakePrinter(object):
+	def __init__(self,buffer_size=4,command_time=0.0,latency=0.0,corrupt_lines=()):
+		"""
+		Parameters
+		-----------
+		buffer_size : int (default: 4)
+			Number of commands the firmware can queue (BUFSIZE)
+		command_time : float (default: 0.0)
+			Seconds needed to execute one command
+		latency : float (default: 0.0)
+			Delay of every reply (s)
+		corrupt_lines : sequence of int (default: ())
+			Line numbers that arrive corrupted the first time they are sent
+		"""
+		self.buffer_size = buffer_size
+		self.command_time = command_time
+		self.latency = latency
+		self.corrupt_lines = set(corrupt_lines)
+		self.received = [] # accepted commands, in order
+		self.executed = 0
+		self.errors = 0
+		self.starved_time = 0.0 # s with an empty queue after the first command
+		self.last_line = 0
+		self.port = None
+		self._master = None
+		self._slave = None
+
+	async def __aenter__(self):
+		await self.start()
+		return self
+
+	async def __aexit__(self,exc_type,exc_value,traceback):
+		await self.stop()
+
+	async def start(self):
+		self._master,self._slave = os.openpty()
+		# raw on the slave side before the host opens it: no echo of the commands
+		configure_terminal(self._slave)
+		self.port = os.ttyname(self._slave)
+		self._connection = await open_fd(self._master)
+		self._queue = asyncio.Queue(self.buffer_size)
+		self._tasks = [asyncio.ensure_future(self._serve()),asyncio.ensure_future(self._execute())]
+
+	async def stop(self):
+		for task in self._tasks:
+			task.cancel()
+		for task in self._tasks:
+			try:
+				await task
+			except (asyncio.CancelledError,RuntimeError):
+				pass
+		self._connection.close()
+		os.close(self._slave)
+
+	def _reply(self,*lines):
+		for line in lines:
+			if self.latency > 0.0:
+				asyncio.get_running_loop().call_later(self.latency,self._connection.write_line,line)
+			else:
+				self._connection.write_line(line)
+
+	def _reject(self,message):
+		self.errors += 1
+		self._reply('Error:{0}, Last Line: {1}'.format(message,self.last_line),'Resend: {}'.format(self.last_line+1),'ok')
+
+	async def _serve(self):
+		while True:
+			line = await self._connection.readline()
+			if not line:
+				continue
+			command = line
+			if line.startswith('N'):
+				if '*' not in line:
+					self._reject('No Checksum with line number')
+					continue
+				text,_,check = line.rpartition('*')
+				number = int(text.split()[0][1:])
+				if number in self.corrupt_lines:
+					self.corrupt_lines.discard(number)
+					self._reject('checksum mismatch')
+					continue
+				if not check.strip().isdigit() or checksum(text) != int(check):
+					self._reject('checksum mismatch')
+					continue
+				command = text.split(None,1)[1] if ' ' in text else ''
+				if command.startswith('M110'):
+					self.last_line = number
+					self._reply('ok')
+					continue
+				if number != self.last_line + 1:
+					self._reject('Line Number is not Last Line Number+1')
+					continue
+				self.last_line = number
+			# the "ok" goes out once the command is queued
+			await self._queue.put(command)
+			self.received.append(command)
+			self._reply('ok')
+
+	async def _execute(self):
+		idle_since = None
+		while True:
+			if self._queue.empty() and self.received:
+				idle_since = time.time()
+			command = await self._queue.get()
+			if idle_since is not None:
+				self.starved_time += time.time() - idle_since
+				idle_since = None
+			if self.command_time > 0.0:
+				await asyncio.sleep(self.command_time)
+			self.executed += 1
+
+if __name__ == "__main__":
+	from serial_host import SerialHost,open_serial,stream_program
+	def plate(g):
+		for i in range(96):
+			g.set_feedrate(1,extrusionunit='mL/min')
+			g.move(e=25,extrusionunit='uL')
+			g.set_feedrate(1000)
+			g.move(z=-15)
+			g.move(x=-9.1)
+			g.move(z=15)
+	async def main():
+		for window in (1,4):
+			async with FakePrinter(command_time=0.001,latency=0.002,corrupt_lines=(50,300)) as printer:
+				connection = await open_serial(printer.port)
+				try:
+					stats = await stream_program(SerialHost(connection,window=window),plate)
+				finally:
+					connection.close()
+				print('window {0}: {1} lines in {2:.3f} s, {3} resends, printer starved {4:.3f} s'.format(
+					window,stats['lines'],stats['elapsed'],stats['resends'],printer.starved_time))
+	asyncio.run(main())
@@ -0,0 +1,255 @@
+import math
+from config import *
+from toolpath import Toolpath,OP_RAW,OP_MOVE,OP_ARC_CW,OP_ARC_CCW,OP_FEED,OP_STEPS,MOTION_OPS
+import arcs
+
+"""
+Adaptive flow-rate planner: caps the volumetric flow of every move.
+
+G turns a flow rate (uL/min, mL/min, uL/s) into one head speed, and the
+firmware applies that feedrate to the XYZ length of a move (to the E length for
+pure dispenses). The flow through the tip therefore depends on the geometry of
+every move, and a high dispense rate can exceed what the syringe and tip can
+pass. This pass goes over a recorded toolpath and, for every move that pushes
+or pulls the plunger, computes its volumetric flow (uL/s) and the wall shear
+rate in the tip (Poiseuille flow, 32Q/(pi D^3) in 1/s). Moves over the limits
+of their tool are retimed to exactly the limit (the fastest time allowed), with
+a G1 F before them and the programmed feedrate restored after. Nothing else
+is slowed down.
+
+Limits are per tool: max_flow (uL/s) and max_shear_rate (1/s) given to the
+planner, or else the max_flow and max_shear_rate fields of the tip profile
+(see hardware.py); a tool with neither is an error. The tips of profiles/
+are rated for a 1 Pa.s ink: max_flow is the flow at which the Poiseuille
+pressure drop along the 1.25 in (31.75 mm) tip reaches 100 psi, and
+max_shear_rate (5000 1/s) keeps the wall shear stress under 5 kPa, the usual
+limit for cell viability. Thinner or thicker inks need their own limits.
+With max_feed, extruding moves may also run faster than
+programmed, up to that head speed and the flow limits, to minimize the total
+time. With max_segment_time, long linear dispenses are split into equal parts
+(with exact step counts) that last at most that long, so a pause from the host
+lands quickly and the report shows the progress of long dispenses. Arcs are
+retimed but not split.
+
+Every planned move is reported as a Segment with the constraint that set its
+speed: 'feed' (the programmed feedrate), 'max_feed', 'flow' or 'shear'.
+
+Example
+-------
+g = G(output=FileSink('plate.gcode'),record=True)
+layout.compile(g)
+plan = g.plan_flow(max_flow=100.0,max_shear_rate=20000.0)
+print('\\n'.join(plan.summary()))
+"""
+
+LIMITS = ('feed','max_feed','flow','shear')
+
+def wall_shear_rate(flow,diameter):
+	""" Wall shear rate (1/s) of a flow (uL/s) through a tip of inner diameter (mm) """
+	return 32.*flow/(math.pi*diameter**3)
+
+def shear_limited_flow(shear_rate,diameter):
+	""" Flow (uL/s) at which the wall shear rate in the tip reaches shear_rate (1/s) """
+	return shear_rate*math.pi*diameter**3/32.
+
+class Segment(object):
+	"""One planned move"""
+	__slots__ = ('row','source','tool','duration','feed','requested_feed','flow','requested_flow','shear_rate','limit')
+	def __init__(self,row,source,tool,duration,feed,requested_feed,flow,requested_flow,shear_rate,limit):
+		self.row = row # row of the planned toolpath
+		self.source = source # row of the recorded toolpath (shared by the parts of a split move)
+		self.tool = tool
+		self.duration = duration # s
+		self.feed = feed # mm/min
+		self.requested_feed = requested_feed # mm/min
+		self.flow = flow # uL/s (absolute, retractions included)
+		self.requested_flow = requested_flow # uL/s
+		self.shear_rate = shear_rate # 1/s at the tip wall
+		self.limit = limit # constraint that set the feedrate, one of LIMITS
+
+class FlowPlan(object):
+	"""Segments planned by a FlowLimiter"""
+	def __init__(self):
+		self.segments = []
+		self.time = 0.0 # s, planned moves
+		self.requested_time = 0.0 # s, same moves at their programmed feedrate
+
+	def counts(self):
+		""" Number of segments per limiting constraint """
+		counts = dict((limit,0) for limit in LIMITS)
+		for segment in self.segments:
+			counts[segment.limit] += 1
+		return counts
+
+	def limited(self):
+		""" Segments slowed down by a flow or shear limit """
+		return [segment for segment in self.segments if segment.limit in ('flow','shear')]
+
+	def lines(self,digits=4):
+		""" One comment line per segment """
+		return [';Move {0} (T{1}): {2:.{digits}f} uL/s at F{3:.{digits}f}, {4:.{digits}f} s | limit: {5}'.format(
+			segment.source,segment.tool,segment.flow,segment.feed,segment.duration,segment.limit,digits=digits) for segment in self.segments]
+
+	def summary(self,digits=4):
+		""" Comment lines with the planned time and the constraints that were hit """
+		counts = self.counts()
+		lines = [';Flow plan: {0} segments | {1}'.format(len(self.segments),' | '.join('{0}: {1}'.format(limit,counts[limit]) for limit in LIMITS))]
+		lines.append(';Planned move time: {0:.{digits}f} s (programmed: {1:.{digits}f} s)'.format(self.time,self.requested_time,digits=digits))
+		if self.segments:
+			peak = max(self.segments,key=lambda segment: segment.flow)
+			lines.append(';Peak flow: {0:.{digits}f} uL/s | peak tip shear rate: {1:.{digits}f} 1/s'.format(peak.flow,max(segment.shear_rate for segment in self.segments),digits=digits))
+		return lines
+
+class FlowLimiter(object):
+	"""Toolpath pass (Toolpath -> Toolpath) enforcing the flow limits, see the module docstring"""
+	def __init__(self,tools,max_flow=None,max_shear_rate=None,max_feed=None,max_segment_time=None,digits=None,segment_length=ARC_SEGMENT_LENGTH):
+		"""
+		Parameters
+		-----------
+		tools : list
+			Tools of the printer (tools.Tool or hardware.ToolProfile), by T index
+		max_flow : float (default: None)
+			Volumetric flow limit (uL/s), by default the one of each tip profile
+		max_shear_rate : float (default: None)
+			Wall shear rate limit in the tip (1/s), by default the one of each tip profile
+		max_feed : float (default: None)
+			Head speed (mm/min) extruding moves may be sped up to, None to never
+			exceed the programmed feedrate
+		max_segment_time : float (default: None)
+			Longest duration (s) of a linear move that moves E, longer ones are split
+		digits : int (default: None)
+			Digits of the output: planned feedrates are rounded down to them so
+			the rendered F stays within the limits
+		segment_length : float (default: ARC_SEGMENT_LENGTH)
+			Length of the chords of circular moves (mm)
+		"""
+		if max_segment_time is not None and max_segment_time <= 0.0:
+			raise RuntimeError('max_segment_time must be positive.')
+		self.tools = list(tools)
+		self.max_feed = max_feed
+		self.max_segment_time = max_segment_time
+		self.digits = digits
+		self.segment_length = segment_length
+		# (syringe cross-section, tip ID, flow cap, constraint of the cap) per tool
+		self._caps = [self._tool_caps(k,tool,max_flow,max_shear_rate) for k,tool in enumerate(self.tools)]
+		self.plan = None
+
+	def _tool_caps(self,index,tool,max_flow,max_shear_rate):
+		tip = getattr(getattr(tool,'profile',tool),'tip',None)
+		extra = getattr(tip,'extra',{})
+		if max_flow is None:
+			max_flow = extra.get('max_flow')
+		if max_shear_rate is None:
+			max_shear_rate = extra.get('max_shear_rate')
+		cap,limit = None,None
+		if max_flow is not None:
+			cap,limit = max_flow,'flow'
+		if max_shear_rate is not None:
+			flow = shear_limited_flow(max_shear_rate,tool.tip_ID)
+			if cap is None or flow < cap:
+				cap,limit = flow,'shear'
+		if cap is None:
+			raise RuntimeError('Tool {0} has no flow or shear limit: give max_flow or max_shear_rate, or add them to the tip profile {1}.'.format(index,tip.name))
+		return (tool.syringe_cross_section,tool.tip_ID,cap,limit)
+
+	def _round(self,feed):
+		if self.digits is None:
+			return feed
+		scale = 10**self.digits
+		return max(math.floor(feed*scale)/scale,1./scale)
+
+	def _path_length(self,toolpath,k,mm):
+		# XYZ length the feedrate applies to (the linearized arc for G2/G3)
+		op = toolpath.op[k]
+		if op == OP_MOVE:
+			return math.sqrt(sum(mm[axes]**2 for axes in MOTION_AXES))
+		i,j = toolpath.i[k],toolpath.j[k]
+		dx,dy = mm[MOTION_AXES[0]],mm[MOTION_AXES[1]]
+		start = math.degrees(math.atan2(-j,-i))
+		end = None if dx == 0.0 and dy == 0.0 else math.degrees(math.atan2(dy-j,dx-i))
+		sweep = arcs.sweep_angle(start,end,'CW' if op == OP_ARC_CW else 'CCW')
+		return float(arcs.arc_length(math.hypot(i,j),sweep,self.segment_length))
+
+	def _plan_move(self,feed,length,edistance,tool):
+		# planned feedrate, constraint, requested and planned flow of one move
+		cross_section,tip_ID,cap,cap_limit = self._caps[tool]
+		distance = length if length > 0.0 else edistance
+		if edistance == 0.0 or distance == 0.0 or feed <= 0.0:
+			return feed,'feed',0.0,0.0
+		flow_per_feed = edistance*cross_section/distance/60. # uL/s per mm/min
+		requested = feed*flow_per_feed
+		planned,limit = feed,'feed'
+		if self.max_feed is not None and self.max_feed > planned:
+			planned,limit = self.max_feed,'max_feed'
+		if cap is not None and planned*flow_per_feed > cap:
+			planned,limit = self._round(cap/flow_per_feed),cap_limit
+		return planned,limit,requested,planned*flow_per_feed
+
+	def __call__(self,toolpath):
+		out = Toolpath(toolpath.start_position,toolpath.start_steps_per_mm,toolpath.start_relative,toolpath.start_speed,toolpath.start_tool)
+		plan = FlowPlan()
+		steps_per_mm = dict(toolpath.start_steps_per_mm)
+		tool = toolpath.start_tool
+		printer_feed = toolpath.start_speed # feedrate the firmware will use
+		pending = None # last programmed G1 F not yet needed by a move
+		for k in range(len(toolpath)):
+			op = toolpath.op[k]
+			if op == OP_FEED:
+				pending = toolpath.feed[k]
+				continue
+			if op == OP_RAW:
+				line = toolpath.extra[toolpath.aux[k]]
+				if isinstance(line,str) and line[:1] == 'T' and line[1:].isdigit():
+					tool = int(line[1:])
+			elif op == OP_STEPS:
+				steps_per_mm.update(toolpath.extra[toolpath.aux[k]][0])
+			if op not in MOTION_OPS:
+				out._append(op,toolpath.feed[k],toolpath.mask[k],None,toolpath.i[k],toolpath.j[k],
+					toolpath.extra[toolpath.aux[k]] if toolpath.aux[k] >= 0 else None)
+				continue
+			pending = None
+			feed = toolpath.feed[k]
+			deltas = dict((axes,toolpath.delta[axes][k]) for axes in AXES)
+			mm = dict((axes,deltas[axes]/float(steps_per_mm[axes])) for axes in AXES)
+			length = self._path_length(toolpath,k,mm)
+			edistance = abs(mm[EXTRUSION_AXES[0]])
+			planned,limit,requested,flow = self._plan_move(feed,length,edistance,tool)
+			distance = length if length > 0.0 else edistance
+			duration = 60.*distance/planned if planned > 0.0 else 0.0
+			parts = 1
+			if op == OP_MOVE and edistance > 0.0 and self.max_segment_time is not None and duration > self.max_segment_time:
+				# at least one step of the longest axis per part
+				parts = min(int(math.ceil(duration/self.max_segment_time)),max(abs(d) for d in deltas.values()))
+			if planned != printer_feed:
+				out._append(OP_FEED,planned)
+				printer_feed = planned
+			for part in range(parts):
+				# exact step counts: cumulative rounding of the move
+				piece = dict((axes,int(round(deltas[axes]*(part+1)/float(parts)))-int(round(deltas[axes]*part/float(parts)))) for axes in AXES)
+				share = 1./parts
+				plan.segments.append(Segment(len(out),k,tool,duration*share,planned,feed,flow,requested,
+					wall_shear_rate(flow,self._caps[tool][1]),limit))
+				out._append(op,planned,toolpath.mask[k],piece,toolpath.i[k],toolpath.j[k])
+			plan.time += duration
+			plan.requested_time += 60.*distance/feed if feed > 0.0 else 0.0
+		if pending is not None and pending != printer_feed:
+			out._append(OP_FEED,pending)
+		self.plan = plan
+		return out
+
+def limit_flow(toolpath,tools,**kwargs):
+	""" Plan a toolpath, returns (planned toolpath, FlowPlan), see FlowLimiter """
+	limiter = FlowLimiter(tools,**kwargs)
+	planned = limiter(toolpath)
+	return planned,limiter.plan
+
+if __name__ == "__main__":
+	from main import G
+	from sinks import MemorySink
+	g = G(output=MemorySink(),diagnostics='off',record=True)
+	g.set_feedrate(10,'mL/min')
+	g.move(e=0.5,extrusionunit='uL')
+	g.move(x=5,e=2,extrusionunit='uL')
+	g.move(x=5)
+	plan = g.plan_flow(max_flow=50.0,max_shear_rate=20000.0,max_segment_time=0.5)
+	print('\n'.join(plan.lines()+plan.summary()))
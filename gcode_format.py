@@ -0,0 +1,112 @@
+from fractions import Fraction
+from itertools import chain
+
+"""
+G-code argument formatter used by the G object.
+
+Templates are compiled once per (axis letters, output digits, minimal) and
+reused for every line. Coordinates can be rendered either from floats (the
+values the user passed in) or directly from integer step counts with exact
+fixed-point arithmetic. In minimal mode trailing zeros are stripped
+(X1.2500 -> X1.25, X2.0000 -> X2).
+"""
+
+_TEMPLATES = {}
+_STEP_SCALES = {}
+
+def template(letters,digits,minimal=False):
+	""" Return the cached %-template for a tuple of axis letters """
+	key = (letters,digits,minimal)
+	tpl = _TEMPLATES.get(key)
+	if tpl is None:
+		if minimal:
+			# values are rendered separately, then substituted as strings
+			tpl = ' '.join(letter+'%s' for letter in letters)
+		else:
+			tpl = ' '.join('{0}%.{1}f'.format(letter,digits) for letter in letters)
+		_TEMPLATES[key] = tpl
+	return tpl
+
+def strip_zeros(number):
+	""" Remove trailing zeros (and a dangling decimal point) from a number string """
+	if '.' in number:
+		number = number.rstrip('0').rstrip('.')
+	if number == '-0' or number == '':
+		number = '0'
+	return number
+
+def format_number(value,digits,minimal=False):
+	number = '%.*f' % (digits,value)
+	if minimal:
+		return strip_zeros(number)
+	return number
+
+def format_args(letters,values,digits,minimal=False):
+	""" Format float values, e.g. (('X','E'),(1.0,0.5),4) -> 'X1.0000 E0.5000' """
+	tpl = template(letters,digits,minimal)
+	if minimal:
+		return tpl % tuple(strip_zeros('%.*f' % (digits,v)) for v in values)
+	return tpl % tuple(values)
+
+def format_table(tpl,values,rows):
+	""" Render a %-template once per row with a single % operation
+
+	values holds the arguments of every row, row after row. The template must
+	not contain newlines.
+	"""
+	if rows == 0:
+		return []
+	return ('\n'.join([tpl]*rows) % tuple(values)).split('\n')
+
+def format_column(values,digits,minimal=False):
+	""" Render a column of floats, e.g. ([1.0,0.5],4) -> ['1.0000','0.5000'] """
+	strings = format_table('%.{}f'.format(digits),values,len(values))
+	if minimal:
+		return [strip_zeros(number) for number in strings]
+	return strings
+
+def format_rows(letters,columns,digits,minimal=False,prefix=''):
+	""" Format one argument string per row from per-letter columns of floats """
+	rows = len(columns[0]) if columns else 0
+	if minimal:
+		columns = [format_column(column,digits,True) for column in columns]
+	return format_table(prefix+template(letters,digits,minimal),chain.from_iterable(zip(*columns)),rows)
+
+# ---------- Integer step rendering ---------- #
+def _step_scale(steps_per_mm,digits):
+	# value*10**digits = steps*numerator/divisor, computed exactly
+	key = (steps_per_mm,digits)
+	scale = _STEP_SCALES.get(key)
+	if scale is None:
+		spm = Fraction(repr(float(steps_per_mm)))
+		scale = (spm.denominator*10**digits,spm.numerator)
+		_STEP_SCALES[key] = scale
+	return scale
+
+def format_steps(steps,steps_per_mm,digits,minimal=False):
+	""" Render a step count as mm with fixed-point arithmetic (round half to even) """
+	numerator,divisor = _step_scale(steps_per_mm,digits)
+	q,r = divmod(abs(steps)*numerator,divisor)
+	if 2*r > divisor or (2*r == divisor and q % 2 == 1):
+		q += 1
+	if digits > 0:
+		number = str(q).rjust(digits+1,'0')
+		number = number[:-digits] + '.' + number[-digits:]
+	else:
+		number = str(q)
+	if steps < 0:
+		number = '-' + number
+	if minimal:
+		return strip_zeros(number)
+	return number
+
+def format_step_args(letters,steps,steps_per_mm,digits,minimal=False):
+	""" Like format_args but from integer steps and the matching steps/mm """
+	return ' '.join(letter+format_steps(s,spm,digits,minimal) for letter,s,spm in zip(letters,steps,steps_per_mm))
+
+def format_step_rows(letters,columns,steps_per_mm,digits,minimal=False):
+	""" Like format_rows but from per-letter columns of integer steps """
+	rendered = []
+	for letter,column,spm in zip(letters,columns,steps_per_mm):
+		rendered.append([letter+format_steps(int(s),spm,digits,minimal) for s in column])
+	return [' '.join(row) for row in zip(*rendered)]
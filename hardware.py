@@ -0,0 +1,265 @@
+import os
+import math
+import json
+try:
+	from collections.abc import Mapping
+except ImportError: # Python 2
+	from collections import Mapping
+
+"""
+Registry of hardware profiles: syringes, tips, printers, pipets and well plates.
+
+Profiles are read from JSON data files, one per category (syringes.json,
+tips.json, printers.json, pipets.json, plates.json), in the profiles directory
+next to this module and in the directories listed in HARDWARE_PATH (separated
+like PATH; later directories override earlier ones, profile by profile). Each
+file holds {"units": {...}, "profiles": {name: {field: value}}}.
+
+Everything is lazy and memoized: a category file is only read the first time
+one of its profiles is asked for, and a profile object (with its derived
+constants: cross-sections, steps per revolution, mm per step...) is built once
+per name. A syringe and tip pair is also built once (tool_profile), so making
+thousands of G objects in a sweep does not recompute anything.
+
+The tables of config.py (SYRINGE_DIAMETER, TIP_ID, WELL_PLATE_PITCH...) are
+read-only views of this registry, kept for existing scripts.
+
+Example
+-------
+tool = tool_profile("BD-3ml","JG22-1.25TTX")
+print(tool.syringe_cross_section,tool.waste_volume)
+register('syringes','Hamilton-250ul',diameter=2.30,waste_volume=0.01)
+g = G(syringe='Hamilton-250ul')
+"""
+
+PROFILE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)),'profiles')
+HARDWARE_PATH = 'HARDWARE_PATH' # environment variable with more profile directories
+
+# ---------- Profiles ---------- #
+class SyringeProfile(object):
+	"""Syringe barrel"""
+	def __init__(self,name,diameter,waste_volume=0.0,**extra):
+		self.name = name
+		self.diameter = diameter # mm
+		self.waste_volume = waste_volume # mL
+		self.cross_section = math.pi*(diameter/2.)**2 # uL/mm
+		self.extra = extra
+
+class TipProfile(object):
+	"""Dispensing tip"""
+	def __init__(self,name,inner_diameter,void_volume=0.0,**extra):
+		self.name = name
+		self.inner_diameter = inner_diameter # mm
+		self.void_volume = void_volume # mL
+		self.cross_section = math.pi*(inner_diameter/2.)**2 # mm^2
+		self.extra = extra
+
+class PrinterProfile(object):
+	"""Motion system: steps/mm, stepper motors and planner limits of the X, Y, Z, E axes"""
+	def __init__(self,name,steps_per_mm,microstepping=16,step_angle=1.8,max_acceleration=None,max_jerk=None,**extra):
+		self.name = name
+		self.steps_per_mm = tuple(steps_per_mm)
+		self.microstepping = microstepping
+		self.step_angle = step_angle # degree
+		self.max_acceleration = tuple(max_acceleration) if max_acceleration is not None else None # mm/s^2
+		self.max_jerk = tuple(max_jerk) if max_jerk is not None else None # mm/s
+		self.mm_per_step = tuple([1./axes for axes in self.steps_per_mm])
+		self.steps_per_revolution = self.steps_per_rev(microstepping)
+		self.extra = extra
+
+	def steps_per_rev(self,microstepping):
+		""" Steps per motor revolution at a microstepping """
+		return int(microstepping*360/self.step_angle)
+
+class PipetProfile(object):
+	"""Pipet used as a vessel"""
+	def __init__(self,name,outer_diameter,**extra):
+		self.name = name
+		self.outer_diameter = outer_diameter # mm
+		self.extra = extra
+
+class PlateProfile(object):
+	"""Well plate (ANSI/SLAS footprint, 127.76 x 85.48 mm)"""
+	def __init__(self,name,rows,columns,pitch,a1_offset,depth,**extra):
+		self.name = name
+		self.rows = rows
+		self.columns = columns
+		self.layout = (rows,columns)
+		self.pitch = pitch # mm, centre to centre
+		self.a1_offset = tuple(a1_offset) # mm, A1 centre from the left and top edges
+		self.depth = depth # mm
+		self.extra = extra
+
+class ToolProfile(object):
+	"""Syringe and tip pair, with the constants extrusion needs"""
+	def __init__(self,syringe,tip):
+		self.syringe = syringe
+		self.tip = tip
+		self.syringe_diameter = syringe.diameter # mm
+		self.syringe_cross_section = syringe.cross_section # uL/mm
+		self.tip_ID = tip.inner_diameter # mm
+		self.tip_cross_section = tip.cross_section # mm^2
+		self.waste_volume = syringe.waste_volume + tip.void_volume # mL
+
+# category -> (profile class, name used in error messages)
+CATEGORIES = {'syringes':(SyringeProfile,'syringe'),'tips':(TipProfile,'tip'),'printers':(PrinterProfile,'printer'),
+	'pipets':(PipetProfile,'pipet'),'plates':(PlateProfile,'well plate')}
+
+# ---------- Registry ---------- #
+class Registry(object):
+	"""Profiles of every category, loaded on first use"""
+	def __init__(self,directories=None):
+		"""
+		Parameters
+		-----------
+		directories : list (default: None)
+			Directories holding the category files, by default PROFILE_DIR then
+			the directories of the HARDWARE_PATH environment variable
+		"""
+		if directories is None:
+			directories = [PROFILE_DIR] + [path for path in os.environ.get(HARDWARE_PATH,'').split(os.pathsep) if path]
+		self.directories = list(directories)
+		self._data = {} # category -> name -> fields, filled on first use
+		self._registered = dict((category,{}) for category in CATEGORIES)
+		self._profiles = {} # (category, name) -> profile
+		self._tools = {} # (syringe, tip) -> ToolProfile
+
+	def _category(self,category):
+		if category not in CATEGORIES:
+			raise RuntimeError('Unknown hardware category: {}'.format(category))
+		data = self._data.get(category)
+		if data is None:
+			data = {}
+			for directory in self.directories:
+				path = os.path.join(directory,category+'.json')
+				if os.path.exists(path):
+					with open(path) as f:
+						data.update(json.load(f).get('profiles',{}))
+			data.update(self._registered[category])
+			self._data[category] = data
+		return data
+
+	def _reset(self):
+		self._data = {}
+		self._profiles = {}
+		self._tools = {}
+
+	def add_directory(self,directory):
+		""" Read profiles from one more directory (overriding the others) """
+		self.directories.append(directory)
+		self._reset()
+
+	def register(self,category,name,**fields):
+		""" Add or replace one profile, e.g. register('tips','JG25',inner_diameter=0.26,void_volume=0.15) """
+		if category not in CATEGORIES:
+			raise RuntimeError('Unknown hardware category: {}'.format(category))
+		self._registered[category][name] = fields
+		self._reset()
+
+	def names(self,category):
+		""" Names of the profiles of a category, sorted """
+		return sorted(self._category(category))
+
+	def fields(self,category,name):
+		""" Raw fields of a profile, as in its data file """
+		data = self._category(category)
+		if name not in data:
+			raise RuntimeError('Unknown {0}: {1}'.format(CATEGORIES[category][1],name))
+		return data[name]
+
+	def get(self,category,name):
+		""" Profile object of a category (built once) """
+		profile = self._profiles.get((category,name))
+		if profile is None:
+			cls,label = CATEGORIES[category] if category in CATEGORIES else (None,None)
+			if cls is not None and isinstance(name,cls):
+				return name # already a profile
+			fields = self.fields(category,name)
+			try:
+				profile = cls(name,**fields)
+			except TypeError as error:
+				raise RuntimeError('Bad {0} profile {1}: {2}'.format(label,name,error))
+			self._profiles[(category,name)] = profile
+		return profile
+
+	def syringe(self,name):
+		return self.get('syringes',name)
+
+	def tip(self,name):
+		return self.get('tips',name)
+
+	def printer(self,name='default'):
+		return self.get('printers',name)
+
+	def pipet(self,name):
+		return self.get('pipets',name)
+
+	def plate(self,name):
+		return self.get('plates',name)
+
+	def tool(self,syringe,tip):
+		""" Syringe and tip pair (built once per pair) """
+		key = (syringe,tip)
+		tool = self._tools.get(key)
+		if tool is None:
+			tool = ToolProfile(self.syringe(syringe),self.tip(tip))
+			self._tools[key] = tool
+		return tool
+
+class ProfileTable(Mapping):
+	"""Read-only name -> field mapping over one category of a registry (config.py tables)"""
+	def __init__(self,category,field,registry=None):
+		self.category = category
+		self.field = field
+		self._registry = registry
+
+	@property
+	def registry(self):
+		return self._registry if self._registry is not None else REGISTRY
+
+	def __getitem__(self,name):
+		try:
+			fields = self.registry.fields(self.category,name)
+		except RuntimeError:
+			raise KeyError(name)
+		if isinstance(self.field,tuple):
+			return tuple(fields[field] for field in self.field)
+		value = fields[self.field]
+		return tuple(value) if isinstance(value,list) else value
+
+	def __iter__(self):
+		return iter(self.registry.names(self.category))
+
+	def __len__(self):
+		return len(self.registry.names(self.category))
+
+	def __repr__(self):
+		return 'ProfileTable({0!r}, {1!r})'.format(self.category,self.field)
+
+# ---------- Default registry ---------- #
+REGISTRY = Registry()
+
+def syringe(name):
+	return REGISTRY.syringe(name)
+
+def tip(name):
+	return REGISTRY.tip(name)
+
+def printer(name='default'):
+	return REGISTRY.printer(name)
+
+def pipet(name):
+	return REGISTRY.pipet(name)
+
+def plate(name):
+	return REGISTRY.plate(name)
+
+def tool_profile(syringe,tip):
+	return REGISTRY.tool(syringe,tip)
+
+def register(category,name,**fields):
+	REGISTRY.register(category,name,**fields)
+
+if __name__ == "__main__":
+	for category in sorted(CATEGORIES):
+		print('{0}: {1}'.format(category,', '.join(REGISTRY.names(category))))
@@ -0,0 +1,387 @@
+from array import array
+from config import AXES
+
+"""
+Compact position history for the G object. Positions are stored in motor steps
+as one typed integer column per axis instead of lists of Python ints.
+
+Alongside the axes, two float columns describe each recorded move: 'feed'
+(the feedrate in mm/min) and 'arc_length' (path length of circular moves, 0 for
+linear moves). They are what the motion planner model needs.
+
+Circular moves also keep their geometry in a sparse table (one row per arc, not
+per move): the centre offset from the start point (I, J in mm) and the signed
+sweep (radians, counterclockwise positive), so the path between two recorded
+positions can be rebuilt (see deposition.py). Tool changes are kept the same
+way (one row per T command): the index of the first position recorded with the
+new tool, and the tool number, so the syringe every move extruded with is known.
+
+Histories can be snapshotted, restored and forked cheaply (see G.snapshot). In
+'full' mode the columns are only ever appended to, so a snapshot keeps a
+reference to them with their current length: the recorded positions are shared
+as an immutable prefix (a list of such segments) by every branch, and each
+branch appends to its own new columns. A 'ring' history is copied (it is
+bounded by maxlen).
+
+Columns are read in chronological order through column() (typed arrays) or
+array() (read-only NumPy arrays, what np.asarray(g.position_history[axis])
+returns). Both are built once and shared until the next position is recorded.
+
+Modes
+-----
+'full' : every recorded position is kept
+'ring' : only the last maxlen positions are kept (bounded memory)
+'off'  : nothing is kept, only the number of recorded positions is counted
+"""
+
+HISTORY_MODES = ('full','ring','off')
+MOVE_FIELDS = ('feed','arc_length')
+ARC_FIELDS = ('i','j','sweep')
+
+def _int64_array(values=()):
+	# 'q' is missing from the array module on Python 2, where 'l' is 64 bits on LP64 platforms
+	try:
+		return array('q',values)
+	except ValueError:
+		return array('l',values)
+
+def _extend(column,values):
+	# append a NumPy array to a typed array of the same item type
+	import numpy as np
+	data = np.ascontiguousarray(values,dtype=np.dtype(column.typecode)).tobytes()
+	if hasattr(column,'frombytes'):
+		column.frombytes(data)
+	else: # Python 2
+		column.fromstring(data)
+
+class PositionHistory(object):
+	def __init__(self,axes=AXES,mode='full',maxlen=None):
+		"""
+		Parameters
+		-----------
+		axes : tuple (default: AXES)
+			Names of the recorded axes
+		mode : str (default: 'full')
+			One of 'full', 'ring' or 'off'
+		maxlen : int (default: None)
+			Number of positions kept in 'ring' mode
+		"""
+		if mode not in HISTORY_MODES:
+			raise RuntimeError('History mode must be one of {}.'.format(', '.join(HISTORY_MODES)))
+		if mode == 'ring' and (maxlen is None or maxlen < 1):
+			raise RuntimeError('A positive maxlen is required for ring history.')
+		self.axes = tuple(axes)
+		self.mode = mode
+		self.maxlen = maxlen if mode == 'ring' else None
+		self.recorded = 0 # total number of positions ever recorded
+		if mode == 'ring':
+			self._columns = dict((axes,_int64_array([0]*maxlen)) for axes in self.axes)
+			self._columns.update((field,array('d',[0.0]*maxlen)) for field in MOVE_FIELDS)
+		else:
+			self._columns = dict((axes,_int64_array()) for axes in self.axes)
+			self._columns.update((field,array('d')) for field in MOVE_FIELDS)
+		# arc geometry, keyed by the index of the recorded position that ends the arc
+		self._arc_index = _int64_array()
+		self._arcs = dict((field,array('d')) for field in ARC_FIELDS)
+		# (index of the first position recorded with the tool, tool) of every tool change
+		self._tool_changes = []
+		# shared prefix ('full' mode): (columns, arc index, arcs, length, arc count) segments
+		self._base = []
+		self._base_length = 0
+		self._cache = {} # axis -> (recorded, chronological column), see column
+		self._view = HistoryView(self)
+
+	def __len__(self):
+		if self.mode == 'full':
+			return self.recorded
+		elif self.mode == 'ring':
+			return min(self.recorded,self.maxlen)
+		return 0
+
+	def record(self,position,feed=0.0,arc_length=0.0,arc=None):
+		""" Record one position given as a dict of axis -> steps
+
+		arc is the (i, j, sweep) of a circular move ending at this position.
+		"""
+		if arc is not None and self.mode != 'off':
+			self._record_arc(arc)
+		if self._cache:
+			self._cache = {}
+		if self.mode == 'full':
+			for axes in self.axes:
+				self._columns[axes].append(position[axes])
+			self._columns['feed'].append(feed)
+			self._columns['arc_length'].append(arc_length)
+		elif self.mode == 'ring':
+			i = self.recorded % self.maxlen
+			for axes in self.axes:
+				self._columns[axes][i] = position[axes]
+			self._columns['feed'][i] = feed
+			self._columns['arc_length'][i] = arc_length
+		self.recorded += 1
+
+	def _record_arc(self,arc):
+		if self.mode == 'ring' and len(self._arc_index) >= 2*self.maxlen:
+			# drop the arcs that left the ring
+			first = self.recorded - self.maxlen
+			keep = [k for k,index in enumerate(self._arc_index) if index >= first]
+			self._arc_index = _int64_array([self._arc_index[k] for k in keep])
+			for field in ARC_FIELDS:
+				self._arcs[field] = array('d',[self._arcs[field][k] for k in keep])
+		self._arc_index.append(self.recorded)
+		for field,value in zip(ARC_FIELDS,arc):
+			self._arcs[field].append(value)
+
+	def record_tool(self,tool):
+		""" The positions recorded from now on are reached with tool (T command) """
+		if self.mode == 'off':
+			return
+		if self._tool_changes and self._tool_changes[-1][0] == self.recorded:
+			self._tool_changes.pop() # no position was recorded with the previous tool
+		if self.mode == 'ring' and len(self._tool_changes) >= 2*self.maxlen:
+			# the last change before the ring is still needed for its first position
+			first = self.recorded - self.maxlen
+			earlier = [change for change in self._tool_changes if change[0] <= first]
+			self._tool_changes = earlier[-1:] + [change for change in self._tool_changes if change[0] > first]
+		self._tool_changes.append((self.recorded,tool))
+
+	def tools(self):
+		""" Tool changes as (index, tool) lists: the tool of the first position still
+		in the history (at index 0), then the chronological position of every change """
+		first = self.recorded - len(self)
+		result = ([0],[0])
+		for index,tool in self._tool_changes:
+			if index <= first:
+				result[1][0] = tool
+			elif index < self.recorded:
+				result[0].append(index-first)
+				result[1].append(tool)
+		return result
+
+	def arcs(self):
+		""" Arc geometry as (index, i, j, sweep) lists, index being the chronological
+		position of the end of each arc (only arcs still in the history) """
+		first = self.recorded - len(self)
+		result = ([],[],[],[])
+		for _,arc_index,arcs,_,count in self._base + [(None,self._arc_index,self._arcs,None,len(self._arc_index))]:
+			keep = [k for k in range(count) if arc_index[k] >= first and arc_index[k] < self.recorded]
+			result[0].extend(arc_index[k]-first for k in keep)
+			for values,field in zip(result[1:],ARC_FIELDS):
+				values.extend(arcs[field][k] for k in keep)
+		return result
+
+	def record_many(self,columns,feed=0.0):
+		""" Record several linear moves given as a dict of axis -> sequence of steps
+
+		feed is either one feedrate for every move or a sequence of feedrates.
+		"""
+		n = len(columns[self.axes[0]])
+		if self._cache:
+			self._cache = {}
+		columns = dict(columns)
+		if hasattr(feed,'tobytes'):
+			columns['feed'] = feed
+		elif hasattr(feed,'__len__'):
+			columns['feed'] = [float(f) for f in feed]
+		else:
+			columns['feed'] = [float(feed)]*n
+		columns['arc_length'] = array('d',[0.0])*n
+		if self.mode == 'full':
+			for axes in self.axes + MOVE_FIELDS:
+				values = columns[axes]
+				if isinstance(values,array):
+					self._columns[axes].extend(values)
+					continue
+				elif hasattr(values,'tobytes'):
+					_extend(self._columns[axes],values)
+					continue
+				elif axes in MOVE_FIELDS:
+					values = [float(v) for v in values]
+				else:
+					values = [int(v) for v in values]
+				self._columns[axes].extend(values)
+		elif self.mode == 'ring':
+			for axes in self.axes + MOVE_FIELDS:
+				col = self._columns[axes]
+				values = columns[axes]
+				# only the tail of the batch can survive in the ring
+				start = max(0,n-self.maxlen)
+				for j in range(start,n):
+					col[(self.recorded+j) % self.maxlen] = values[j]
+		self.recorded += n
+
+	def _index(self,i):
+		# map a chronological index to a storage index
+		n = len(self)
+		if i < 0:
+			i += n
+		if i < 0 or i >= n:
+			raise IndexError('history index out of range')
+		if self.mode == 'ring' and self.recorded > self.maxlen:
+			return (self.recorded + i) % self.maxlen
+		return i
+
+	def value(self,axis,i):
+		""" One recorded value of an axis (or move field), by chronological index """
+		i = self._index(i)
+		if i < self._base_length:
+			for columns,_,_,length,_ in self._base:
+				if i < length:
+					return columns[axis][i]
+				i -= length
+		return self._columns[axis][i-self._base_length]
+
+	def column(self,axis):
+		""" One axis (or move field) in chronological order as a typed array
+
+		The array is built once per number of recorded positions and returned
+		again by the next calls, so it must not be modified.
+		"""
+		cached = self._cache.get(axis)
+		if cached is not None and cached[0] == self.recorded:
+			return cached[1]
+		col = self._ordered(axis)
+		self._cache[axis] = (self.recorded,col)
+		return col
+
+	def array(self,axis):
+		""" Read-only NumPy view of column(axis) (no copy) """
+		import numpy as np
+		key = (axis,'array')
+		cached = self._cache.get(key)
+		if cached is not None and cached[0] == self.recorded:
+			return cached[1]
+		col = self.column(axis)
+		values = np.frombuffer(col,dtype=np.dtype(col.typecode)) if len(col) else np.zeros(0,dtype=np.dtype(col.typecode))
+		values.flags.writeable = False
+		self._cache[key] = (self.recorded,values)
+		return values
+
+	def _ordered(self,axis):
+		# a new chronological copy of a column
+		col = self._columns[axis]
+		if self.mode == 'full':
+			if self._base:
+				col = col[:0]
+				for columns,_,_,length,_ in self._base:
+					col += columns[axis][:length]
+				return col + self._columns[axis]
+			return col[:]
+		elif self.mode == 'ring':
+			if self.recorded <= self.maxlen:
+				return col[:self.recorded]
+			split = self.recorded % self.maxlen
+			return col[split:] + col[:split]
+		return col[:0]
+
+	def view(self):
+		return self._view
+
+	# ---------- Branching ---------- #
+	def snapshot(self):
+		""" Opaque state of the history, to restore it or fork it later """
+		if self.mode == 'full':
+			base = list(self._base)
+			if len(self._columns[self.axes[0]]):
+				base.append((self._columns,self._arc_index,self._arcs,len(self._columns[self.axes[0]]),len(self._arc_index)))
+			return (self.recorded,base,tuple(self._tool_changes))
+		elif self.mode == 'ring':
+			columns = dict((axes,col[:]) for axes,col in self._columns.items())
+			arcs = dict((field,values[:]) for field,values in self._arcs.items())
+			return (self.recorded,(columns,self._arc_index[:],arcs),tuple(self._tool_changes))
+		return (self.recorded,None,())
+
+	def restore(self,state):
+		""" Go back to a snapshot (of this history or of one with the same mode and axes) """
+		self.recorded,data,tool_changes = state
+		self._tool_changes = list(tool_changes)
+		self._cache = {}
+		if self.mode == 'full':
+			# the snapshot becomes the shared prefix, new positions go to new columns
+			self._base = list(data)
+			self._base_length = sum(segment[3] for segment in self._base)
+			self._columns = dict((axes,_int64_array()) for axes in self.axes)
+			self._columns.update((field,array('d')) for field in MOVE_FIELDS)
+			self._arc_index = _int64_array()
+			self._arcs = dict((field,array('d')) for field in ARC_FIELDS)
+		elif self.mode == 'ring':
+			columns,arc_index,arcs = data
+			self._columns = dict((axes,col[:]) for axes,col in columns.items())
+			self._arc_index = arc_index[:]
+			self._arcs = dict((field,values[:]) for field,values in arcs.items())
+
+	def fork(self):
+		""" A new history with the same positions, sharing them in 'full' mode """
+		history = PositionHistory(self.axes,self.mode,self.maxlen)
+		history.restore(self.snapshot())
+		return history
+
+class AxisView(object):
+	"""Read-only, chronologically ordered view of one history column"""
+	def __init__(self,history,axis):
+		self._history = history
+		self._axis = axis
+
+	def __len__(self):
+		return len(self._history)
+
+	def __getitem__(self,i):
+		if isinstance(i,slice):
+			return [self[j] for j in range(*i.indices(len(self)))]
+		return self._history.value(self._axis,i)
+
+	def __iter__(self):
+		return iter(self._history.column(self._axis))
+
+	def tolist(self):
+		return self._history.column(self._axis).tolist()
+
+	def __array__(self,dtype=None,copy=None):
+		# the read-only array of the history, converted or copied only when asked to
+		values = self._history.array(self._axis)
+		if dtype is not None and values.dtype != dtype:
+			return values.astype(dtype)
+		return values.copy() if copy else values
+
+	def __repr__(self):
+		return 'AxisView({0!r}, {1} positions)'.format(self._axis,len(self))
+
+class HistoryView(object):
+	"""Read-only mapping of axis -> AxisView, shaped like the old dict of lists
+
+	The move fields are available as view['feed'] and view['arc_length'] but are
+	not part of keys(); the arc geometry comes from arcs() and the tool changes
+	from tools().
+	"""
+	def __init__(self,history):
+		self._history = history
+		self._axes = dict((axes,AxisView(history,axes)) for axes in history.axes + MOVE_FIELDS)
+
+	def __getitem__(self,axis):
+		return self._axes[axis]
+
+	def __iter__(self):
+		return iter(self._history.axes)
+
+	def __len__(self):
+		return len(self._history.axes)
+
+	def __contains__(self,axis):
+		return axis in self._history.axes
+
+	def keys(self):
+		return list(self._history.axes)
+
+	def arcs(self):
+		""" Geometry of the circular moves, see PositionHistory.arcs """
+		return self._history.arcs()
+
+	def tools(self):
+		""" Tool changes, see PositionHistory.tools """
+		return self._history.tools()
+
+	def values(self):
+		return [self._axes[axes] for axes in self._history.axes]
+
+	def items(self):
+		return [(axes,self._axes[axes]) for axes in self._history.axes]
@@ -0,0 +1,153 @@
+import math
+import numpy as np
+
+"""
+Rectilinear infill of a layer.
+
+A layer outline is a polygon (vertices in mm, in order, not repeated at the
+end). Parallel scan lines `spacing` apart, at `angle` degrees from +X, are
+intersected with the polygon edges all at once; pairs of crossings along every
+line are the segments to fill. Consecutive lines are joined end to end in a
+serpentine, so a convex outline is filled by one continuous polyline; where a
+line crosses a concave outline more than once, the path is broken into several
+polylines with travel moves in between.
+
+Redundant passes print the same layer again, each pass rotated by pass_angle
+(90 degrees gives a cross-hatched grid, 0 retraces the same lines). The
+layer volume is shared by all passes, in proportion to their path length:
+two passes deposit the volume of one layer between them, not one each.
+"""
+
+def polygon_area(vertices):
+	""" Area of a simple polygon (shoelace formula) """
+	v = np.asarray(vertices,dtype=float)
+	x,y = v[:,0],v[:,1]
+	return 0.5*abs(np.dot(x,np.roll(y,-1)) - np.dot(y,np.roll(x,-1)))
+
+def rectangle(width,height):
+	""" Vertices of a width x height rectangle centred on the origin """
+	w = width/2.
+	h = height/2.
+	return np.array([(-w,-h),(w,-h),(w,h),(-w,h)])
+
+def points_inside(vertices,points,tolerance=1e-9):
+	""" Which points lie inside (or within tolerance of the edge of) a polygon, by ray casting """
+	v = np.asarray(vertices,dtype=float)
+	p = np.asarray(points,dtype=float).reshape(-1,2)
+	x0 = v[:,0][None,:]
+	y0 = v[:,1][None,:]
+	x1 = np.roll(v[:,0],-1)[None,:]
+	y1 = np.roll(v[:,1],-1)[None,:]
+	px = p[:,0][:,None]
+	py = p[:,1][:,None]
+	crosses = ((y0 <= py) & (py < y1)) | ((y1 <= py) & (py < y0))
+	with np.errstate(divide='ignore',invalid='ignore'):
+		x = x0 + (py-y0)/(y1-y0)*(x1-x0)
+	left = (crosses & (x < px)).sum(axis=1)
+	# distance to every edge, for points on the outline
+	dx = x1-x0
+	dy = y1-y0
+	length2 = dx**2 + dy**2
+	with np.errstate(divide='ignore',invalid='ignore'):
+		t = np.clip(np.where(length2 > 0.0,((px-x0)*dx+(py-y0)*dy)/length2,0.0),0.0,1.0)
+	distance = np.hypot(x0+t*dx-px,y0+t*dy-py).min(axis=1)
+	return (left % 2 == 1) | (distance <= tolerance)
+
+def _rotation(angle):
+	a = math.radians(angle)
+	return np.array([[math.cos(a),-math.sin(a)],[math.sin(a),math.cos(a)]])
+
+def scan_segments(vertices,spacing,angle=0.0):
+	""" Fill segments of a polygon along scan lines at angle degrees
+
+	Returns (starts, ends, line) where starts and ends are (n,2) arrays and line
+	gives the scan line index of every segment. Segments are ordered line by line
+	and alternate direction from one line to the next (serpentine).
+	"""
+	if spacing <= 0.0:
+		raise RuntimeError('Infill spacing must be positive.')
+	rotation = _rotation(angle)
+	# work in a frame where the scan lines are horizontal
+	v = np.asarray(vertices,dtype=float).dot(rotation)
+	p0 = v
+	p1 = np.roll(v,-1,axis=0)
+	ymin = v[:,1].min()
+	ymax = v[:,1].max()
+	count = int(math.floor((ymax-ymin)/spacing))
+	# lines centred in the outline, at least half a spacing from the extreme vertices
+	offset = ymin + ((ymax-ymin) - (count-1)*spacing)/2. if count > 0 else (ymin+ymax)/2.
+	ys = offset + spacing*np.arange(max(count,1))
+	# crossings of every line with every edge (half-open in y, so shared vertices count once)
+	y0 = p0[:,1][None,:]
+	y1 = p1[:,1][None,:]
+	Y = ys[:,None]
+	crosses = ((y0 <= Y) & (Y < y1)) | ((y1 <= Y) & (Y < y0))
+	with np.errstate(divide='ignore',invalid='ignore'):
+		t = (Y-y0)/(y1-y0)
+	x = p0[:,0][None,:] + t*(p1[:,0]-p0[:,0])[None,:]
+	line,edge = np.nonzero(crosses)
+	xs = x[line,edge]
+	order = np.lexsort((xs,line))
+	line = line[order]
+	xs = xs[order]
+	# pair the crossings of each line: (1st,2nd), (3rd,4th), ...
+	starts_x = xs[0::2]
+	ends_x = xs[1::2]
+	line = line[0::2]
+	# serpentine: odd lines run backwards, segments in reverse order
+	rank = np.unique(line,return_inverse=True)[1]
+	backwards = rank % 2 == 1
+	starts_x,ends_x = np.where(backwards,ends_x,starts_x),np.where(backwards,starts_x,ends_x)
+	key = np.where(backwards,-starts_x,starts_x)
+	order = np.lexsort((key,line))
+	y = ys[line[order]]
+	starts = np.column_stack((starts_x[order],y)).dot(rotation.T)
+	ends = np.column_stack((ends_x[order],y)).dot(rotation.T)
+	return starts,ends,line[order]
+
+def infill_paths(vertices,spacing,angle=0.0):
+	""" Serpentine polylines filling a polygon, as a list of (m,2) point arrays """
+	starts,ends,line = scan_segments(vertices,spacing,angle)
+	if len(line) == 0:
+		return []
+	# consecutive lines with one segment each are joined end to end, as long as
+	# the link between them stays inside the outline
+	counts = np.bincount(line)
+	single = counts[line] == 1
+	joined = np.zeros(len(line),dtype=bool)
+	joined[1:] = single[1:] & single[:-1] & (line[1:] == line[:-1]+1)
+	candidates = np.nonzero(joined)[0]
+	if len(candidates):
+		a = ends[candidates-1]
+		b = starts[candidates]
+		tolerance = 1e-6*spacing
+		inside = points_inside(vertices,0.75*a+0.25*b,tolerance) & points_inside(vertices,0.25*a+0.75*b,tolerance)
+		joined[candidates] = inside
+	breaks = np.nonzero(~joined)[0].tolist() + [len(line)]
+	paths = []
+	for a,b in zip(breaks[:-1],breaks[1:]):
+		points = np.empty((2*(b-a),2))
+		points[0::2] = starts[a:b]
+		points[1::2] = ends[a:b]
+		paths.append(points)
+	return paths
+
+def layer_paths(vertices,spacing,redundancy=1,angle=0.0,pass_angle=90.0):
+	""" Polylines of all redundant passes of a layer, pass after pass """
+	paths = []
+	for k in range(redundancy):
+		paths.extend(infill_paths(vertices,spacing,angle+k*pass_angle))
+	return paths
+
+def path_volumes(paths,volume):
+	""" Split volume over every move of the polylines, in proportion to its length
+
+	Returns one array of per-move volumes per polyline (like print_disc, which
+	weights its rings by their path length). The volumes add up to volume,
+	whatever the number of passes the polylines come from.
+	"""
+	lengths = [np.sqrt((np.diff(p,axis=0)**2).sum(axis=1)) for p in paths]
+	total = sum(float(l.sum()) for l in lengths)
+	if total == 0.0:
+		return [np.zeros(len(l)) for l in lengths]
+	return [volume*l/total for l in lengths]
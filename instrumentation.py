@@ -0,0 +1,194 @@
+import json
+import time
+try:
+	import tracemalloc
+except ImportError: # Python 2
+	tracemalloc = None
+
+"""
+Opt-in profiling of a G object.
+
+Instrumentation wraps the methods of one G instance (the instance attributes
+shadow the class methods), so an uninstrumented G runs exactly the same code as
+before and pays nothing. When attached it collects:
+- call counts and cumulative wall time of every wrapped method (inclusive: the
+  time of move() contains the time of the _update_current_position and write
+  calls it makes)
+- lines and bytes emitted by the sink, and their rate over the run, and the
+  lines G wrote (one per write call, all of them for write_lines, which the
+  batch and toolpath output go through)
+- current and peak traced memory (tracemalloc, Python 3), with labelled
+  snapshots and the top allocation sites
+- custom counters, updated by hooks called after every wrapped call
+
+Example
+-------
+g = G(output=FileSink('plate.gcode'))
+profile = g.instrument()
+profile.add_hook(lambda name,elapsed,args,kwargs: profile.count('slow calls') if elapsed > 1e-3 else None)
+... build the program ...
+g.summary_report()
+profile.dump('plate_profile.json')
+"""
+
+DEFAULT_METHODS = ('move','move_many','circular_move','arc_move','_update_current_position','_apply_arc',
+	'_format_args','_format_step_args','write','write_lines','write_block','set_feedrate','print_disc','print_square',
+	'print_polygon','print_scaffold','print_vessel','summary_report')
+TOP_ALLOCATIONS = 10
+
+_clock = getattr(time,'perf_counter',time.time)
+
+class Instrumentation(object):
+	def __init__(self,g,methods=DEFAULT_METHODS,trace_memory=True):
+		"""
+		Parameters
+		-----------
+		g : G
+			Generator to profile
+		methods : sequence of str (default: DEFAULT_METHODS)
+			Names of the G methods to time (names G does not have are ignored)
+		trace_memory : bool (default: True)
+			Trace allocations with tracemalloc (ignored where it is not available)
+		"""
+		self.g = g
+		self.methods = tuple(name for name in methods if hasattr(g,name))
+		self.trace_memory = trace_memory and tracemalloc is not None
+		self.calls = dict((name,0) for name in self.methods)
+		self.wall_time = dict((name,0.0) for name in self.methods) # s
+		self.counters = {}
+		self.written_lines = 0 # lines passed to G.write and G.write_lines
+		self.snapshots = []
+		self._hooks = []
+		self._started_tracing = False
+		self._start = None
+		self._stop = None
+		self._start_lines = 0
+		self._start_bytes = 0
+		self._end_lines = 0
+		self._end_bytes = 0
+		self.attached = False
+
+	# ---------- Lifetime ---------- #
+	def attach(self):
+		""" Start profiling: wrap the methods of g and start the clock """
+		if self.attached:
+			return self
+		for name in self.methods:
+			setattr(self.g,name,self._wrap(name,getattr(self.g,name)))
+		if self.trace_memory and not tracemalloc.is_tracing():
+			tracemalloc.start()
+			self._started_tracing = True
+		self._start_lines = self.g.output.lines
+		self._start_bytes = self.g.output.bytes
+		self._start = _clock()
+		self._stop = None
+		self.attached = True
+		return self
+
+	def detach(self):
+		""" Stop profiling and restore the original methods of g """
+		if not self.attached:
+			return self
+		self._stop = _clock()
+		self._end_lines = self.g.output.lines
+		self._end_bytes = self.g.output.bytes
+		if self.trace_memory:
+			self.stop_tracing()
+		for name in self.methods:
+			self.g.__dict__.pop(name,None)
+		self.attached = False
+		return self
+
+	def _wrap(self,name,method):
+		calls = self.calls
+		wall_time = self.wall_time
+		hooks = self._hooks
+		instrumentation = self
+		def wrapper(*args,**kwargs):
+			if name == 'write':
+				instrumentation.written_lines += 1
+			elif name == 'write_lines':
+				args = (list(args[0]),) + args[1:]
+				instrumentation.written_lines += len(args[0])
+			elif name == 'write_block':
+				instrumentation.written_lines += args[0].count('\n') if len(args) < 2 or args[1] is None else args[1]
+			start = _clock()
+			result = method(*args,**kwargs)
+			elapsed = _clock() - start
+			calls[name] += 1
+			wall_time[name] += elapsed
+			for methods,hook in hooks:
+				if methods is None or name in methods:
+					hook(name,elapsed,args,kwargs)
+			return result
+		wrapper.__name__ = name
+		wrapper.__doc__ = method.__doc__
+		return wrapper
+
+	# ---------- Custom counters ---------- #
+	def add_hook(self,hook,methods=None):
+		""" Call hook(name, elapsed, args, kwargs) after every wrapped call (or only those in methods) """
+		self._hooks.append((None if methods is None else frozenset(methods),hook))
+
+	def count(self,name,amount=1):
+		""" Increase a custom counter """
+		self.counters[name] = self.counters.get(name,0) + amount
+
+	# ---------- Memory ---------- #
+	def snapshot(self,label):
+		""" Record the current and peak traced memory under a label """
+		if not self.trace_memory or not tracemalloc.is_tracing():
+			return None
+		current,peak = tracemalloc.get_traced_memory()
+		top = tracemalloc.take_snapshot().statistics('lineno')[:TOP_ALLOCATIONS]
+		entry = {'label':label,'current_bytes':current,'peak_bytes':peak,
+			'top_allocations':[{'location':str(stat.traceback),'bytes':stat.size,'count':stat.count} for stat in top]}
+		self.snapshots.append(entry)
+		return entry
+
+	def stop_tracing(self):
+		""" Take the 'end' snapshot and stop tracemalloc if attach started it (timing goes on) """
+		if not self.trace_memory or not tracemalloc.is_tracing():
+			return
+		self.snapshot('end')
+		if self._started_tracing:
+			tracemalloc.stop()
+			self._started_tracing = False
+
+	# ---------- Reports ---------- #
+	def elapsed(self):
+		if self._start is None:
+			return 0.0
+		return (self._stop if self._stop is not None else _clock()) - self._start
+
+	def report(self):
+		""" The profile as a JSON-serializable dict """
+		elapsed = self.elapsed()
+		if self.attached:
+			lines = self.g.output.lines - self._start_lines
+			nbytes = self.g.output.bytes - self._start_bytes
+		else:
+			lines = self._end_lines - self._start_lines
+			nbytes = self._end_bytes - self._start_bytes
+		methods = {}
+		for name in self.methods:
+			calls = self.calls[name]
+			methods[name] = {'calls':calls,'wall_time':self.wall_time[name],
+				'mean_time':self.wall_time[name]/calls if calls else 0.0}
+		report = {'elapsed':elapsed,'methods':methods,'counters':dict(self.counters),
+			'output':{'lines':lines,'bytes':nbytes,'written_lines':self.written_lines,
+				'lines_per_second':lines/elapsed if elapsed > 0.0 else 0.0,
+				'bytes_per_second':nbytes/elapsed if elapsed > 0.0 else 0.0}}
+		if self.trace_memory:
+			peak = None
+			if tracemalloc.is_tracing():
+				peak = tracemalloc.get_traced_memory()[1]
+			elif self.snapshots:
+				peak = self.snapshots[-1]['peak_bytes']
+			report['memory'] = {'peak_bytes':peak,'snapshots':self.snapshots}
+		return report
+
+	def dump(self,path):
+		""" Write the report as JSON """
+		with open(path,'w') as f:
+			json.dump(self.report(),f,indent=2,sort_keys=True)
@@ -1,63 +1,125 @@
 from config import *
+from sinks import StdoutSink
+from history import PositionHistory
+import gcode_format
+from diagnostics import diagnostic_level,FlowStatistics,filament_width,SUMMARY,AGGREGATE,FULL
+from toolpath import Toolpath
+from tools import make_tools
+import hardware
 
 """
 #### CHANGE LOG ####
 4/28/2018 - Changed where syringe type and tip type are chosen. Now user selects that when creating G object
 
 5/10/2018 - Fixed set_axis_steps_per_mm() function
+
+All output now goes through a pluggable sink (see sinks.py) instead of print()
 """
 
 #define the G object
 class G(object):
-	def __init__(self,microstepping=MICROSTEPPING,output_digits=4,num_extruder=1,initial_feedrate=100.0,include_header=True,syringe="BD-1ml",tip="JG24-1.25TTX",layer_height=0.3):
+	def __init__(self,microstepping=MICROSTEPPING,output_digits=4,num_extruder=1,initial_feedrate=100.0,include_header=True,syringe="BD-1ml",tip="JG24-1.25TTX",layer_height=0.3,output=None,history='full',history_size=None,minimal_output=False,step_coordinates=False,record=False,planner_estimate=False,diagnostics='full',profile=None,tools=None,printer=PRINTER):
 		"""
 		Parameters
 		-----------
-		microstepping : int (default: 16)
-			What to multiply the original steps/revolution for motors
+		microstepping : int (default: MICROSTEPPING)
+			What to multiply the original steps/revolution for motors (the default
+			is that of the PRINTER profile). None uses the microstepping of printer.
 		output_digits : int (default: 6)
 			How many digits to include after decimal in output gcode
 		num_extruder : int (default: 1)
-			How many extruders are equipped on the machine
+			How many extruders are equipped on the machine, all with the given
+			syringe and tip unless tools is given (see tools.py)
 		initial_feedrate : float  (default: 100.0)
 			The starting feedrate of the printer (in mm/min)
 		header : bool (default: True)
 			If true, will display the header at the top of the Gcode
+		output : Sink (default: None)
+			Where emitted lines go (see sinks.py). Defaults to a StdoutSink.
+		history : str (default: 'full')
+			Position history mode: 'full', 'ring' (last history_size positions) or 'off'
+		history_size : int (default: None)
+			Number of positions kept when history is 'ring'
+		minimal_output : bool (default: False)
+			If true, trailing zeros are stripped from numbers in G-code arguments
+		step_coordinates : bool (default: False)
+			If true, move() renders the step-quantized coordinates the motors will
+			actually reach instead of the values that were passed in
+		record : bool (default: False)
+			If true, commands are captured into a Toolpath (see toolpath.py) from the
+			start, including the header, until emit() is called
+		planner_estimate : bool (default: False)
+			If true, summary_report also shows the acceleration-aware print time
+			estimate (see motion_planner.py, requires NumPy and the position history)
+		diagnostics : str (default: 'full')
+			Diagnostic comments: 'off', 'summary', 'aggregate' (flow rate and filament
+			width statistics in summary_report) or 'full' (comments before every
+			extruding move), see diagnostics.py
+		profile : str (default: None)
+			If given, the generator is instrumented from the start (see
+			instrumentation.py) and summary_report writes the JSON profile to this path,
+			stopping the memory tracing the profiler started
+		tools : list (default: None)
+			Per-extruder syringe and tip, as (syringe, tip) pairs or dicts (see
+			tools.make_tools). Tool 0 is active at the start.
+		printer : str or PrinterProfile (default: PRINTER)
+			Printer profile (steps/mm, motors, planner limits), see hardware.py
 		"""
-		self.microstepping = microstepping
+		self.output = output if output is not None else StdoutSink()
+		self.printer = hardware.printer(printer)
+		self.microstepping = microstepping if microstepping is not None else self.printer.microstepping
 		self.output_digits = output_digits
-		self.num_extruder = num_extruder
+		self.minimal_output = minimal_output
+		self.step_coordinates = step_coordinates
+		self.planner_estimate = planner_estimate
+		self.diagnostics = diagnostics
+		self._diagnostic_level = diagnostic_level(diagnostics)
+		self.flow_statistics = FlowStatistics() # filled in 'aggregate' mode
+		self.tools = make_tools(num_extruder,syringe,tip,tools)
+		self.num_extruder = len(self.tools)
+		self.active_tool = 0
+		self.tool_change_time = TOOL_CHANGE_TIME # s, added to print_time by select_tool
 		self.speed = initial_feedrate
 		self.layer_height = layer_height
 		self.include_header = include_header
 		# Extrusion calculations
-		self.steps_per_rev = int(self.microstepping*360/MOTOR_STEP_ANGLE)
-		self.syringe = syringe
-		self.syringe_diameter = SYRINGE_DIAMETER[self.syringe] # mm
-		self.syringe_cross_section = math.pi*(self.syringe_diameter/2)**2 # mm
-		self.tip = tip
-		self.tip_ID = TIP_ID[self.tip]
-		self.tip_cross_section = math.pi*(self.tip_ID/2)**2
-		# Waste volume
-		self.waste_volume = SYRINGE_WASTE_SPACE[self.syringe] + TIP_VOID_VOLUME[self.tip]
+		self.steps_per_rev = self.printer.steps_per_rev(self.microstepping)
+		# syringe, tip and waste volume of the active tool
+		self._load_tool(self.tools[0])
 
 		###===== Internal variables =====###
-		self.mm_to_steps = dict(zip(AXES,DEFAULT_AXIS_STEPS_PER_MM))
-		self.steps_to_mm = dict(zip(AXES,MM_PER_STEP))
+		self.mm_to_steps = dict(zip(AXES,self.printer.steps_per_mm))
+		self.steps_to_mm = dict(zip(AXES,self.printer.mm_per_step))
 		self._current_position = dict(zip(AXES,[0,0,0,0]))
-		self.position_history = dict(zip(AXES,([0],[0],[0],[0]))) # in steps
+		self._history = PositionHistory(AXES,mode=history,maxlen=history_size) # in steps
+		self._history.record(self._current_position)
 		self.travel_distance = 0 # mm
 		self.extrusion_distance = 0 # mm
 		self.max_e_position = 0 # in steps
 		self.extrusion_volume = 0 # uL
+		self._tool_volume_mark = 0 # extrusion_volume when the active tool was selected
 		self.print_time = 0 # seconds
 		self.is_relative = True # relative or absolute positioning
 		self.extrusionrate_constant = False # if true, extrusion rate will always be kept the same
 		self.allow_cold_extrusion = None # if true, allows E moves to occur
+		self._toolpath = None # Toolpath being recorded, if any
+		self.instrumentation = None # Instrumentation, if profiling
+		self.profile = profile
+		if profile is not None:
+			# written once summary_report has returned, so its own time is in the profile
+			self.instrument().add_hook(self._dump_profile,('summary_report',))
+		if record:
+			# nothing has been sent to the printer yet, so its modal state is unknown
+			self._toolpath = Toolpath(self._current_position,self.mm_to_steps,is_relative=None,speed=None)
 
 		# run setup method
 		self.setup()
 
+	@property
+	def position_history(self):
+		""" Read-only view of the recorded positions (in steps), indexed by axis """
+		return self._history.view()
+
 	# ---------- PRIVATE METHODS ---------- #
 	def _get_position(self,axis,mode='steps'):
 		if mode == 'steps':
@@ -65,22 +127,42 @@ class G(object):
 		elif mode == 'mm':
 			return self._current_position[axis]*self.steps_to_mm[axis]
 
+	def _load_tool(self,tool):
+		self.syringe = tool.syringe
+		self.syringe_diameter = tool.syringe_diameter # mm
+		self.syringe_cross_section = tool.syringe_cross_section # uL/mm
+		self.tip = tool.tip
+		self.tip_ID = tool.tip_ID # mm
+		self.tip_cross_section = tool.tip_cross_section # mm^2
+		self.waste_volume = tool.waste_volume # mL
+
+	def _store_tool(self):
+		# bring the accounting of the active tool up to date
+		tool = self.tools[self.active_tool]
+		tool.e_position = self._current_position[EXTRUSION_AXES[0]]
+		tool.max_e_position = self.max_e_position
+		tool.extrusion_volume += self.extrusion_volume - self._tool_volume_mark
+		self._tool_volume_mark = self.extrusion_volume
+
 	def _update_current_position(self,x=None,y=None,z=None,e=None,**kwargs):
 		"""
 		_update_current_position algorithm
 		0. Instantiate default local variables necessary for function
 		1. Gather axial move inputs from user into dict dims
 		2. Calculate the number of steps to reach new location
-		3. 
+		3. Accumulate distances, volume and time, then record the position
+		Returns the dict of step differences for the moved axes.
 		"""
 		# 0. Instantiate default local variables necessary for function
 		xyzdistance = 0.0 	# distance of move
 		edistance = 0.0 	# distance of extrusion
+		extruded_volume = 0.0 	# volume extruded past max_e_position
 		move_time = 0.0 	# elapsed time during move
 		# load output digits
 		d = self.output_digits
 		# 1. Gather axial input values from user input
 		dims = {}
+		diffs = {}
 		if x is not None:
 			dims[AXES[0]] = x
 		if y is not None:
@@ -98,6 +180,7 @@ class G(object):
 			target = int(round(destination*self.mm_to_steps[axes]))
 			# the difference in steps from current position to desired position is calculated
 			diff = target - self._get_position(axes)
+			diffs[axes] = diff
 			# handle summing travel and extrusion distances
 			if axes in MOTION_AXES:
 				xyzdistance += (diff*self.steps_to_mm[axes])**2
@@ -116,20 +199,28 @@ class G(object):
 		# calculate move time 
 		if xyzdistance != 0.0:
 			move_time = 60.*xyzdistance/self.speed
-			if edistance != 0.0:
+			# diagnostics are only computed when they are reported
+			if edistance != 0.0 and self._diagnostic_level >= AGGREGATE:
 				espeed = 60.*edistance/move_time # mm/min
 				flowrate = espeed*self.syringe_cross_section/60. # uL/s
 				filamentarea = extruded_volume / xyzdistance # mm^2
-				filamentwidth = 4*filamentarea / math.pi / self.layer_height # mm (assumes ellipse)
-				print(";Extr. rate: {0:.{digits}f} mm/min ({1:.{digits}f} uL/s | {2:.{digits}f} mL/min)".format(espeed,flowrate,60.*flowrate/1000.,digits=d))
-				print(";Extr. volume: {0:.{digits}f} uL| Filament area: {1:.{digits}f} mm^2".format(extruded_volume,filamentarea,digits=d))
-				print(";Filament width (elliptical assumption): {0:.{digits}f} mm".format(filamentwidth,digits=d))
+				filamentwidth = filament_width(extruded_volume,xyzdistance,self.layer_height) # mm (assumes ellipse)
+				if self._diagnostic_level == FULL:
+					self.write(";Extr. rate: {0:.{digits}f} mm/min ({1:.{digits}f} uL/s | {2:.{digits}f} mL/min)".format(espeed,flowrate,60.*flowrate/1000.,digits=d))
+					self.write(";Extr. volume: {0:.{digits}f} uL| Filament area: {1:.{digits}f} mm^2".format(extruded_volume,filamentarea,digits=d))
+					self.write(";Filament width (elliptical assumption): {0:.{digits}f} mm".format(filamentwidth,digits=d))
+				else:
+					self.flow_statistics.add(flowrate,filamentwidth)
 		elif xyzdistance == 0.0 and edistance != 0.0:
 			move_time = 60.*edistance/self.speed
-			espeed = 60.*edistance/move_time # mm/min
-			flowrate = espeed*self.syringe_cross_section/60. # uL/s
-			print(";Extr. rate: {0:.{digits}f} mm/min ({1:.{digits}f} uL/s | {2:.{digits}f} mL/min)".format(espeed,flowrate,60.*flowrate/1000.,digits=d))
-			print(";Extr. volume {0:.{digits}f} uL".format(extruded_volume,digits=d))
+			if self._diagnostic_level >= AGGREGATE:
+				espeed = 60.*edistance/move_time # mm/min
+				flowrate = espeed*self.syringe_cross_section/60. # uL/s
+				if self._diagnostic_level == FULL:
+					self.write(";Extr. rate: {0:.{digits}f} mm/min ({1:.{digits}f} uL/s | {2:.{digits}f} mL/min)".format(espeed,flowrate,60.*flowrate/1000.,digits=d))
+					self.write(";Extr. volume {0:.{digits}f} uL".format(extruded_volume,digits=d))
+				else:
+					self.flow_statistics.add(flowrate)
 			
 		self.print_time += move_time
 
@@ -142,29 +233,61 @@ class G(object):
 			self.extrusion_distance += edistance
 		
 		# record position
-		for axes in AXES:
-			self.position_history[axes].append(self._current_position[axes])
+		self._history.record(self._current_position,self.speed)
+		return diffs
 
 	def _format_args(self,x,y,z,e,**kwargs):
-		d = self.output_digits
-	 	args = []
-	 	# Look for passed kwargs representing the axes
-	 	if x is not None:
-	 		args.append('{0}{1:.{digits}f}'.format('X',x,digits=d))
-	 	if y is not None:
-	 		args.append('{0}{1:.{digits}f}'.format('Y',y,digits=d))
-	 	if z is not None:
-	 		args.append('{0}{1:.{digits}f}'.format('Z',z,digits=d))
-	 	if e is not None:
-	 		args.append('{0}{1:.{digits}f}'.format('E',e,digits=d))
-	 	args += ['{0}{1:.{digits}f}'.format(k,kwargs[k],digits=d) for k in sorted(kwargs)]
-	 	# Join them all together
-	 	args = ' '.join(args)
-	 	return args
+		letters = ()
+		values = ()
+		# Look for passed kwargs representing the axes
+		if x is not None:
+			letters += ('X',)
+			values += (x,)
+		if y is not None:
+			letters += ('Y',)
+			values += (y,)
+		if z is not None:
+			letters += ('Z',)
+			values += (z,)
+		if e is not None:
+			letters += ('E',)
+			values += (e,)
+		if kwargs:
+			keys = tuple(sorted(kwargs)) if len(kwargs) > 1 else tuple(kwargs)
+			letters += keys
+			values += tuple(kwargs[k] for k in keys)
+		return gcode_format.format_args(letters,values,self.output_digits,self.minimal_output)
+
+	def _format_step_args(self,diffs):
+		# render moved axes from integer steps: deltas when relative, positions when absolute
+		letters = tuple(axes for axes in AXES if axes in diffs)
+		if self.is_relative:
+			steps = [diffs[axes] for axes in letters]
+		else:
+			steps = [self._current_position[axes] for axes in letters]
+		steps_per_mm = [self.mm_to_steps[axes] for axes in letters]
+		return gcode_format.format_step_args(letters,steps,steps_per_mm,self.output_digits,self.minimal_output)
 
 	# ---------- UI METHODS ---------- #
 	def write(self,statement_in):
-		print(statement_in)
+		if self._toolpath is not None:
+			self._toolpath.raw(statement_in,self.speed)
+		else:
+			self.output.write(statement_in)
+
+	def write_lines(self,lines):
+		""" Write lines that are already rendered (batches, optimized toolpaths) to the sink """
+		self.output.write_lines(lines)
+
+	def write_block(self,text,lines=None):
+		""" Write rendered lines given as one text, each line ending in a newline (batches)
+
+		lines is the number of lines of text, if known.
+		"""
+		self.output.write_block(text,lines)
+
+	def flush(self):
+		self.output.flush()
 
 	def move(self,x=None,y=None,z=None,e=None,extrusionunit='mm'):
 		# Calculate extrusion distance from volume if applicable
@@ -172,17 +295,91 @@ class G(object):
 			if extrusionunit == 'uL' or extrusionunit == 'ul':
 				e = e/self.syringe_cross_section # mm
 		# Update internal tracking variables
-		self._update_current_position(x,y,z,e)
-		args = self._format_args(x,y,z,e)
+		diffs = self._update_current_position(x,y,z,e)
+		if self._toolpath is not None:
+			self._toolpath.move(diffs,self.speed)
+			return
+		if self.step_coordinates:
+			args = self._format_step_args(diffs)
+		else:
+			args = self._format_args(x,y,z,e)
 		cmd = 'G1 '+ args
 		# Print the line
 		self.write(cmd)
 
-	def circular_move(self,radius,axis='+X',e=None,extrusionunit='mm',direction='CW'):
+	def move_many(self,x=None,y=None,z=None,e=None,extrusionunit='mm'):
+		""" Apply a batch of moves at once (requires NumPy)
+		Parameters
+		----------
+		x, y, z, e : array-like or float
+			Per-move axis values, exactly as they would be passed to move().
+			Scalars are repeated for every move of the batch.
+		extrusionunit : str
+			Units of e ('mm' or 'uL')
+
+		Step counts, distances, volume and print time match calling move() for
+		each element in turn; the lines are emitted to the sink in chunks of
+		batch.BATCH_CHUNK moves. Returns the number of moves.
+		"""
+		from batch import move_many
+		return move_many(self,x,y,z,e,extrusionunit)
+
+	def circular_move(self,radius,axis='+X',e=None,extrusionunit='mm',direction='CW',segment_length=ARC_SEGMENT_LENGTH,linearize=False):
+		""" Full circle starting and ending at the current position
+		Parameters
+		----------
+		radius : float
+			Radius of the circle (mm)
+		axis : str
+			Where the centre is relative to the head ('+X', '-X', '+Y' or '-Y')
+		e : float
+			Extrusion over the whole circle
+		extrusionunit : str
+			Units of e ('mm' or 'uL')
+		direction : str
+			'CW' (G2) or 'CCW' (G3)
+		segment_length : float
+			Length of the segments the firmware splits the arc into (mm)
+		linearize : bool
+			If true, emit the segments as G1 chords instead of a G2/G3
+		"""
 		if ('X' not in axis) and ('Y' not in axis):
 			raise RuntimeError('Axis of circular move not indicated.')
 		if ('+' not in axis) and ('-' not in axis):
 			raise RuntimeError('Positive or negative not indicated.')
+		# Angle from the centre to the head
+		if "X" in axis:
+			start_angle = 180.0 if "+" in axis else 0.0
+		else:
+			start_angle = 270.0 if "+" in axis else 90.0
+		if self._diagnostic_level == FULL:
+			self.write(";Circular path -> Dir: {} | D: {} mm | C: {} mm".format(axis,2*radius,2*radius*math.pi))
+		self.arc_move(radius,start_angle,None,e,extrusionunit,direction,segment_length,linearize)
+
+	def arc_move(self,radius,start_angle,end_angle=None,e=None,extrusionunit='mm',direction='CW',segment_length=ARC_SEGMENT_LENGTH,linearize=False):
+		""" Arc around a centre at distance radius from the head
+		Parameters
+		----------
+		radius : float
+			Radius of the arc (mm)
+		start_angle : float
+			Angle (degrees, counterclockwise from +X) from the centre to the current position
+		end_angle : float
+			Angle of the end point, None for a full circle
+		e : float
+			Extrusion over the whole arc
+		extrusionunit : str
+			Units of e ('mm' or 'uL')
+		direction : str
+			'CW' (G2) or 'CCW' (G3)
+		segment_length : float
+			Length of the segments the firmware splits the arc into (mm)
+		linearize : bool
+			If true, emit the segments as G1 chords instead of a G2/G3
+		"""
+		import arcs
+		if direction not in ('CW','CCW'):
+			raise RuntimeError('Direction must be CW or CCW.')
 		# Change to relative positioning if not already since this function only works
 		# with relative position
 		changed_positioning = False
@@ -190,68 +387,95 @@ class G(object):
 			self.relative() # change to relative
 			changed_positioning = True # flag to change back later
 
-		self.write(";Circular path -> Dir: {} | D: {} mm | C: {} mm".format(axis,2*radius,2*radius*math.pi))
 		# Calculate extrusion distance from volume if applicable
 		if e is not None:
 			if extrusionunit == 'uL' or extrusionunit == 'ul':
 				e = e/self.syringe_cross_section # mm
+		sweep = arcs.sweep_angle(start_angle,end_angle,direction)
+		a0 = math.radians(start_angle)
+		if linearize:
+			from batch import quantize_relative
+			import numpy as np
+			chords = arcs.chord_deltas(radius,start_angle,sweep,segment_length)
+			n = len(chords)
+			x = quantize_relative(self,AXES[0],chords[:,0])
+			y = quantize_relative(self,AXES[1],chords[:,1])
+			e = None if e is None else quantize_relative(self,EXTRUSION_AXES[0],np.full(n,e/n))
+			self.move_many(x=x,y=y,e=e)
+		else:
+			# centre offset from the start point, end point offset (none for a full circle)
+			i = -radius*math.cos(a0)
+			j = -radius*math.sin(a0)
+			if end_angle is None:
+				dx = dy = None
+			else:
+				a1 = a0 + sweep
+				dx = radius*(math.cos(a1)-math.cos(a0))
+				dy = radius*(math.sin(a1)-math.sin(a0))
+			path_length = float(arcs.arc_length(radius,sweep,segment_length))
+			diffs = self._apply_arc(dx,dy,e,path_length,(i,j,sweep))
+			kwin = {}
+			if abs(i) > 1e-12:
+				kwin['I'] = i
+			if abs(j) > 1e-12:
+				kwin['J'] = j
+			if self._toolpath is not None:
+				self._toolpath.arc(direction == 'CW',diffs,self.speed,i=kwin.get('I',0.0),j=kwin.get('J',0.0))
+			else:
+				# Choose the correct G command to complete the move
+				cmd = 'G2 ' if direction == 'CW' else 'G3 '
+				cmd += self._format_args(x=dx,y=dy,z=None,e=e,**kwin)
+				self.write(cmd)
+
+		# change back to absolute positioning if that's what was being used.
+		if changed_positioning:
+			self.absolute()
+
+	def _apply_arc(self,dx,dy,e,path_length,arc=None):
+		""" Update position and statistics for a (relative) arc along a path of path_length mm
+		arc is the (i, j, sweep) geometry kept in the position history.
+		"""
 		# The printer currently does not have a retract function
 		# Extruded material cannot be retracted.
 		# For these two reasons above, the below must be executed for tracking amount of volume used.
 		# If e_move is negative, it should not add to total volume extruded
 		# If e_move does not add to the current e_position 
-		if e is not None:
-			axes = EXTRUSION_AXES[0]
-			destination = e + self._get_position(axes,'mm') if self.is_relative else e
+		diffs = {}
+		edistance = 0.0
+		extruded_volume = 0.0
+		for axes,value in zip((AXES[0],AXES[1],EXTRUSION_AXES[0]),(dx,dy,e)):
+			if value is None:
+				continue
+			destination = value + self._get_position(axes,'mm')
 			target = int(round(destination*self.mm_to_steps[axes]))
 			diff = target - self._get_position(axes)
-			edistance = abs(diff*self.steps_to_mm[axes])
-			self.extrusion_distance += edistance
-			if target > self.max_e_position:
-				ediff = target - self.max_e_position
-				extruded_volume = ediff*self.steps_to_mm[axes]*self.syringe_cross_section # uL
-				self.extrusion_volume += extruded_volume
-				self.max_e_position = target
+			diffs[axes] = diff
+			if axes in EXTRUSION_AXES:
+				edistance = abs(diff*self.steps_to_mm[axes])
+				self.extrusion_distance += edistance
+				if target > self.max_e_position:
+					ediff = target - self.max_e_position
+					extruded_volume = ediff*self.steps_to_mm[axes]*self.syringe_cross_section # uL
+					self.extrusion_volume += extruded_volume
+					self.max_e_position = target
 			self._current_position[axes] += diff
 
-		# Add XYX displacement to total distance
-		xydistance = 2*math.pi*radius # should be updated later to account for discrete movement
-		self.travel_distance += xydistance
-		move_time = 60.*xydistance/self.speed
-		if edistance != 0.0:
+		# Add XY displacement along the linearized arc to total distance
+		self.travel_distance += path_length
+		move_time = 60.*path_length/self.speed
+		if edistance != 0.0 and self._diagnostic_level >= AGGREGATE:
 			espeed = 60.*edistance/move_time # mm/min
 			flowrate = espeed*self.syringe_cross_section/60. # uL/s
-			d = self.output_digits
-			print(";Extrusion rate: {0:.{digits}f} mm/min | Flow rate: {1:.{digits}f} uL/s".format(espeed,flowrate,digits=d))
+			if self._diagnostic_level == FULL:
+				d = self.output_digits
+				self.write(";Extrusion rate: {0:.{digits}f} mm/min | Flow rate: {1:.{digits}f} uL/s".format(espeed,flowrate,digits=d))
+			else:
+				self.flow_statistics.add(flowrate,filament_width(extruded_volume,path_length,self.layer_height))
 		self.print_time += move_time
 
-		# Figure out direction to make circle
-		if "+" in axis:
-			r = radius
-		elif "-" in axis:
-			r = -radius
-		if "X" in axis:
-			kwin = {"I":r}
-		elif "Y" in axis:
-			kwin = {"J":r}
-		# Choose the correct G command to complete the move
-		if direction == 'CW':
-			cmd = 'G2 '
-		elif direction == 'CCW':
-			cmd = 'G3 '
-		# Format the move
-		args = self._format_args(x=None,y=None,z=None,e=e,**kwin)
-		# Write command
-		cmd += args
-		self.write(cmd)
-
 		# record position
-		for axes in AXES:
-			self.position_history[axes].append(self._current_position[axes])
-
-		# change back to absolute positioning if that's what was being used.
-		if changed_positioning:
-			self.absolute()
+		self._history.record(self._current_position,self.speed,path_length,arc)
+		return diffs
 
 	def set_feedrate(self,rate,extrusionunit='mm/min'):
 		""" Set the feed rate (tool head speed) in mm/min
@@ -263,25 +487,69 @@ class G(object):
 			Units to use when specifying extrusion rate ('mm/min', 'uL/min', mL/min or uL/s)
 		"""
 		d = self.output_digits
+		self.speed = self._speed_from_rate(rate,extrusionunit)
+		if self._diagnostic_level == FULL:
+			self.write(self._feedrate_comment(self.speed))
+		if self._toolpath is not None:
+			self._toolpath.set_feed(self.speed)
+		else:
+			self.write('G1 '+gcode_format.format_args(('F',),(self.speed,),d,self.minimal_output))
+
+	def _speed_from_rate(self,rate,extrusionunit='mm/min',tool=None):
+		# convert a feed rate given in any supported unit to head speed (mm/min),
+		# for the syringe of the active tool or of the given one
+		cross_section = self.syringe_cross_section if tool is None else self.tools[tool].syringe_cross_section
 		if extrusionunit == 'mm/min':
-			self.speed = rate
+			return rate
 		elif extrusionunit == 'uL/min':
-			self.speed = rate / self.syringe_cross_section
+			return rate / cross_section
 		elif extrusionunit == 'mL/min':
-			self.speed = 1000*rate / self.syringe_cross_section
+			return 1000*rate / cross_section
 		elif extrusionunit == 'uL/s':
-			self.speed = rate / (60.*self.syringe_cross_section)
+			return rate / (60.*cross_section)
+		return self.speed
 
-		self.write(";Extr. rate: {0:.{digits}f} mm/min ({1:.{digits}f} uL/s | {2:.{digits}f} mL/min)".format(self.speed,self.speed*self.syringe_cross_section/60,self.speed*self.syringe_cross_section/1000,digits=d))
-		self.write('G1 F{:.{digits}f}'.format(self.speed,digits=d))
-		
+	def _feedrate_comment(self,speed):
+		d = self.output_digits
+		return ";Extr. rate: {0:.{digits}f} mm/min ({1:.{digits}f} uL/s | {2:.{digits}f} mL/min)".format(speed,speed*self.syringe_cross_section/60,speed*self.syringe_cross_section/1000,digits=d)
+
+	def select_tool(self,index):
+		""" Make extruder index the active tool (T command)
+		The syringe and tip of the tool are used for volumes and flow rates from
+		now on. Its plunger resumes where it stopped: material it had retracted
+		is pushed back before it counts as extruded again.
+		"""
+		if not 0 <= index < self.num_extruder:
+			raise RuntimeError('Tool {} does not exist ({} extruders).'.format(index,self.num_extruder))
+		if index == self.active_tool:
+			return
+		self._store_tool()
+		tool = self.tools[index]
+		# keep the retraction of the tool relative to the current E position
+		self.max_e_position = self._current_position[EXTRUSION_AXES[0]] + tool.max_e_position - tool.e_position
+		self.active_tool = index
+		self._load_tool(tool)
+		self._history.record_tool(index)
+		self.print_time += self.tool_change_time
+		self.write('T{}'.format(index))
+
+	def tool_volumes(self):
+		""" Volume (uL) delivered by every tool """
+		self._store_tool()
+		return [tool.extrusion_volume for tool in self.tools]
 
 	def relative(self):
-		self.write('G91')
+		if self._toolpath is not None:
+			self._toolpath.set_relative(True,self.speed)
+		else:
+			self.write('G91')
 		self.is_relative = True
 
 	def absolute(self):
-		self.write('G90')
+		if self._toolpath is not None:
+			self._toolpath.set_relative(False,self.speed)
+		else:
+			self.write('G90')
 		self.is_relative = False
 
 	def cold_extrusion(self,mode=True):
@@ -307,6 +575,11 @@ class G(object):
 			self.steps_to_mm[AXES[3]] = 1./e
 			self.mm_to_steps[AXES[3]] = e
 
+		if self._toolpath is not None:
+			values = dict((axes,v) for axes,v in zip(AXES,(x,y,z,e)) if v is not None)
+			self._toolpath.set_steps_per_mm(values,comment,self.speed)
+			return
+
 		args = self._format_args(x,y,z,e)
 		cmd = 'M92 '+args
 
@@ -318,10 +591,118 @@ class G(object):
 		self.write(cmd)
 
 
+	# ---------- Profiling ---------- #
+	def instrument(self,methods=None,trace_memory=True):
+		""" Start profiling this generator and return the Instrumentation (see instrumentation.py) """
+		from instrumentation import Instrumentation,DEFAULT_METHODS
+		if self.instrumentation is None:
+			self.instrumentation = Instrumentation(self,DEFAULT_METHODS if methods is None else methods,trace_memory)
+		return self.instrumentation.attach()
+
+	def _dump_profile(self,name,elapsed,args,kwargs):
+		# the program is done: stop tracing allocations (if profiling started it) before writing the profile
+		self.instrumentation.stop_tracing()
+		self.instrumentation.dump(self.profile)
+
+	# ---------- Branching ---------- #
+	def snapshot(self):
+		""" Capture the state of the generator and its output, see branching.py """
+		from branching import Snapshot
+		return Snapshot(self)
+
+	def restore(self,snapshot):
+		""" Go back to a snapshot of this generator, discarding the output written since """
+		from branching import restore
+		restore(self,snapshot)
+
+	def fork(self,output=None,snapshot=None):
+		""" A new generator continuing from here (or from a snapshot), sharing the program so far
+		Parameters
+		----------
+		output : Sink (default: None)
+			Output of the fork, by default a fork of this one (MemorySink, NullSink)
+		snapshot : Snapshot (default: None)
+			Branch from this snapshot instead of the current state
+		"""
+		from branching import fork
+		return fork(self,output,snapshot)
+
+	# ---------- Recording ---------- #
+	def start_recording(self):
+		""" Capture subsequent commands into a Toolpath instead of writing them """
+		if self._toolpath is None:
+			self._toolpath = Toolpath(self._current_position,self.mm_to_steps,self.is_relative,self.speed,self.active_tool)
+
+	def emit(self,passes=None):
+		""" Stop recording, optimize the recorded toolpath and write it to the sink
+		Parameters
+		----------
+		passes : sequence of callables (default: None)
+			Optimization passes (Toolpath -> Toolpath), defaults to toolpath.DEFAULT_PASSES
+
+		Returns the optimized Toolpath.
+		"""
+		if self._toolpath is None:
+			raise RuntimeError('G is not recording.')
+		toolpath = self._toolpath.optimize(passes)
+		self._toolpath = None
+		self.write_lines(toolpath.lines(self.output_digits,self.minimal_output))
+		return toolpath
+
+	def emit_binary(self,target,passes=None):
+		""" Stop recording and write the optimized toolpath in the binary format (see binary_gcode.py)
+		Parameters
+		----------
+		target : str or binary stream
+			File to write (gzip-compressed if the name ends in .gz)
+		passes : sequence of callables (default: None)
+			Optimization passes, defaults to toolpath.DEFAULT_PASSES
+
+		Returns the number of bytes of the encoding (before gzip).
+		"""
+		import binary_gcode
+		if self._toolpath is None:
+			raise RuntimeError('G is not recording.')
+		toolpath = self._toolpath.optimize(passes)
+		self._toolpath = None
+		return binary_gcode.write(toolpath,target,self.output_digits,self.minimal_output)
+
+	def plan_flow(self,max_flow=None,max_shear_rate=None,max_feed=None,max_segment_time=None,passes=None,report=False):
+		""" Stop recording, cap the flow of every move (see flow_planner.py) and write the toolpath
+		Parameters
+		----------
+		max_flow : float (default: None)
+			Volumetric flow limit (uL/s), by default the one of each tip profile
+		max_shear_rate : float (default: None)
+			Wall shear rate limit in the tip (1/s), by default the one of each tip profile
+		max_feed : float (default: None)
+			Head speed (mm/min) extruding moves may be sped up to
+		max_segment_time : float (default: None)
+			Longest duration (s) of a linear dispense, longer ones are split
+		passes : sequence of callables (default: None)
+			Optimization passes run before planning, defaults to toolpath.DEFAULT_PASSES
+		report : bool (default: False)
+			If true, the limiting constraint of every segment and a summary are written after the program
+
+		Returns the FlowPlan. print_time is updated to the planned durations.
+		"""
+		from flow_planner import FlowLimiter
+		if self._toolpath is None:
+			raise RuntimeError('G is not recording.')
+		limiter = FlowLimiter(self.tools,max_flow,max_shear_rate,max_feed,max_segment_time,self.output_digits)
+		toolpath = limiter(self._toolpath.optimize(passes))
+		self._toolpath = None
+		self.write_lines(toolpath.lines(self.output_digits,self.minimal_output))
+		plan = limiter.plan
+		self.print_time += plan.time - plan.requested_time
+		if report:
+			self.write_lines(plan.lines(self.output_digits) + plan.summary(self.output_digits))
+		return plan
+
 	# ---------- G-Code COMMENT METHODS --------- #
 
 	def print_blank_line(self):
-		print(' ')
+		self.write(' ')
 
 	def setup(self):
 		if self.include_header:
@@ -330,7 +711,8 @@ class G(object):
 		# set as relative move
 		self.relative()
 		# set the axis steps per unit
-		self.set_axis_steps_per_mm(x=DEFAULT_AXIS_STEPS_PER_MM[0],y=DEFAULT_AXIS_STEPS_PER_MM[1],z=DEFAULT_AXIS_STEPS_PER_MM[2],e=DEFAULT_AXIS_STEPS_PER_MM[3])
+		x,y,z,e = self.printer.steps_per_mm
+		self.set_axis_steps_per_mm(x=x,y=y,z=z,e=e)
 		# turn off cold extrusion prevention
 		self.cold_extrusion()
 		# set initial speed
@@ -342,26 +724,35 @@ class G(object):
 		# load the set output digits
 		d = self.output_digits
 		self.write(';Printer is using {}X microstepping'.format(self.microstepping))
-		self.write(';There are {} steps per revolution of the motor.'.format(STEPS_PER_REVOLUTION))
+		self.write(';There are {} steps per revolution of the motor.'.format(self.printer.steps_per_revolution))
 		args = [axes+str(1000.*self.steps_to_mm[axes]) for axes in AXES]
 		args = ' '.join(args)
 		self.write(';Min. travel/extrusion distance (um): '+args)
 		self.write(';Syringe type: {}'.format(self.syringe))
 		self.write(';Syringe extrusion (uL/mm): {:.{digits}f}'.format(self.syringe_cross_section,digits=d))
-		self.write(';Syringe waste volume (mL): {}'.format(SYRINGE_WASTE_SPACE[self.syringe]))
+		self.write(';Syringe waste volume (mL): {}'.format(self.tools[self.active_tool].profile.syringe.waste_volume))
 		self.write(';Min. extrudable volume (uL): {:.{digits}f}'.format(self.steps_to_mm[AXES[3]]*self.syringe_cross_section,digits=d))
 		self.write(';Tip type: {}'.format(self.tip))
 		self.write(';Tip diameter (mm): {:.{digits}f}'.format(self.tip_cross_section,digits=d))
-		self.write(';Tip void volume (mL): {:.{digits}f}'.format(TIP_VOID_VOLUME[self.tip],digits=d))
+		self.write(';Tip void volume (mL): {:.{digits}f}'.format(self.tools[self.active_tool].profile.tip.void_volume,digits=d))
 		self.write(';Volumetric flow: {:.{digits}f} uL/min for every 100 mm/min'.format(100*self.syringe_cross_section,digits=d))
 		self.write(';For syringe extrusion rate of 100 mm/min, tip extrusion rate is {:.{digits}f} mm/min'.format(100.0*self.syringe_cross_section/self.tip_cross_section,digits=d))
+		if self.num_extruder > 1:
+			for tool in self.tools:
+				self.write(tool.line(d))
 
 	def summary_report(self):
-		self.write('')
-		self.report_current_location()
-		self.report_distances()
-		self.report_extrusion_volume()
-		self.report_print_time()
+		if self._diagnostic_level >= SUMMARY:
+			self.write('')
+			self.report_current_location()
+			self.report_distances()
+			self.report_extrusion_volume()
+			self.report_print_time()
+			if self._diagnostic_level == AGGREGATE:
+				self.report_flow_statistics()
+			if self.planner_estimate:
+				self.report_planner_time()
+		self.flush()
 
 	def report_current_location(self):
 		d = self.output_digits
@@ -371,7 +762,7 @@ class G(object):
 			args.append('{0}{1:.{digits}f}'.format(axes,pos,digits=d))
 		args = ' '.join(args)
 		msg = ';Current location (mm): ' + args
-		print(msg)
+		self.write(msg)
 
 	def report_distances(self):
 		d = self.output_digits
@@ -384,57 +775,252 @@ class G(object):
 		d = self.output_digits
 		msg = ';Total extruded volume: {} uL'.format(self.extrusion_volume)
 		self.write(msg)
+		if self.num_extruder > 1:
+			for k,volume in enumerate(self.tool_volumes()):
+				self.write(';Tool {0} extruded volume: {1:.{digits}f} uL'.format(k,volume,digits=d))
+
+	def report_flow_statistics(self):
+		for line in self.flow_statistics.lines(self.output_digits):
+			self.write(line)
+
+	def _format_duration(self,duration):
+		if duration > 60.0:
+			minutes,seconds = divmod(duration,60.0)
+			return '{0} min {1:.{digits}f} s'.format(int(minutes),seconds,digits=self.output_digits)
+		return '{0:.{digits}f} s'.format(duration,digits=self.output_digits)
 
 	def report_print_time(self):
 		msg = ';Total print time: '
+		msg += self._format_duration(self.print_time)
+		self.write(msg)
 
-		if self.print_time > 60.0:
-			minutes,seconds = divmod(self.print_time,60.0)
-			time_report = '{0} min {1:.{digits}f} s'.format(int(minutes),seconds,digits=self.output_digits)
-		else:
-			time_report = '{0:.{digits}f} s'.format(self.print_time,digits=self.output_digits)
-
-		msg += time_report
+	def report_planner_time(self,**limits):
+		""" Report the print time estimated with acceleration, jerk and lookahead
+		Keyword arguments (max_acceleration, max_jerk, lookahead) are passed to
+		motion_planner.estimate_print_time. Requires the position history.
+		"""
+		from motion_planner import estimate_print_time
+		# planner limits of the printer profile unless given
+		for key in ('max_acceleration','max_jerk'):
+			if getattr(self.printer,key) is not None:
+				limits.setdefault(key,getattr(self.printer,key))
+		times,total = estimate_print_time(self,**limits)
+		msg = ';Estimated print time (acceleration model): {} | constant feedrate: {}'.format(self._format_duration(total),self._format_duration(self.print_time))
 		self.write(msg)
+		return times
+
+	# ---------- Validation ---------- #
+	def validate(self,limits=None,keepouts=(),origin=(0.0,0.0,0.0),source=None):
+		""" First move outside the soft limits or into a keep-out box, None if the program is safe
+		Parameters
+		----------
+		limits : dict (default: None)
+			Axis -> (low, high) machine coordinates (mm) for any of X, Y and Z
+		keepouts : sequence (default: ())
+			Boxes ((xmin,xmax),(ymin,ymax),(zmin,zmax)) the tip must not enter (mm)
+		origin : tuple (default: (0,0,0))
+			Machine coordinates of the head when the program started (mm)
+		source : str or list (default: None)
+			Program text for the line number, by default the output of the sink
+
+		See validation.py. Requires the position history and NumPy.
+		"""
+		from validation import find_violation
+		return find_violation(self,limits,keepouts,origin,source=source)
 
 # ========== Cartesian shape functions ========== #
-	def print_disc(self,r2,r1,step,thickness,direction='outwards'):
+	def print_disc(self,r2,r1,step,thickness,direction='outwards',segment_length=ARC_SEGMENT_LENGTH,linearize=False):
+		""" Concentric rings from radius r2 down to r1, starting on the outer ring
+		The volume of the disc is distributed over the rings in proportion to the
+		length of their linearized paths. With linearize, the whole disc is emitted
+		as one batch of G1 chords.
+		"""
+		import numpy as np
+		import arcs
 		num_ring = int(1+(r2-r1)/step)
-		step_list = [step*i for i in range(num_ring)]
-		radii = [r2-i for i in step_list]
-		circums = [2*math.pi*r for r in radii]
-		total_path_length = sum(circums)
-		weights = [i/total_path_length for i in circums] # in mm
+		radii = r2 - step*np.arange(num_ring)
+		lengths = arcs.arc_length(radii,2*math.pi,segment_length)
+		weights = lengths/lengths.sum()
 		# now calculate total volume
 		vol = math.pi*thickness*((r2**2) - (r1**2))
 		# calculate e move
 		total_e = vol/self.syringe_cross_section
-		e_list = [total_e*i for i in weights]
-		# plan for move
-		for i in range(num_ring):
-			self.circular_move(radii[i],e=e_list[i])
-			if i != (num_ring-1):
-				self.move(x=step)
+		e_list = total_e*weights
+		if not linearize:
+			# plan for move
+			for i in range(num_ring):
+				self.circular_move(float(radii[i]),e=float(e_list[i]),segment_length=segment_length)
+				if i != (num_ring-1):
+					self.move(x=step)
+			return
+		# every ring starts on its left (centre at +X) and is drawn clockwise
+		chords,counts = arcs.ring_chords(radii,180.0,-2*math.pi,segment_length)
+		ring = np.repeat(np.arange(num_ring),counts)
+		e_moves = (e_list/counts)[ring]
+		# insert the step towards the centre after every ring but the last
+		ends = np.cumsum(counts)[:-1]
+		x = np.insert(chords[:,0],ends,step)
+		y = np.insert(chords[:,1],ends,0.0)
+		e_moves = np.insert(e_moves,ends,0.0)
+		changed_positioning = False
+		if self.is_relative == False:
+			self.relative()
+			changed_positioning = True
+		from batch import quantize_relative
+		x = quantize_relative(self,AXES[0],x)
+		y = quantize_relative(self,AXES[1],y)
+		e_moves = quantize_relative(self,EXTRUSION_AXES[0],e_moves)
+		self.move_many(x=x,y=y,e=e_moves)
+		if changed_positioning:
+			self.absolute()
 
 	def print_square(self,side,layerheight,spacing=0.2,redundancy=2,lift=0.0):
+		""" Fill a side x side square layer centred on the current position (see print_polygon)
+
+		The layer volume (side*side*layerheight) is split over the redundant passes.
+		"""
 		self.print_blank_line()
 		layervolume = layerheight*(side**2)
 		msg1 = ";Printing square layer: {0} X {0} X {1}mm".format(side,layerheight)
-		print(msg1)
+		self.write(msg1)
 		msg2 = ";Layer volume: {} uL".format(layervolume)
-		print(msg2)
-		if lift>0.0:
+		self.write(msg2)
+		import infill
+		self.print_polygon(infill.rectangle(side,side),layerheight,spacing,redundancy,lift)
+
+	def print_polygon(self,vertices,layerheight,spacing=0.2,redundancy=1,lift=0.0,angle=0.0,pass_angle=90.0,volume=None):
+		""" Fill a polygonal layer with rectilinear serpentine infill (see infill.py)
+		Parameters
+		-----------
+		vertices : sequence of (x,y)
+			Outline of the layer (mm), relative to the current position
+		layerheight : float
+			Layer height (mm)
+		spacing : float (default: 0.2)
+			Distance between infill lines (mm)
+		redundancy : int (default: 1)
+			Number of passes over the layer, each rotated by pass_angle
+		lift : float (default: 0.0)
+			Z lift for travel moves between polylines (mm, 0 travels without lifting)
+		angle : float (default: 0.0)
+			Direction of the infill lines of the first pass (degrees from +X)
+		pass_angle : float (default: 90.0)
+			Rotation between redundant passes (degrees)
+		volume : float (default: None)
+			Layer volume (uL), by default the polygon area times layerheight.
+			This is the total over all passes: with redundancy=2 each pass
+			deposits about half of it (pass it multiplied by redundancy for a
+			full layer volume per pass)
+
+		The volume is distributed over the infill moves of all passes in
+		proportion to their length and every polyline is emitted as one batch.
+		The head returns to the start position at the end.
+		"""
+		import numpy as np
+		import infill
+		from batch import quantize_relative
+		if volume is None:
+			volume = infill.polygon_area(vertices)*layerheight # uL
+		paths = infill.layer_paths(vertices,spacing,redundancy,angle,pass_angle)
+		volumes = infill.path_volumes(paths,volume)
+		changed_positioning = False
+		if self.is_relative == False:
+			self.relative()
+			changed_positioning = True
+		origin = dict((axes,self._get_position(axes)) for axes in AXES[:2])
+		for path,vols in zip(paths,volumes):
+			self._travel_to(origin,path[0],lift)
+			deltas = np.diff(path,axis=0)
+			x = quantize_relative(self,AXES[0],deltas[:,0])
+			y = quantize_relative(self,AXES[1],deltas[:,1])
+			e = quantize_relative(self,EXTRUSION_AXES[0],vols/self.syringe_cross_section)
+			self.move_many(x=x,y=y,e=e)
+		if paths:
+			self._travel_to(origin,(0.0,0.0),lift)
+		if changed_positioning:
+			self.absolute()
+
+	def _travel_to(self,origin,target,lift=0.0):
+		# relative travel to target (mm from the origin step position), without drift
+		dx = target[0] - (self._get_position(AXES[0])-origin[AXES[0]])*self.steps_to_mm[AXES[0]]
+		dy = target[1] - (self._get_position(AXES[1])-origin[AXES[1]])*self.steps_to_mm[AXES[1]]
+		if abs(dx) < 0.5*self.steps_to_mm[AXES[0]] and abs(dy) < 0.5*self.steps_to_mm[AXES[1]]:
+			return
+		if lift > 0.0:
 			self.move(z=-lift)
-			self.move(x=-side/2.,y=-side/2.)
+			self.move(x=dx,y=dy)
 			self.move(z=lift)
 		else:
-			self.move(x=-side/2.,y=-side/2.)
-		# 
+			self.move(x=dx,y=dy)
+
+	def print_scaffold(self,vertices,layers,layerheight,spacing=0.2,redundancy=1,lift=0.0,angle=0.0,layer_angle=90.0):
+		""" Stack layers of rectilinear infill (see print_polygon), each rotated by layer_angle """
+		for i in range(layers):
+			self.write(';Scaffold layer {0}/{1}'.format(i+1,layers))
+			self.print_polygon(vertices,layerheight,spacing,redundancy,lift,angle+i*layer_angle)
+			if i != layers-1:
+				self.move(z=-layerheight)
 
 
 # ========== Vessel functions ========== #
-	def print_vessel(self,length,thickness):
-		pass
+	def print_vessel(self,length,thickness,layer_height=None,mode='helix',pipet=PIPET,segment_length=ARC_SEGMENT_LENGTH,chunk_turns=50):
+		""" Print a hollow cylinder around a pipet (see vessel_math.py)
+		Parameters
+		-----------
+		length : float
+			Vessel length (mm)
+		thickness : float
+			Wall thickness (um)
+		layer_height : float (default: None)
+			Rise per turn (mm), by default the layer height of G
+		mode : str (default: 'helix')
+			'helix' (continuous helical shells) or 'rings' (stacked concentric rings)
+		pipet : str (default: PIPET)
+			Pipet used as mandrel (key of PIPET_OD)
+		segment_length : float (default: ARC_SEGMENT_LENGTH)
+			Length of the chords approximating the circles (mm)
+		chunk_turns : int (default: 50)
+			Turns emitted per batch, which bounds memory for long vessels
+
+		The tip starts against the left side of the pipet at the bottom end of the
+		vessel. The vessel volume is spread over the path in proportion to length.
+		"""
+		import numpy as np
+		from vessel_math import Vessel
+		from batch import quantize_relative
+		if layer_height is None:
+			layer_height = self.layer_height
+		vessel = Vessel(length,thickness,pipet=pipet,g=self,verbose=False)
+		self.print_blank_line()
+		self.write(';Printing vessel: {0} mm long, {1} um wall, {2} shell(s), {3} turns ({4})'.format(
+			length,thickness,vessel.shell_count(),vessel.turn_count(layer_height),mode))
+		for line in vessel.settings_lines()[1:] + vessel.volume_lines():
+			self.write(';'+line)
+		e_per_mm = vessel.volume/vessel.path_length(layer_height,mode,segment_length)/self.syringe_cross_section
+		changed_positioning = False
+		if self.is_relative == False:
+			self.relative()
+			changed_positioning = True
+		# unrounded position (mm) along the path, so the chunks do not add up rounding errors
+		axes = list(AXES[:3]) + list(EXTRUSION_AXES[:1])
+		origin = dict((axis,self._get_position(axis)*self.steps_to_mm[axis]) for axis in axes)
+		for kind,x,y,z,weight in vessel.toolpath(layer_height,mode,segment_length,chunk_turns):
+			if kind == 'travel':
+				self.move(x=x if x != 0.0 else None,y=y if y != 0.0 else None,z=z if z != 0.0 else None)
+				for axis,delta in zip(AXES,(x,y,z)):
+					origin[axis] += delta
+				continue
+			moves = dict(zip(axes,(x,y,z,weight*e_per_mm)))
+			quantized = dict((axis,quantize_relative(self,axis,moves[axis],origin[axis])) for axis in axes)
+			for axis in axes:
+				origin[axis] += float(np.sum(moves[axis]))
+			if mode == 'helix':
+				self.move_many(x=quantized[AXES[0]],y=quantized[AXES[1]],z=quantized[AXES[2]],e=quantized[EXTRUSION_AXES[0]])
+			else:
+				self.move_many(x=quantized[AXES[0]],y=quantized[AXES[1]],e=quantized[EXTRUSION_AXES[0]])
+		if changed_positioning:
+			self.absolute()
+		return vessel
 
 # ========== Debug functions ========== # 
 	def run_test(self):
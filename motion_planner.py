@@ -0,0 +1,151 @@
+import numpy as np
+from config import *
+
+"""
+Acceleration-aware print time estimate (trapezoidal motion planner model).
+
+G's print_time assumes every move runs at the programmed feedrate from start to
+finish. Firmware actually accelerates and decelerates every move, and slows
+down at corners so that the change of velocity of each axis stays below its
+jerk limit. It can only plan across the moves in its buffer (the lookahead).
+
+The model, per move k with length L, acceleration a and nominal speed v:
+1. junction speed limit between moves from the per-axis jerk
+2. backward pass: entry speed^2 <= exit speed^2 + 2aL, only over the next
+   `lookahead` moves, the last of which must end at its safe (jerk) speed
+3. forward pass: exit speed^2 <= entry speed^2 + 2aL
+4. trapezoid (or triangle) profile time
+
+Both passes are recurrences of the form w[k] = min(B[k], w[k+1] + c[k]), which
+become (windowed) cumulative minima over prefix sums, so the whole simulation
+is vectorized.
+"""
+
+def _sliding_min(values,window):
+	# min(values[k:k+window]) for every k, padding with +inf at the end
+	padded = np.concatenate((values,np.full(window-1,np.inf)))
+	shape = (len(values),window)
+	strides = (padded.strides[0],padded.strides[0])
+	return np.lib.stride_tricks.as_strided(padded,shape=shape,strides=strides).min(axis=1)
+
+def move_times(deltas,feed,arc_length=None,max_acceleration=None,max_jerk=None,lookahead=PLANNER_LOOKAHEAD):
+	""" Estimate the duration of every move
+	Parameters
+	-----------
+	deltas : array of shape (n,4)
+		Per-move displacement (mm) of the X,Y,Z,E axes
+	feed : array of shape (n,)
+		Programmed feedrate of every move (mm/min)
+	arc_length : array of shape (n,) (default: None)
+		Path length of circular moves (0 for linear moves)
+	max_acceleration : tuple (default: None)
+		Per-axis acceleration limit (mm/s^2), by default the one of the PRINTER profile
+	max_jerk : tuple (default: None)
+		Per-axis instantaneous velocity change limit (mm/s), by default the one
+		of the PRINTER profile
+	lookahead : int (default: PLANNER_LOOKAHEAD)
+		Number of moves the planner can see ahead, None for unlimited
+
+	Returns an array of the move times (s). Moves without motion take 0 s.
+	"""
+	deltas = np.asarray(deltas,dtype=float).reshape(-1,len(AXES))
+	feed = np.asarray(feed,dtype=float)
+	n = len(deltas)
+	if arc_length is None:
+		arc_length = np.zeros(n)
+	arc_length = np.asarray(arc_length,dtype=float)
+	if max_acceleration is None:
+		max_acceleration = printer_profile().max_acceleration
+	if max_jerk is None:
+		max_jerk = printer_profile().max_jerk
+	accel_limit = np.asarray(max_acceleration,dtype=float)
+	jerk_limit = np.asarray(max_jerk,dtype=float)
+	times = np.zeros(n)
+
+	xyz = np.sqrt((deltas[:,:len(MOTION_AXES)]**2).sum(axis=1))
+	e = np.abs(deltas[:,len(MOTION_AXES)])
+	is_arc = arc_length > 0.0
+	length = np.where(is_arc,arc_length,np.where(xyz > 0.0,xyz,e))
+	moving = length > 0.0
+	if not np.any(moving):
+		return times
+	d = deltas[moving]
+	L = length[moving]
+	arc = is_arc[moving]
+	v = feed[moving]/60. # mm/s
+	unit = d/L[:,None] # per-axis share of the path speed
+	# arcs sweep X and Y without a net displacement: treat them as using both fully
+	unit[arc,0] = 1.0
+	unit[arc,1] = 1.0
+	unit[arc,2] = 0.0
+
+	# acceleration along the path, limited by the slowest contributing axis
+	with np.errstate(divide='ignore'):
+		axis_accel = np.where(np.abs(unit) > 0.0,accel_limit/np.abs(unit),np.inf)
+		a = axis_accel.min(axis=1)
+		# highest speed at which a move can start or stop abruptly
+		safe = np.minimum(v,np.where(np.abs(unit) > 0.0,jerk_limit/np.abs(unit),np.inf).min(axis=1))
+		# junction limits: per-axis velocity change when both moves run at speed u
+		change = np.abs(unit[1:]-unit[:-1])
+		junction = np.where(change > 0.0,jerk_limit/change,np.inf).min(axis=1)
+	junction = np.minimum(junction,np.minimum(v[1:],v[:-1]))
+	# nothing is known about the direction of an arc at its ends
+	touches_arc = arc[1:] | arc[:-1]
+	junction = np.where(touches_arc,np.minimum(safe[1:],safe[:-1]),junction)
+	junction = np.maximum(junction,np.minimum(safe[1:],safe[:-1]))
+	m = len(L)
+	# entry speed bound of every move, with the program starting and ending at rest
+	bound = np.concatenate(([safe[0]],junction,[0.0]))**2 # m+1 boundaries
+	c = 2.*a*L
+	S = np.concatenate(([0.0],np.cumsum(c)))
+
+	# backward pass: w[k] = min(bound[j] + S[j]) over j in the lookahead window - S[k]
+	A = bound + S
+	if lookahead is None or lookahead >= m:
+		backward = np.minimum.accumulate(A[::-1])[::-1]
+	else:
+		backward = _sliding_min(A,lookahead)
+		# the last move in the buffer has to be able to stop at its safe speed
+		end = np.arange(m+1) + lookahead
+		closing = np.full(m+1,np.inf)
+		inside = end <= m
+		closing[inside] = np.minimum(safe[end[inside]-1]**2,bound[end[inside]]) + S[end[inside]]
+		backward = np.minimum(backward,closing)
+	w = backward - S
+
+	# forward pass: entry[k] = S[k] + min(w[j] - S[j]) over j <= k
+	entry = S + np.minimum.accumulate(w - S)
+	entry = np.maximum(entry,0.0)
+	v0 = np.sqrt(entry[:-1])
+	v1 = np.sqrt(entry[1:])
+
+	# trapezoid profile time
+	accel_dist = (v**2-v0**2)/(2.*a)
+	decel_dist = (v**2-v1**2)/(2.*a)
+	cruise = L - accel_dist - decel_dist
+	trapezoid = cruise >= 0.0
+	peak = np.where(trapezoid,v,np.sqrt(np.maximum((2.*a*L+v0**2+v1**2)/2.,0.0)))
+	t = (peak-v0)/a + (peak-v1)/a + np.where(trapezoid,cruise/np.where(v > 0.0,v,1.0),0.0)
+	times[moving] = t
+	return times
+
+def history_moves(g):
+	""" Per-move displacement (mm), feedrate and arc length from g's position history """
+	history = g.position_history
+	steps = np.column_stack([np.asarray(history[axes],dtype=np.int64) for axes in AXES])
+	scale = np.array([g.steps_to_mm[axes] for axes in AXES])
+	deltas = np.diff(steps,axis=0)*scale
+	feed = np.asarray(history['feed'])[1:]
+	arc_length = np.asarray(history['arc_length'])[1:]
+	return deltas,feed,arc_length
+
+def estimate_print_time(g,max_acceleration=None,max_jerk=None,lookahead=PLANNER_LOOKAHEAD):
+	""" Return (per-move times, total) for the moves recorded in g's position history
+
+	With a 'ring' history only the moves still in the ring are estimated.
+	"""
+	if len(g.position_history[AXES[0]]) == 0:
+		raise RuntimeError('The position history is off: nothing to estimate.')
+	deltas,feed,arc_length = history_moves(g)
+	times = move_times(deltas,feed,arc_length,max_acceleration,max_jerk,lookahead)
+	return times,float(times.sum())
@@ -0,0 +1,330 @@
+import numpy as np
+from config import *
+import hardware
+import batch
+from diagnostics import AGGREGATE,FULL
+
+"""
+Declarative well plate layouts.
+
+A Layout maps wells of a plate (geometry from the plate profiles, see
+hardware.py) to dispense specs, then compiles the whole plate into G moves: lift,
+travel, lower, set the flow rate and dispense, well after well, starting with
+the tip over A1 like 96wellDepositionExperiment.py does. The plate profiles use
+the ANSI/SLAS standard pitch (9.00 mm for 96 wells); that script keeps its
+own measured 9.1 mm, so its output does not change. Register a plate profile
+with that pitch to reproduce it with a Layout.
+
+Compilation first lists the program as simple operations, then executes them
+either call by call on G (fast=False, the reference) or as one vectorized batch
+(fast=True). In the batch path each distinct dispense routine, travel move and
+feedrate block is rendered once and replayed for every well that uses it; the
+step counts, volume and time are computed for the whole plate at once and are
+the same as in the call-by-call path.
+
+Conditions can be assigned to different tools of a multi-extruder G (see
+tools.py): the program selects the tool before its wells, and the 'schedule'
+visit order groups the wells by tool to keep tool changes to a minimum.
+"""
+
+class PlateGeometry(object):
+	def __init__(self,name=WELL_PLATE):
+		"""
+		Parameters
+		-----------
+		name : str (default: WELL_PLATE)
+			Plate profile name (e.g. "96-well plate", see hardware.py)
+		"""
+		profile = hardware.plate(name)
+		self.name = name
+		self.rows,self.columns = profile.layout
+		self.pitch = profile.pitch # mm
+		self.a1_offset = profile.a1_offset # mm
+		self.depth = profile.depth # mm
+
+	def row_name(self,row):
+		# A..Z, then AA, AB, ... for 1536-well plates
+		name = ''
+		row += 1
+		while row > 0:
+			row,rem = divmod(row-1,26)
+			name = chr(ord('A')+rem) + name
+		return name
+
+	def well_name(self,row,column):
+		return '{0}{1}'.format(self.row_name(row),column+1)
+
+	def well_names(self):
+		""" All wells, row by row """
+		return [self.well_name(r,c) for r in range(self.rows) for c in range(self.columns)]
+
+	def parse(self,well):
+		""" Return the (row, column) indices of a well name such as 'B7' """
+		letters = well.rstrip('0123456789').upper()
+		digits = well[len(letters):]
+		if not letters or not digits:
+			raise RuntimeError('Invalid well name: {}'.format(well))
+		row = 0
+		for letter in letters:
+			row = 26*row + (ord(letter)-ord('A')+1)
+		row -= 1
+		column = int(digits) - 1
+		if not (0 <= row < self.rows and 0 <= column < self.columns):
+			raise RuntimeError('Well {} is not on a {}.'.format(well,self.name))
+		return row,column
+
+	def wells(self,selection):
+		""" Expand a well selection: 'A1', a rectangle 'A1:B12' or a list of those """
+		if not isinstance(selection,str):
+			return [w for item in selection for w in self.wells(item)]
+		if ':' in selection:
+			first,last = selection.split(':')
+			r0,c0 = self.parse(first)
+			r1,c1 = self.parse(last)
+			return [self.well_name(r,c) for r in range(min(r0,r1),max(r0,r1)+1) for c in range(min(c0,c1),max(c0,c1)+1)]
+		self.parse(selection)
+		return [selection.upper()]
+
+	def centre(self,well):
+		""" Centre of a well (mm) from the left and top edges of the plate """
+		row,column = self.parse(well)
+		return (self.a1_offset[0]+column*self.pitch,self.a1_offset[1]+row*self.pitch)
+
+class Layout(object):
+	def __init__(self,plate=WELL_PLATE,x_direction=-1,y_direction=-1):
+		"""
+		Parameters
+		-----------
+		plate : str or PlateGeometry (default: WELL_PLATE)
+			Plate format
+		x_direction : int (default: -1)
+			Sign of the X move from one column to the next
+		y_direction : int (default: -1)
+			Sign of the Y move from one row to the next
+		"""
+		self.plate = plate if isinstance(plate,PlateGeometry) else PlateGeometry(plate)
+		self.x_direction = x_direction
+		self.y_direction = y_direction
+		self.assignments = [] # (well, spec) in the order they were added
+		self._used = set()
+
+	def add(self,volume,rate=None,rate_unit='mL/min',replicates=1,wells=None,label=None,tool=0):
+		""" Assign a dispense condition to wells
+		Parameters
+		-----------
+		volume : float
+			Volume to dispense in every well (uL)
+		rate : float (default: None)
+			Flow rate of the dispense, in rate_unit (None keeps the current feedrate)
+		rate_unit : str (default: 'mL/min')
+			Any unit accepted by G.set_feedrate
+		replicates : int (default: 1)
+			Number of wells to fill with this condition, taken from the next free
+			wells (row by row) when wells is not given
+		wells : str or list (default: None)
+			Explicit well selection (see PlateGeometry.wells)
+		label : str (default: None)
+			Name of the condition, written as a comment before each dispense
+		tool : int (default: 0)
+			Extruder that dispenses the condition (the rate and volume apply to its syringe)
+
+		Returns the list of wells that were assigned.
+		"""
+		if wells is None:
+			free = [w for w in self.plate.well_names() if w not in self._used]
+			if len(free) < replicates:
+				raise RuntimeError('Not enough free wells on the {} for {} replicates.'.format(self.plate.name,replicates))
+			wells = free[:replicates]
+		else:
+			wells = self.plate.wells(wells)
+		spec = (float(volume),rate,rate_unit,label,tool)
+		for well in wells:
+			if well in self._used:
+				raise RuntimeError('Well {} is already assigned.'.format(well))
+			self._used.add(well)
+			self.assignments.append((well,spec))
+		return wells
+
+	def offset(self,well):
+		""" Head displacement (mm) from A1 to a well """
+		row,column = self.plate.parse(well)
+		return (self.x_direction*column*self.plate.pitch,self.y_direction*row*self.plate.pitch)
+
+	def schedule(self,travel_rate=1000.,z_lift=15.,return_home=True,tool_change_time=TOOL_CHANGE_TIME,current_tool=0):
+		""" Tool schedule of the assigned wells (see plate_routing.plan_schedule) """
+		from plate_routing import plan_schedule
+		return plan_schedule([self.offset(w) for w,_ in self.assignments],[spec[4] for _,spec in self.assignments],
+			travel_rate=travel_rate,z_lift=z_lift,tool_change_time=tool_change_time,current_tool=current_tool,return_home=return_home)
+
+	def visit_order(self,order='serpentine',return_home=True,travel_rate=1000.,z_lift=15.,current_tool=0):
+		""" Order of the assigned wells: 'serpentine', 'rows', 'input', 'route' or 'schedule' (plate_routing) """
+		assignments = list(self.assignments)
+		if order == 'input':
+			return assignments
+		if order == 'route':
+			from plate_routing import plan_route
+			route = plan_route([self.offset(w) for w,_ in assignments],travel_rate=travel_rate,z_lift=z_lift,return_home=return_home)
+			return [assignments[k] for k in route.order]
+		if order == 'schedule':
+			schedule = self.schedule(travel_rate,z_lift,return_home,current_tool=current_tool)
+			return [assignments[k] for k in schedule.order]
+		keyed = []
+		for well,spec in assignments:
+			row,column = self.plate.parse(well)
+			if order == 'serpentine' and row % 2 == 1:
+				column = -column
+			elif order not in ('serpentine','rows'):
+				raise RuntimeError('Unknown visit order: {}'.format(order))
+			keyed.append(((row,column),well,spec))
+		keyed.sort(key=lambda item: item[0])
+		return [(well,spec) for _,well,spec in keyed]
+
+	def operations(self,g,z_lift=15.,travel_rate=1000.,order='serpentine',return_home=True):
+		""" The plate program as a list of ('feed', rate, unit), ('move', x, y, z, e), ('tool', index), ('comment', text) and ('blank',) """
+		ops = []
+		speed = g.speed
+		tool = g.active_tool
+		position = (0.0,0.0)
+		visits = self.visit_order(order,return_home,travel_rate,z_lift,tool)
+		if return_home and visits:
+			visits = visits + [(None,None)]
+		for well,spec in visits:
+			target = self.offset(well) if well is not None else (0.0,0.0)
+			dx = target[0]-position[0]
+			dy = target[1]-position[1]
+			# tool changes happen with the tip lifted, before the travel
+			change = well is not None and spec[4] != tool
+			if change and spec[4] >= g.num_extruder:
+				raise RuntimeError('Well {} uses tool {} but G has {} extruders.'.format(well,spec[4],g.num_extruder))
+			if dx != 0.0 or dy != 0.0:
+				if speed != g._speed_from_rate(travel_rate):
+					ops.append(('feed',travel_rate,'mm/min'))
+					speed = g._speed_from_rate(travel_rate)
+				ops.append(('move',None,None,-z_lift,None))
+				if change:
+					ops.append(('tool',spec[4]))
+				ops.append(('move',dx if dx != 0.0 else None,dy if dy != 0.0 else None,None,None))
+				ops.append(('move',None,None,z_lift,None))
+				position = target
+			elif change:
+				ops.append(('tool',spec[4]))
+			if well is None:
+				break
+			volume,rate,rate_unit,label,tool = spec
+			if label is not None:
+				ops.append(('comment',';{} -> {}'.format(well,label)))
+			if rate is not None and speed != g._speed_from_rate(rate,rate_unit,tool):
+				ops.append(('feed',rate,rate_unit))
+				speed = g._speed_from_rate(rate,rate_unit,tool)
+			ops.append(('move',None,None,None,volume/g.tools[tool].syringe_cross_section))
+			ops.append(('blank',))
+		return ops
+
+	def compile(self,g,z_lift=15.,travel_rate=1000.,order='serpentine',return_home=True,fast=True):
+		""" Emit the plate program on g (tip over A1, relative positioning)
+		Parameters
+		-----------
+		g : G
+			Target generator
+		z_lift : float (default: 15.)
+			Lift before travelling between wells (mm)
+		travel_rate : float (default: 1000.)
+			Travel feedrate (mm/min)
+		order : str (default: 'serpentine')
+			Visit order, see visit_order ('schedule' for several tools)
+		return_home : bool (default: True)
+			Return to A1 at the end
+		fast : bool (default: True)
+			Vectorized replay (requires the toolpath recorder to be off); if false
+			every operation is a regular G call
+		"""
+		if not g.is_relative:
+			raise RuntimeError('Plate layouts are compiled in relative positioning.')
+		ops = self.operations(g,z_lift,travel_rate,order,return_home)
+		if not fast or g._toolpath is not None:
+			run_operations(g,ops)
+		else:
+			replay_operations(g,ops)
+		return ops
+
+def run_operations(g,ops):
+	""" Execute plate operations one G call at a time """
+	for op in ops:
+		if op[0] == 'feed':
+			g.set_feedrate(op[1],extrusionunit=op[2])
+		elif op[0] == 'move':
+			g.move(x=op[1],y=op[2],z=op[3],e=op[4])
+		elif op[0] == 'tool':
+			g.select_tool(op[1])
+		elif op[0] == 'comment':
+			g.write(op[1])
+		elif op[0] == 'blank':
+			g.print_blank_line()
+
+def replay_operations(g,ops):
+	""" Execute plate operations as one batch, rendering each distinct block once """
+	# a tool change swaps the syringe: replay the operations of each tool as their own batch
+	changes = [k for k,op in enumerate(ops) if op[0] == 'tool']
+	if changes:
+		first = 0
+		for k in changes:
+			replay_operations(g,ops[first:k])
+			g.select_tool(ops[k][1])
+			first = k+1
+		replay_operations(g,ops[first:])
+		return
+	feeds = {} # (rate, unit) -> (speed, lines)
+	moves = [] # move operations
+	speeds = [] # feedrate of every move
+	speed = g.speed
+	for op in ops:
+		if op[0] == 'feed':
+			key = (op[1],op[2])
+			if key not in feeds:
+				s = g._speed_from_rate(op[1],op[2])
+				comment = [g._feedrate_comment(s)] if g._diagnostic_level == FULL else []
+				feeds[key] = (s,comment+['G1 '+g._format_args(None,None,None,None,F=s)])
+			speed = feeds[key][0]
+		elif op[0] == 'move':
+			moves.append(op)
+			speeds.append(speed)
+	if not moves:
+		run_operations(g,ops)
+		return
+	columns = [np.array([0.0 if op[k] is None else op[k] for op in moves]) for k in range(1,5)]
+	plan = batch.plan_moves(g,*columns,speed=speeds)
+
+	texts = {}
+	diagnostics = {}
+	lines = []
+	i = 0
+	for op in ops:
+		kind = op[0]
+		if kind == 'move':
+			if plan['edistance'][i] != 0.0 and g._diagnostic_level == FULL:
+				key = (int(plan['diffs'][EXTRUSION_AXES[0]][i]),float(plan['extruded_volume'][i]),float(plan['xyzdistance'][i]),speeds[i])
+				block = diagnostics.get(key)
+				if block is None:
+					block = diagnostics[key] = batch.diagnostic_lines(g,i,plan)
+				lines.extend(block)
+			if g.step_coordinates:
+				diffs = dict((axes,int(plan['diffs'][axes][i])) for axes,v in zip(AXES,op[1:]) if v is not None)
+				key = tuple(sorted(diffs.items()))
+			else:
+				key = op[1:]
+			text = texts.get(key)
+			if text is None:
+				text = texts[key] = 'G1 '+(g._format_step_args(diffs) if g.step_coordinates else g._format_args(*op[1:]))
+			lines.append(text)
+			i += 1
+		elif kind == 'feed':
+			lines.extend(feeds[(op[1],op[2])][1])
+		elif kind == 'comment':
+			lines.append(op[1])
+		elif kind == 'blank':
+			lines.append(' ')
+	if g._diagnostic_level == AGGREGATE:
+		batch.aggregate_diagnostics(g,plan)
+	batch.commit_plan(g,plan)
+	g.speed = speed
+	g.write_lines(lines)
@@ -0,0 +1,385 @@
+import itertools
+import numpy as np
+from config import *
+
+"""
+Well-visit ordering for plate deposition runs.
+
+The wells of a plate are visited in the order that minimizes the travel time
+of the head. Two tours are seeded, the serpentine over the rows of wells from
+the best corner and a nearest neighbour tour; both are improved by 2-opt and
+Or-opt moves and the cheaper one is kept, so the route is never slower than the
+serpentine order 96wellDepositionExperiment.py uses. Moves between
+adjacent wells (no further apart than adjacent_distance) are done without the
+Z lift; every other move lifts the tip, travels and lowers it again, the same
+way 96wellDepositionExperiment.py does.
+
+Time is estimated like G does it: 60*distance/speed for every move.
+
+On printers with several tools, plan_schedule also orders the dispenses by
+tool: each tool is selected once and its wells are routed as above, so the
+program pays for the smallest number of tool changes.
+"""
+
+class Route(object):
+	"""Visit order of a set of wells and its estimated travel time"""
+	def __init__(self,order,wells,start,travel_rate,z_lift,adjacent_distance,return_home,naive_order=None):
+		self.order = list(order) # indices into wells
+		self.wells = wells
+		self.start = start
+		self.travel_rate = travel_rate
+		self.z_lift = z_lift
+		self.adjacent_distance = adjacent_distance
+		self.return_home = return_home
+		self.travel_time = _path_cost(self._points(self.order),travel_rate,z_lift,adjacent_distance,return_home) # s
+		naive_order = range(len(wells)) if naive_order is None else naive_order
+		self.naive_time = _path_cost(self._points(naive_order),travel_rate,z_lift,adjacent_distance,return_home) # s
+
+	def _points(self,order):
+		return np.vstack(([self.start],self.wells[list(order)]))
+
+	@property
+	def time_saved(self):
+		return self.naive_time - self.travel_time
+
+	def lifts(self):
+		""" For each leg of the route, whether the tip must be lifted """
+		points = self._points(self.order)
+		steps = np.hypot(*np.diff(points,axis=0).T)
+		return (steps > self.adjacent_distance).tolist()
+
+	def report(self,g):
+		""" Write the route statistics as comments """
+		d = g.output_digits
+		g.write(';Well route: {} wells | {} lifts skipped'.format(len(self.order),self.lifts()[1:].count(False)))
+		g.write(';Route travel time: {0:.{digits}f} s (input order: {1:.{digits}f} s | saved: {2:.{digits}f} s)'.format(self.travel_time,self.naive_time,self.time_saved,digits=d))
+
+def _distance_matrix(points):
+	diff = points[:,None,:] - points[None,:,:]
+	return np.sqrt((diff**2).sum(axis=2))
+
+def _cost_matrix(points,travel_rate,z_lift,adjacent_distance):
+	# travel time between every pair of points, lifting when they are not adjacent
+	distance = _distance_matrix(points)
+	lift = np.where(distance > adjacent_distance,2.*abs(z_lift),0.0)
+	return 60.*(distance+lift)/travel_rate
+
+def _path_cost(points,travel_rate,z_lift,adjacent_distance,return_home):
+	legs = np.diff(points,axis=0)
+	if return_home:
+		legs = np.vstack((legs,points[:1]-points[-1:]))
+	distance = np.hypot(legs[:,0],legs[:,1])
+	lift = np.where(distance > adjacent_distance,2.*abs(z_lift),0.0)
+	return float(np.sum(60.*(distance+lift)/travel_rate))
+
+def nearest_neighbour(cost):
+	""" Greedy tour over a cost matrix starting (and fixed) at node 0 """
+	n = len(cost)
+	visited = np.zeros(n,dtype=bool)
+	visited[0] = True
+	tour = [0]
+	current = 0
+	for _ in range(n-1):
+		row = np.where(visited,np.inf,cost[current])
+		current = int(np.argmin(row))
+		visited[current] = True
+		tour.append(current)
+	return np.array(tour)
+
+def two_opt(tour,cost,closed=True,max_passes=50):
+	""" Improve a tour (node 0 fixed first) by reversing segments until no move helps """
+	tour = np.array(tour)
+	n = len(tour)
+	if n < 4:
+		return tour
+	for _ in range(max_passes):
+		improved = False
+		for i in range(0,n-2):
+			a = tour[i]
+			b = tour[i+1]
+			c = tour[i+2:]
+			if closed:
+				d = np.append(tour[i+3:],tour[0])
+				next_cost = cost[c,d]
+				new_next = cost[b,d]
+			else:
+				d = tour[i+3:]
+				# the last node of an open path has no outgoing edge
+				next_cost = np.append(cost[c[:-1],d],0.0)
+				new_next = np.append(cost[b,d],0.0)
+			gain = cost[a,b] + next_cost - cost[a,c] - new_next
+			j = int(np.argmax(gain))
+			if gain[j] > 1e-9:
+				# reverse tour[i+1 .. i+2+j]
+				tour[i+1:i+3+j] = tour[i+1:i+3+j][::-1].copy()
+				improved = True
+		if not improved:
+			break
+	return tour
+
+def or_opt(tour,cost,closed=True,max_passes=50,lengths=(1,2,3)):
+	""" Improve a tour (node 0 fixed first) by moving runs of up to 3 nodes, possibly reversed, elsewhere """
+	tour = np.array(tour)
+	n = len(tour)
+	for _ in range(max_passes):
+		improved = False
+		for length in lengths:
+			i = 1
+			while i+length <= n:
+				segment = tour[i:i+length]
+				first,last = segment[0],segment[-1]
+				previous = tour[i-1]
+				following = tour[i+length] if i+length < n else (tour[0] if closed else None)
+				rest = np.concatenate((tour[:i],tour[i+length:]))
+				removed = cost[previous,first]
+				if following is not None:
+					removed += cost[last,following] - cost[previous,following]
+				# insertion between rest[k] and rest[k+1] (the closing edge last)
+				a = rest
+				b = np.append(rest[1:],rest[0])
+				forward = cost[a,first] + cost[last,b] - cost[a,b]
+				backward = cost[a,last] + cost[first,b] - cost[a,b]
+				if not closed:
+					# after the last node of an open path nothing follows
+					forward[-1] = cost[a[-1],first]
+					backward[-1] = cost[a[-1],last]
+				k = int(np.argmin(np.minimum(forward,backward)))
+				reverse = backward[k] < forward[k]
+				if removed - min(forward[k],backward[k]) > 1e-9:
+					tour = np.concatenate((rest[:k+1],segment[::-1] if reverse else segment,rest[k+1:]))
+					improved = True
+				i += 1
+		if not improved:
+			break
+	return tour
+
+def improve(tour,cost,closed=True,max_passes=50):
+	""" Alternate 2-opt and Or-opt until neither improves the tour (at most max_passes rounds) """
+	tour = two_opt(tour,cost,closed,max_passes)
+	for _ in range(max_passes):
+		moved = or_opt(tour,cost,closed,max_passes=1)
+		if np.array_equal(moved,tour):
+			break
+		tour = two_opt(moved,cost,closed,max_passes)
+	return tour
+
+def serpentine_order(wells,reverse_rows=False,reverse_first=False):
+	""" Indices of the wells row by row (rows are equal Y), alternating the X direction
+
+	Rows go from the highest Y down (reverse_rows: from the lowest up) and the
+	first row runs towards +X (reverse_first: towards -X).
+	"""
+	wells = np.asarray(wells,dtype=float).reshape(-1,2)
+	if len(wells) == 0:
+		return np.arange(0)
+	y = np.round(wells[:,1],6)
+	levels = np.unique(y)[::1 if reverse_rows else -1]
+	order = []
+	for row,level in enumerate(levels):
+		members = np.nonzero(y == level)[0]
+		members = members[np.argsort(wells[members,0],kind='mergesort')]
+		if (row % 2 == 1) != reverse_first:
+			members = members[::-1]
+		order.extend(members.tolist())
+	return np.array(order,dtype=int)
+
+def _tour_cost(tour,cost,closed):
+	total = float(cost[tour[:-1],tour[1:]].sum())
+	return total + float(cost[tour[-1],tour[0]]) if closed else total
+
+def plan_route(wells,start=(0.0,0.0),travel_rate=1000.,z_lift=15.,adjacent_distance=None,return_home=True,optimize=True,max_passes=50):
+	""" Order the visits of a set of wells
+	Parameters
+	-----------
+	wells : array-like of shape (n,2)
+		Well centres (mm) in the same frame as start
+	start : tuple (default: (0,0))
+		Head position before the first well, and where it returns to
+	travel_rate : float (default: 1000.)
+		Feedrate of travel moves (mm/min)
+	z_lift : float (default: 15.)
+		Height of the lift between non-adjacent wells (mm)
+	adjacent_distance : float (default: None)
+		Moves up to this length skip the lift. Defaults to the smallest
+		well-to-well spacing (orthogonal neighbours only).
+	return_home : bool (default: True)
+		Include the return move to start in the cost
+	optimize : bool (default: True)
+		If false, keep the input order (useful as a baseline)
+	max_passes : int (default: 50)
+		Maximum number of 2-opt sweeps and of 2-opt/Or-opt rounds
+	"""
+	wells = np.asarray(wells,dtype=float).reshape(-1,2)
+	start = np.asarray(start,dtype=float)
+	if adjacent_distance is None:
+		if len(wells) > 1:
+			spacing = _distance_matrix(wells)
+			spacing = spacing[spacing > 0.0]
+			adjacent_distance = 1.01*float(spacing.min()) if len(spacing) else 0.0
+		else:
+			adjacent_distance = 0.0
+	order = np.arange(len(wells))
+	if optimize and len(wells) > 1:
+		points = np.vstack(([start],wells))
+		cost = _cost_matrix(points,travel_rate,z_lift,adjacent_distance)
+		# the serpentine from the best corner, and the nearest neighbour tour
+		serpentines = [np.append(0,serpentine_order(wells,*corner)+1) for corner in itertools.product((False,True),repeat=2)]
+		seeds = [min(serpentines,key=lambda t: _tour_cost(t,cost,return_home)),nearest_neighbour(cost)]
+		tours = [improve(seed,cost,closed=return_home,max_passes=max_passes) for seed in seeds]
+		tour = min(tours,key=lambda t: _tour_cost(t,cost,return_home))
+		order = tour[1:] - 1
+	return Route(order,wells,start,travel_rate,z_lift,adjacent_distance,return_home)
+
+class Schedule(object):
+	"""Visit order of wells dispensed by several tools, with its estimated time"""
+	def __init__(self,order,wells,tools,start,travel_rate,z_lift,adjacent_distance,return_home,tool_change_time,current_tool):
+		self.order = list(order) # indices into wells
+		self.wells = wells
+		self.tools = tools # tool of every well
+		self.start = start
+		self.travel_rate = travel_rate
+		self.z_lift = z_lift
+		self.adjacent_distance = adjacent_distance
+		self.return_home = return_home
+		self.tool_change_time = tool_change_time
+		self.current_tool = current_tool
+		self.tool_changes = _tool_changes(tools[self.order],current_tool)
+		self.travel_time = _path_cost(self._points(self.order),travel_rate,z_lift,adjacent_distance,return_home) # s
+		naive_order = np.arange(len(wells))
+		self.naive_tool_changes = _tool_changes(tools,current_tool)
+		self.naive_travel_time = _path_cost(self._points(naive_order),travel_rate,z_lift,adjacent_distance,return_home) # s
+
+	def _points(self,order):
+		return np.vstack(([self.start],self.wells[list(order)]))
+
+	@property
+	def time(self):
+		return self.travel_time + self.tool_changes*self.tool_change_time
+
+	@property
+	def naive_time(self):
+		return self.naive_travel_time + self.naive_tool_changes*self.tool_change_time
+
+	@property
+	def time_saved(self):
+		return self.naive_time - self.time
+
+	def report(self,g):
+		""" Write the schedule statistics as comments """
+		d = g.output_digits
+		g.write(';Tool schedule: {0} wells | {1} tool changes (input order: {2})'.format(len(self.order),self.tool_changes,self.naive_tool_changes))
+		g.write(';Schedule time: {0:.{digits}f} s (input order: {1:.{digits}f} s | saved: {2:.{digits}f} s)'.format(self.time,self.naive_time,self.time_saved,digits=d))
+
+def _tool_changes(tools,current_tool):
+	tools = np.asarray(tools)
+	if len(tools) == 0:
+		return 0
+	return int(tools[0] != current_tool) + int(np.count_nonzero(tools[1:] != tools[:-1]))
+
+def plan_schedule(wells,tools,start=(0.0,0.0),travel_rate=1000.,z_lift=15.,tool_change_time=TOOL_CHANGE_TIME,current_tool=0,adjacent_distance=None,return_home=True,max_passes=50,max_permuted_tools=5):
+	""" Order the dispenses of several tools over a set of wells
+	Every tool is selected once, starting with current_tool if it has wells, and
+	its wells are routed with plan_route from where the previous tool stopped.
+	The order of the tools is the one with the shortest travel: all orders are
+	tried for up to max_permuted_tools tools, otherwise the next tool is the one
+	with the well closest to the head.
+	Parameters
+	-----------
+	wells : array-like of shape (n,2)
+		Well centres (mm) in the same frame as start
+	tools : sequence of int
+		Tool dispensing in every well
+	tool_change_time : float (default: TOOL_CHANGE_TIME)
+		Estimated duration of a tool change (s)
+	current_tool : int (default: 0)
+		Tool active before the first dispense
+
+	Other parameters are those of plan_route.
+	"""
+	wells = np.asarray(wells,dtype=float).reshape(-1,2)
+	tools = np.asarray(tools,dtype=int).reshape(-1)
+	if len(tools) != len(wells):
+		raise RuntimeError('{} wells but {} tools.'.format(len(wells),len(tools)))
+	start = np.asarray(start,dtype=float)
+	if adjacent_distance is None:
+		adjacent_distance = plan_route(wells,start,optimize=False).adjacent_distance
+	groups = dict((t,np.nonzero(tools == t)[0]) for t in np.unique(tools).tolist())
+	first = [current_tool] if current_tool in groups else []
+	others = [t for t in sorted(groups) if t != current_tool]
+
+	routes = {}
+	def route(t,position):
+		# wells of tool t, routed from position (permutations share their prefixes)
+		key = (t,tuple(position.tolist()))
+		if key not in routes:
+			members = groups[t]
+			r = plan_route(wells[members],position,travel_rate,z_lift,adjacent_distance,return_home=False,max_passes=max_passes)
+			routes[key] = members[r.order].tolist()
+		return routes[key]
+
+	def chain(sequence):
+		# the groups one after the other, each from where the previous one ended
+		order = []
+		for t in sequence:
+			order.extend(route(t,wells[order[-1]] if order else start))
+		return order
+
+	def cost(order):
+		return _path_cost(np.vstack(([start],wells[order])),travel_rate,z_lift,adjacent_distance,return_home)
+
+	if len(others) <= max_permuted_tools:
+		order = min([chain(first+list(p)) for p in itertools.permutations(others)],key=cost)
+	else:
+		order = chain(first)
+		remaining = list(others)
+		while remaining:
+			position = wells[order[-1]] if order else start
+			nearest = min(remaining,key=lambda t: float(np.hypot(*(wells[groups[t]]-position).T).min()))
+			remaining.remove(nearest)
+			order.extend(route(nearest,position))
+	return Schedule(order,wells,tools,start,travel_rate,z_lift,adjacent_distance,return_home,tool_change_time,current_tool)
+
+def run_route(g,route,specs,extrusionunit='uL',rate=DISPENSE_RATE,rate_unit='mL/min'):
+	""" Drive g along a route, dispensing at every well
+	Parameters
+	-----------
+	g : G
+		Generator positioned at route.start, in relative mode
+	route : Route
+		Output of plan_route
+	specs : list of dict
+		Per-well dispense spec (same indexing as the wells), with keys 'volume'
+		and optionally 'rate' and 'rate_unit'
+	rate : float (default: DISPENSE_RATE)
+		Dispense rate of the specs without one. The feedrate is set for every
+		well, since the travel moves leave it at travel_rate.
+	rate_unit : str (default: 'mL/min')
+		Unit of rate and of the spec rates without a 'rate_unit' (as set_feedrate)
+	"""
+	route.report(g)
+	lifts = route.lifts()
+	position = route.start
+	for leg,well in enumerate(route.order):
+		target = route.wells[well]
+		_travel(g,target-position,lifts[leg],route)
+		position = target
+		spec = specs[well]
+		if spec.get('rate') is not None:
+			g.set_feedrate(spec['rate'],extrusionunit=spec.get('rate_unit',rate_unit))
+		else:
+			g.set_feedrate(rate,extrusionunit=rate_unit)
+		g.move(e=spec['volume'],extrusionunit=extrusionunit)
+		g.print_blank_line()
+	if route.return_home:
+		delta = route.start-position
+		_travel(g,delta,np.hypot(*delta) > route.adjacent_distance,route)
+
+def _travel(g,delta,lift,route):
+	if not np.any(delta):
+		return
+	g.set_feedrate(route.travel_rate)
+	if lift:
+		g.move(z=-route.z_lift)
+	g.move(x=float(delta[0]),y=float(delta[1]))
+	if lift:
+		g.move(z=route.z_lift)
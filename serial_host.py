@@ -0,0 +1,387 @@
+import asyncio
+import os
+import termios
+import time
+import tty
+from collections import deque
+from sinks import Sink
+
+"""
+Asyncio host that streams G output to a Marlin-style printer over serial.
+
+Instead of waiting for "ok" after every line (ping-pong), the host keeps up to
+`window` commands in flight so the firmware's command queue never runs dry.
+Every line is sent as "N<number> <command>*<checksum>", and when the firmware
+asks for a line again ("Resend: N" / "rs N") the host rewinds to it. Lines
+already in flight when the rewind happens are rejected by the firmware one by
+one, each with its own resend request; those duplicates are ignored. Firmware
+may also drop them silently when it flushes its receive buffer: if the "ok"s
+stop coming after a resend, the missing ones are written off once.
+
+Requires Python 3 (asyncio) and a POSIX terminal; the port is opened with
+termios, so no serial library is needed. See fake_printer.py for a simulated
+printer on a pseudo-terminal.
+
+Example
+-------
+async def main():
+	connection = await open_serial('/dev/ttyACM0',115200)
+	host = SerialHost(connection,window=4)
+	stats = await stream_program(host,build)   # build(g) generates the program
+	print(stats)
+"""
+
+DEFAULT_WINDOW = 4 # commands in flight
+DEFAULT_TIMEOUT = 30.0 # s without any reply before giving up
+HISTORY_SIZE = 512 # sent lines kept for resends
+
+def checksum(text):
+	""" Marlin checksum: XOR of all bytes of the numbered command """
+	value = 0
+	for c in bytearray(text.encode('ascii')):
+		value ^= c
+	return value
+
+def number_line(number,command):
+	""" Add a line number and checksum to a command """
+	text = 'N{0} {1}'.format(number,command)
+	return '{0}*{1}'.format(text,checksum(text))
+
+def clean_command(line):
+	""" Strip comments and surrounding whitespace (empty string if nothing is left) """
+	i = line.find(';')
+	if i >= 0:
+		line = line[:i]
+	return line.strip()
+
+def _resend_number(reply):
+	# "Resend: 12", "Resend:12" or "rs N12"
+	lower = reply.lower()
+	if lower.startswith('resend'):
+		text = reply.split(':',1)[-1]
+	elif lower.startswith('rs'):
+		text = reply[2:]
+	else:
+		return None
+	digits = ''.join(c for c in text if c.isdigit())
+	return int(digits) if digits else None
+
+# ---------- Serial port ---------- #
+class SerialConnection(object):
+	""" Line-oriented asyncio wrapper around a terminal file descriptor """
+	def __init__(self,reader,transport,fd):
+		self.reader = reader
+		self.transport = transport
+		self.fd = fd
+
+	async def readline(self):
+		line = await self.reader.readline()
+		if not line:
+			raise RuntimeError('Serial connection closed.')
+		return line.decode('ascii','replace').strip()
+
+	def write_line(self,text):
+		self.transport.write((text+'\n').encode('ascii'))
+
+	def close(self):
+		self.transport.close()
+
+def configure_terminal(fd,baudrate=None):
+	""" Raw mode (no echo, no line editing) and, optionally, the baud rate """
+	tty.setraw(fd)
+	if baudrate is not None:
+		speed = getattr(termios,'B{}'.format(baudrate),None)
+		if speed is None:
+			raise RuntimeError('Unsupported baud rate: {}'.format(baudrate))
+		attributes = termios.tcgetattr(fd)
+		attributes[4] = attributes[5] = speed
+		termios.tcsetattr(fd,termios.TCSANOW,attributes)
+
+async def open_fd(fd):
+	""" Connect asyncio streams to a terminal file descriptor """
+	loop = asyncio.get_running_loop()
+	reader = asyncio.StreamReader()
+	read_file = os.fdopen(fd,'rb',buffering=0,closefd=False)
+	await loop.connect_read_pipe(lambda: asyncio.StreamReaderProtocol(reader),read_file)
+	write_file = os.fdopen(os.dup(fd),'wb',buffering=0)
+	transport,_ = await loop.connect_write_pipe(asyncio.Protocol,write_file)
+	return SerialConnection(reader,transport,fd)
+
+async def open_serial(path,baudrate=115200):
+	""" Open a serial port (or the slave side of a pty) for a SerialHost """
+	fd = os.open(path,os.O_RDWR | os.O_NOCTTY | os.O_NONBLOCK)
+	configure_terminal(fd,baudrate)
+	return await open_fd(fd)
+
+# ---------- Host ---------- #
+class SerialHost(object):
+	def __init__(self,connection,window=DEFAULT_WINDOW,line_numbers=True,timeout=DEFAULT_TIMEOUT):
+		"""
+		Parameters
+		-----------
+		connection : SerialConnection
+			Port to the printer (open_serial)
+		window : int (default: DEFAULT_WINDOW)
+			Number of commands sent ahead of their "ok" (1 is ping-pong)
+		line_numbers : bool (default: True)
+			Send N<number> ... *<checksum> lines (required for resends)
+		timeout : float (default: DEFAULT_TIMEOUT)
+			Seconds without any reply from the printer before giving up
+		"""
+		if window < 1:
+			raise RuntimeError('window must be at least 1.')
+		self.connection = connection
+		self.window = window
+		self.line_numbers = line_numbers
+		self.timeout = timeout
+		self.messages = [] # echo:/Error: lines from the firmware
+		self._history = {} # line number -> command
+		self._order = deque() # line numbers in the history, oldest first
+		self._in_flight = deque() # send times of the commands waiting for "ok"
+		self._next_number = 1 # number of the next new line
+		self._resend = deque() # line numbers to send again before new lines
+		self._ignore_resends = 0
+		self._rewind = None # line number of the last rewind
+		self._written_off = 0 # resends after which missing "ok"s were written off
+		self._credit = None # asyncio.Condition, created in the running loop
+		self._reset_stats()
+
+	def _reset_stats(self):
+		self.lines_sent = 0
+		self.bytes_sent = 0
+		self.resends = 0
+		self.acknowledged = 0
+		self.latencies = []
+		self._start = None
+		self._stop = None
+
+	# ---------- Receiving ---------- #
+	async def _receive(self):
+		while True:
+			reply = await self.connection.readline()
+			if not reply:
+				continue
+			async with self._credit:
+				if reply.startswith('ok'):
+					if self._in_flight:
+						self.latencies.append(time.time() - self._in_flight.popleft())
+						self.acknowledged += 1
+					self._credit.notify_all()
+					continue
+				number = _resend_number(reply)
+				if number is not None:
+					self._request_resend(number)
+					continue
+			if reply.startswith('Error'):
+				self.messages.append(reply)
+				if 'halted' in reply or 'kill' in reply:
+					raise RuntimeError('Printer halted: {}'.format(reply))
+			elif not reply.startswith('busy'):
+				self.messages.append(reply)
+
+	def _request_resend(self,number):
+		if self._ignore_resends > 0 and number == self._rewind:
+			# rejection of a line that was already in flight at the rewind
+			self._ignore_resends -= 1
+			return
+		if number not in self._history:
+			raise RuntimeError('Printer asked for line {} which is no longer available.'.format(number))
+		self._resend = deque(n for n in self._order if n >= number)
+		self._ignore_resends = max(len(self._in_flight) - 1,0)
+		self._rewind = number
+		self.resends += 1
+
+	# ---------- Sending ---------- #
+	def _transmit(self,number,command):
+		text = number_line(number,command) if self.line_numbers else command
+		self.connection.write_line(text)
+		self._in_flight.append(time.time())
+		self.lines_sent += 1
+		self.bytes_sent += len(text) + 1
+
+	async def _wait_reply(self,receiver):
+		# wait (holding the condition) until the receiver handles a reply
+		if receiver.done():
+			receiver.result()
+			raise RuntimeError('Printer stopped replying.')
+		try:
+			await asyncio.wait_for(self._credit.wait(),self.timeout)
+		except asyncio.TimeoutError:
+			if self.resends > self._written_off:
+				# the firmware flushed lines that were in flight at the resend
+				self._written_off = self.resends
+				self._in_flight.clear()
+				self._ignore_resends = 0
+				return
+			raise RuntimeError('Printer did not reply for {} s.'.format(self.timeout))
+
+	async def _wait_for_credit(self,receiver):
+		# wait until fewer than window commands are in flight
+		while len(self._in_flight) >= self.window:
+			await self._wait_reply(receiver)
+
+	async def _send_one(self,command,receiver):
+		async with self._credit:
+			await self._wait_for_credit(receiver)
+			while self._resend:
+				n = self._resend.popleft()
+				self._transmit(n,self._history[n])
+				await self._wait_for_credit(receiver)
+			number = self._next_number
+			self._next_number += 1
+			if self.line_numbers:
+				self._history[number] = command
+				self._order.append(number)
+				if len(self._order) > HISTORY_SIZE:
+					del self._history[self._order.popleft()]
+			self._transmit(number,command)
+
+	async def _finish(self,receiver):
+		# wait for the outstanding "ok"s, resending on request
+		async with self._credit:
+			while self._in_flight or self._resend:
+				while self._resend:
+					await self._wait_for_credit(receiver)
+					n = self._resend.popleft()
+					self._transmit(n,self._history[n])
+				if not self._in_flight:
+					break
+				await self._wait_reply(receiver)
+
+	async def send(self,lines):
+		""" Stream lines (an iterable or an async iterable, e.g. a HostSink) to the printer
+
+		Comments and blank lines are skipped. Returns the statistics (see stats).
+		"""
+		self._credit = asyncio.Condition()
+		self._reset_stats()
+		self._start = time.time()
+		receiver = asyncio.ensure_future(self._receive())
+		try:
+			if self.line_numbers:
+				# restart the firmware's line numbering
+				await self._send_untracked('M110 N0',receiver)
+			if hasattr(lines,'__aiter__'):
+				async for line in lines:
+					command = clean_command(line)
+					if command:
+						await self._send_one(command,receiver)
+			else:
+				for line in lines:
+					command = clean_command(line)
+					if command:
+						await self._send_one(command,receiver)
+			await self._finish(receiver)
+		finally:
+			receiver.cancel()
+			try:
+				await receiver
+			except asyncio.CancelledError:
+				pass
+		self._stop = time.time()
+		return self.stats()
+
+	async def _send_untracked(self,command,receiver):
+		# sent as line 0, the number M110 sets
+		async with self._credit:
+			await self._wait_for_credit(receiver)
+			self._history[0] = command
+			self._order.append(0)
+			self._transmit(0,command)
+			self._next_number = 1
+
+	# ---------- Statistics ---------- #
+	def stats(self):
+		""" Throughput and latency of the last send """
+		end = self._stop if self._stop is not None else time.time()
+		elapsed = end - self._start if self._start is not None else 0.0
+		latencies = self.latencies
+		return {'lines':self.lines_sent,'bytes':self.bytes_sent,'resends':self.resends,
+			'acknowledged':self.acknowledged,'elapsed':elapsed,
+			'lines_per_second':self.lines_sent/elapsed if elapsed > 0.0 else 0.0,
+			'bytes_per_second':self.bytes_sent/elapsed if elapsed > 0.0 else 0.0,
+			'mean_latency':sum(latencies)/len(latencies) if latencies else 0.0,
+			'max_latency':max(latencies) if latencies else 0.0}
+
+# ---------- Streaming G output ---------- #
+class HostSink(Sink):
+	"""Hands lines produced in another thread to an asyncio consumer
+
+	G runs in a worker thread and writes to this sink; the event loop iterates
+	over it (async for). At most maxsize chunks of chunk_size lines are queued,
+	so generation blocks while the printer is behind.
+	"""
+	def __init__(self,loop,chunk_size=64,maxsize=16):
+		super(HostSink, self).__init__()
+		self.loop = loop
+		self.chunk_size = chunk_size
+		self.queue = asyncio.Queue(maxsize)
+		self._chunk = []
+
+	def _emit(self,line):
+		self._chunk.append(line)
+		if len(self._chunk) >= self.chunk_size:
+			self.flush()
+
+	def flush(self):
+		if self._chunk:
+			chunk,self._chunk = self._chunk,[]
+			asyncio.run_coroutine_threadsafe(self.queue.put(chunk),self.loop).result()
+
+	def close(self):
+		self.flush()
+		asyncio.run_coroutine_threadsafe(self.queue.put(None),self.loop).result()
+
+	async def __aiter__(self):
+		while True:
+			chunk = await self.queue.get()
+			if chunk is None:
+				return
+			for line in chunk:
+				yield line
+
+async def stream_program(host,build,**g_kwargs):
+	""" Generate a program with build(g) in a worker thread while host sends it
+
+	g_kwargs are passed to G. Returns the send statistics.
+	"""
+	from main import G
+	loop = asyncio.get_running_loop()
+	sink = HostSink(loop)
+	def generate():
+		try:
+			build(G(output=sink,**g_kwargs))
+		finally:
+			sink.close()
+	worker = loop.run_in_executor(None,generate)
+	try:
+		stats = await host.send(sink)
+	finally:
+		if not worker.done():
+			# unblock the generator if sending failed
+			while not worker.done():
+				try:
+					sink.queue.get_nowait()
+				except asyncio.QueueEmpty:
+					await asyncio.sleep(0.01)
+	await worker
+	return stats
+
+if __name__ == "__main__":
+	import argparse
+	parser = argparse.ArgumentParser(description='Stream a G-code file to a Marlin-style printer.')
+	parser.add_argument('file')
+	parser.add_argument('port')
+	parser.add_argument('--baudrate',type=int,default=115200)
+	parser.add_argument('--window',type=int,default=DEFAULT_WINDOW)
+	options = parser.parse_args()
+	async def main():
+		connection = await open_serial(options.port,options.baudrate)
+		try:
+			with open(options.file) as f:
+				stats = await SerialHost(connection,options.window).send(f)
+		finally:
+			connection.close()
+		for key in sorted(stats):
+			print('{0}: {1}'.format(key,stats[key]))
+	asyncio.run(main())
@@ -0,0 +1,344 @@
+import sys
+import atexit
+import weakref
+from collections import deque
+
+"""
+Output sinks for the G object. Every line emitted by G goes through exactly one
+sink, which decides where the text ends up (stdout, a file, memory, a consumer
+or nowhere at all). All sinks keep a running count of lines and bytes (the size
+of the text encoded in UTF-8, newlines included). Files are written in UTF-8.
+
+Sinks that can take back what they were given support snapshot/restore (see
+G.snapshot): memory and null sinks, and file sinks on a seekable stream
+(restore truncates the file). Memory and null sinks can also fork: a
+MemorySink shares the lines written so far with its forks and only keeps the
+lines written after the fork.
+"""
+
+if sys.version_info >= (3,7):
+	def _size(text):
+		return len(text) if text.isascii() else len(text.encode('utf-8'))
+elif sys.version_info[0] >= 3:
+	def _size(text):
+		return len(text.encode('utf-8'))
+else:
+	def _size(text):
+		return len(text.encode('utf-8')) if isinstance(text,unicode) else len(text)
+
+def _lines_size(lines):
+	# UTF-8 size of lines joined by newlines, with the final newline
+	return _size('\n'.join(lines)) + 1 if lines else 0
+
+class Sink(object):
+	"""Base class for all output sinks"""
+	def __init__(self):
+		self.lines = 0 # number of lines written
+		self.bytes = 0 # number of bytes written (UTF-8, including newlines)
+
+	def write(self,line):
+		self.lines += 1
+		self.bytes += _size(line) + 1
+		self._emit(line)
+
+	def write_lines(self,lines):
+		for line in lines:
+			self.write(line)
+
+	def write_block(self,text,lines=None):
+		""" Write lines given as one text, each line ending in a newline
+
+		lines is the number of lines of text, if known.
+		"""
+		self.write_lines(text.split('\n')[:-1])
+
+	def _emit(self,line):
+		raise NotImplementedError
+
+	def flush(self):
+		pass
+
+	def close(self):
+		self.flush()
+
+	# ---------- Branching ---------- #
+	def snapshot(self):
+		""" Opaque state to rewind the sink to with restore """
+		raise RuntimeError('{} cannot be rewound.'.format(type(self).__name__))
+
+	def restore(self,state):
+		raise RuntimeError('{} cannot be rewound.'.format(type(self).__name__))
+
+	def fork(self,state=None):
+		""" A new sink holding the same output (or the output of a snapshot) """
+		raise RuntimeError('{} cannot be forked: give the branch its own output.'.format(type(self).__name__))
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self,exc_type,exc_value,traceback):
+		self.close()
+
+class FileSink(Sink):
+	"""Buffered writer for a file path or an open text stream"""
+	rewindable = True # snapshots seek back and truncate the stream
+	def __init__(self,target,flush_size=1000,mode='w'):
+		"""
+		Parameters
+		-----------
+		target : str or file-like
+			Path of the file to write or an already opened text stream
+		flush_size : int (default: 1000)
+			Number of lines to buffer before writing to the stream
+		mode : str (default: 'w')
+			Mode used to open the file when target is a path
+		"""
+		super(FileSink, self).__init__()
+		if flush_size < 1:
+			raise RuntimeError('flush_size must be at least 1.')
+		if hasattr(target,'write'):
+			self.stream = target
+			self._owns_stream = False
+		else:
+			self.stream = open(target,mode,encoding='utf-8') if sys.version_info[0] >= 3 else open(target,mode)
+			self._owns_stream = True
+		self.flush_size = flush_size
+		self._buffer = []
+
+	def _emit(self,line):
+		self._buffer.append(line)
+		if len(self._buffer) >= self.flush_size:
+			self.flush()
+
+	def write_lines(self,lines):
+		lines = list(lines)
+		self.lines += len(lines)
+		self.bytes += _lines_size(lines)
+		self._buffer.extend(lines)
+		if len(self._buffer) >= self.flush_size:
+			self.flush()
+
+	def write_block(self,text,lines=None):
+		# written as is, without splitting it into lines
+		self.lines += text.count('\n') if lines is None else lines
+		self.bytes += _size(text)
+		self._write_buffer()
+		self.stream.write(text)
+
+	def _write_buffer(self):
+		if self._buffer:
+			self.stream.write('\n'.join(self._buffer) + '\n')
+			self._buffer = []
+
+	def flush(self):
+		self._write_buffer()
+		if hasattr(self.stream,'flush'):
+			self.stream.flush()
+
+	def close(self):
+		self.flush()
+		if self._owns_stream:
+			self.stream.close()
+
+	def snapshot(self):
+		self.flush()
+		try:
+			position = self.stream.tell() if self.rewindable else None
+		except (AttributeError,IOError,OSError,ValueError):
+			position = None
+		if position is None:
+			return super(FileSink, self).snapshot()
+		return (self.lines,self.bytes,position)
+
+	def restore(self,state):
+		self.flush()
+		self.lines,self.bytes,position = state
+		self.stream.seek(position)
+		self.stream.truncate()
+
+class GzipSink(FileSink):
+	"""Writes a gzip-compressed text file"""
+	rewindable = False
+	def __init__(self,path,flush_size=1000,compresslevel=6):
+		"""
+		Parameters
+		-----------
+		path : str
+			File to write (usually ending in .gcode.gz)
+		flush_size : int (default: 1000)
+			Number of lines to buffer before compressing them
+		compresslevel : int (default: 6)
+			zlib compression level (1 fastest, 9 smallest)
+		"""
+		import gzip
+		if sys.version_info[0] >= 3:
+			stream = gzip.open(path,'wt',compresslevel,encoding='utf-8')
+		else:
+			stream = gzip.open(path,'wb',compresslevel)
+		super(GzipSink, self).__init__(stream,flush_size=flush_size)
+		self._owns_stream = True
+
+class ZstdSink(FileSink):
+	"""Writes a zstd-compressed text file (requires the zstandard package)"""
+	rewindable = False
+	def __init__(self,path,flush_size=1000,level=3):
+		"""
+		Parameters
+		-----------
+		path : str
+			File to write (usually ending in .gcode.zst)
+		flush_size : int (default: 1000)
+			Number of lines to buffer before compressing them
+		level : int (default: 3)
+			zstd compression level
+		"""
+		try:
+			import zstandard
+		except ImportError:
+			raise RuntimeError('ZstdSink requires the zstandard package.')
+		import io
+		self._raw = open(path,'wb')
+		writer = zstandard.ZstdCompressor(level=level).stream_writer(self._raw)
+		super(ZstdSink, self).__init__(io.TextIOWrapper(writer,encoding='utf-8'),flush_size=flush_size)
+		self._owns_stream = True
+
+	def close(self):
+		super(ZstdSink, self).close()
+		if not self._raw.closed:
+			self._raw.close()
+
+def open_sink(path,flush_size=1000):
+	""" A FileSink, GzipSink or ZstdSink depending on the extension of path (.gz, .zst) """
+	if path.endswith('.gz'):
+		return GzipSink(path,flush_size)
+	if path.endswith('.zst'):
+		return ZstdSink(path,flush_size)
+	return FileSink(path,flush_size)
+
+_STDOUT_SINKS = weakref.WeakSet()
+
+@atexit.register
+def _flush_stdout_sinks():
+	for sink in list(_STDOUT_SINKS):
+		sink.flush()
+
+class StdoutSink(FileSink):
+	"""Writes to sys.stdout (looked up on every flush so redirection still works)
+
+	Lines are buffered like a FileSink; G.flush, summary_report and the end of
+	the interpreter flush them. Use flush_size=1 to interleave the program with
+	other prints to stdout.
+	"""
+	def __init__(self,flush_size=1000):
+		super(StdoutSink, self).__init__(sys.stdout,flush_size=flush_size)
+		_STDOUT_SINKS.add(self)
+
+	def flush(self):
+		self.stream = sys.stdout
+		super(StdoutSink, self).flush()
+
+class MemorySink(Sink):
+	"""Keeps every line in memory
+
+	After a snapshot or a fork the lines written so far are shared (as (list,
+	length) segments, lists are only ever appended to) and new lines go to a new
+	list; reading buffer joins them back into one list the first time.
+	"""
+	def __init__(self):
+		super(MemorySink, self).__init__()
+		self._lines = []
+		self._base = [] # shared (list, length) segments before self._lines
+
+	@property
+	def buffer(self):
+		if self._base:
+			lines = []
+			for segment,length in self._base:
+				lines.extend(segment[:length])
+			lines.extend(self._lines)
+			self._lines = lines
+			self._base = []
+		return self._lines
+
+	@buffer.setter
+	def buffer(self,lines):
+		self._lines = lines
+		self._base = []
+
+	def _emit(self,line):
+		self._lines.append(line)
+
+	def write_lines(self,lines):
+		lines = list(lines)
+		self.lines += len(lines)
+		self.bytes += _lines_size(lines)
+		self._lines.extend(lines)
+
+	def getvalue(self):
+		if not self.buffer:
+			return ''
+		return '\n'.join(self.buffer) + '\n'
+
+	def snapshot(self):
+		base = list(self._base)
+		if self._lines:
+			base.append((self._lines,len(self._lines)))
+		return (self.lines,self.bytes,base)
+
+	def restore(self,state):
+		self.lines,self.bytes,base = state
+		self._base = list(base)
+		self._lines = []
+
+	def fork(self,state=None):
+		sink = MemorySink()
+		sink.restore(self.snapshot() if state is None else state)
+		return sink
+
+class GeneratorSink(Sink):
+	"""Queues lines until a streaming consumer iterates over the sink
+
+	Iterating yields (and forgets) every line produced so far, so a consumer can
+	alternate between generating part of a program and draining it.
+	"""
+	def __init__(self):
+		super(GeneratorSink, self).__init__()
+		self._pending = deque()
+
+	def _emit(self,line):
+		self._pending.append(line)
+
+	def pending(self):
+		return len(self._pending)
+
+	def __iter__(self):
+		pending = self._pending
+		while pending:
+			yield pending.popleft()
+
+	drain = __iter__
+
+class NullSink(Sink):
+	"""Discards output; only the line and byte counters are kept (dry runs)"""
+	def _emit(self,line):
+		pass
+
+	def snapshot(self):
+		return (self.lines,self.bytes)
+
+	def restore(self,state):
+		self.lines,self.bytes = state
+
+	def fork(self,state=None):
+		sink = NullSink()
+		sink.restore(self.snapshot() if state is None else state)
+		return sink
+
+	def write_lines(self,lines):
+		lines = list(lines)
+		self.lines += len(lines)
+		self.bytes += _lines_size(lines)
+
+	def write_block(self,text,lines=None):
+		self.lines += text.count('\n') if lines is None else lines
+		self.bytes += _size(text)
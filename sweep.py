@@ -0,0 +1,114 @@
+import csv
+import inspect
+import itertools
+import os
+import multiprocessing
+from main import G
+from sinks import FileSink
+
+"""
+Parameter sweeps: build many program variants in parallel.
+
+A sweep takes a build function and a parameter grid. For every combination a
+fresh G is created, writing to its own .gcode file, and build(g, **params) is
+called to generate the program. Parameters named like G's constructor
+arguments (syringe, tip, initial_feedrate, ...) are given to G instead of the
+build function. Runs are independent and results are ordered by their index in
+the grid, so the files and the summary table do not depend on the number of
+workers. The build function must be defined at module level (it is pickled).
+
+Example
+-------
+def dispense(g,rate,volume=25):
+	g.set_feedrate(rate,extrusionunit='mL/min')
+	g.move(e=volume,extrusionunit='uL')
+
+grid = parameter_grid(rate=[1,5,10],syringe=['BD-1ml','BD-3ml'])
+table = run_sweep(dispense,grid,'sweep_output',workers=4)
+"""
+
+try:
+	_G_ARGUMENTS = list(inspect.signature(G.__init__).parameters)
+except AttributeError: # Python 2
+	_G_ARGUMENTS = inspect.getargspec(G.__init__).args
+# constructor arguments of G a sweep can vary (output is the file of each run)
+G_PARAMETERS = tuple(name for name in _G_ARGUMENTS if name not in ('self','output'))
+SUMMARY_FIELDS = ('extrusion_volume','travel_distance','extrusion_distance','print_time','max_e_position')
+
+def parameter_grid(**axes):
+	""" Every combination of the given parameter values, in a deterministic order """
+	names = sorted(axes)
+	return [dict(zip(names,values)) for values in itertools.product(*[axes[k] for k in names])]
+
+def run_name(index,params):
+	""" File name of one run, e.g. 0003_rate-5_syringe-BD-3ml.gcode """
+	parts = ['{0}-{1}'.format(k,params[k]) for k in sorted(params)]
+	name = '_'.join(['{0:04d}'.format(index)] + parts)
+	return ''.join(c if c.isalnum() or c in '-_.' else '-' for c in name) + '.gcode'
+
+def _run(job):
+	build,index,params,output_dir,summary = job
+	path = os.path.join(output_dir,run_name(index,params))
+	g_kwargs = dict((k,v) for k,v in params.items() if k in G_PARAMETERS)
+	build_kwargs = dict((k,v) for k,v in params.items() if k not in G_PARAMETERS)
+	sink = FileSink(path,flush_size=10000)
+	try:
+		g = G(output=sink,**g_kwargs)
+		build(g,**build_kwargs)
+		if g_kwargs.get('record') and g._toolpath is not None:
+			g.emit() # the build function left the program recorded
+		if summary:
+			g.summary_report()
+	finally:
+		sink.close()
+	row = {'index':index,'file':path,'lines':sink.lines,'bytes':sink.bytes}
+	row.update(params)
+	for field in SUMMARY_FIELDS:
+		row[field] = getattr(g,field)
+	return row
+
+def run_sweep(build,grid,output_dir,workers=None,summary=True,table='summary.csv'):
+	""" Generate one program per parameter set and collect their statistics
+	Parameters
+	-----------
+	build : callable
+		build(g, **params) generates a program on a fresh G
+	grid : list of dict
+		Parameter sets, e.g. from parameter_grid
+	output_dir : str
+		Directory for the .gcode files and the summary table
+	workers : int (default: None)
+		Number of processes (None: one per CPU, 1: run in this process)
+	summary : bool (default: True)
+		Append summary_report to every program
+	table : str (default: 'summary.csv')
+		Name of the CSV summary written to output_dir (None to skip)
+
+	Returns the list of per-run statistics, in grid order.
+	"""
+	if not os.path.isdir(output_dir):
+		os.makedirs(output_dir)
+	jobs = [(build,index,params,output_dir,summary) for index,params in enumerate(grid)]
+	if workers == 1 or len(jobs) <= 1:
+		rows = [_run(job) for job in jobs]
+	else:
+		pool = multiprocessing.Pool(workers)
+		try:
+			rows = pool.map(_run,jobs,chunksize=1)
+		finally:
+			pool.close()
+			pool.join()
+	rows.sort(key=lambda row: row['index'])
+	if table is not None:
+		write_table(rows,os.path.join(output_dir,table))
+	return rows
+
+def write_table(rows,path):
+	""" Write sweep statistics as CSV (parameter columns in sorted order) """
+	params = sorted(set(k for row in rows for k in row) - set(('index','file','lines','bytes') + SUMMARY_FIELDS))
+	fields = ['index','file'] + params + list(SUMMARY_FIELDS) + ['lines','bytes']
+	with open(path,'w') as f:
+		writer = csv.DictWriter(f,fieldnames=fields)
+		writer.writeheader()
+		for row in rows:
+			writer.writerow(row)
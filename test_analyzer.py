@@ -0,0 +1,60 @@
+import pytest
+from analyzer import GcodeAnalyzer
+
+"""
+Reading back a program written by G must give the totals G computed while
+writing it.
+"""
+
+@pytest.mark.parametrize('options',[{},{'minimal_output':True},{'step_coordinates':True},{'diagnostics':'off'}])
+def test_totals_match_g(make_g,program,options):
+	g = make_g(program,**options)
+	summary = GcodeAnalyzer().feed(g.output.buffer).summary()
+	assert summary['travel_distance'] == pytest.approx(g.travel_distance,rel=1e-9)
+	assert summary['extrusion_distance'] == pytest.approx(g.extrusion_distance,rel=1e-9)
+	assert summary['extrusion_volume'] == pytest.approx(g.extrusion_volume,rel=1e-9)
+	assert summary['print_time'] == pytest.approx(g.print_time,rel=1e-9)
+	assert summary['max_e_position'] == g.max_e_position
+	assert summary['tool_volumes'] == [summary['extrusion_volume']]
+
+def test_tool_changes(make_g):
+	tools = [('BD-1ml','JG24-1.25TTX'),('BD-3ml','JG22-1.25TTX')]
+	g = make_g(tools=tools)
+	g.move(x=1,e=1)
+	g.select_tool(1)
+	g.move(x=1,e=1)
+	g.select_tool(0)
+	g.move(x=1,e=0.5)
+	a = GcodeAnalyzer(tools=tools).feed(g.output.buffer)
+	volumes = a.tool_volumes()
+	assert volumes[0] == pytest.approx(1.5*g.tools[0].syringe_cross_section)
+	assert volumes[1] == pytest.approx(g.tools[1].syringe_cross_section)
+	assert a.summary()['extrusion_volume'] == pytest.approx(g.extrusion_volume)
+	assert a.summary()['print_time'] == pytest.approx(g.print_time)
+
+def test_unknown_tool_takes_the_default_syringe():
+	a = GcodeAnalyzer().feed(['G91','T1','G1 E1.0000'])
+	assert len(a.tools) == 2
+	assert a.tool_volumes() == [0.0,pytest.approx(a.tools[0].syringe_cross_section)]
+
+def test_set_position():
+	a = GcodeAnalyzer().feed(['G91','G1 X10 E5','G1 E-1','G92 E0','G1 E2'])
+	e_mm = a.steps_to_mm['E']
+	# 1 mm refills the retraction, 1 mm is new material
+	assert a.extrusion_volume == pytest.approx(6*a.syringe_cross_section)
+	assert a.position['E']*e_mm == pytest.approx(2)
+	a.feed(['G90','G92 X0','G1 X1'])
+	assert a.position['X'] == int(round(a.mm_to_steps['X']))
+	a.feed(['G92','G1 Y2 E1']) # every axis back to 0
+	assert a.position['X'] == 0
+	assert a.travel_distance == pytest.approx(10+1+2)
+	assert a.extrusion_volume == pytest.approx(7*a.syringe_cross_section)
+	assert a.unknown == 0
+
+@pytest.mark.parametrize('ending',['\n',''])
+def test_file_in_chunks(make_g,program,tmp_path,ending):
+	lines = make_g(program).output.buffer
+	path = str(tmp_path/'program.gcode')
+	with open(path,'w') as f:
+		f.write('\n'.join(lines)+ending)
+	assert GcodeAnalyzer().analyze_file(path,chunk_size=97).summary() == GcodeAnalyzer().feed(lines).summary()
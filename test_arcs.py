@@ -0,0 +1,65 @@
+import math
+import numpy as np
+import pytest
+import arcs
+from main import G
+from sinks import MemorySink
+
+"""
+Arcs are split into the chords the firmware moves along, so lengths, times
+and linearized output all follow the same segment count.
+"""
+
+def test_sweep_angle():
+	assert arcs.sweep_angle(0,90,'CCW') == pytest.approx(math.pi/2)
+	assert arcs.sweep_angle(0,90,'CW') == pytest.approx(-3*math.pi/2)
+	assert arcs.sweep_angle(0,None,'CW') == -2*math.pi
+	assert arcs.sweep_angle(30,30,'CCW') == 2*math.pi
+	with pytest.raises(RuntimeError):
+		arcs.sweep_angle(0,90,'up')
+
+@pytest.mark.parametrize('radius,sweep,segment_length',[(1.0,2*math.pi,0.1),(3.0,-math.pi/2,0.1),(0.01,math.pi,1.0),(25.0,2*math.pi,0.5)])
+def test_segment_count_and_length(radius,sweep,segment_length):
+	n = int(arcs.segment_count(radius,sweep,segment_length))
+	assert n == max(int(math.floor(abs(sweep)*radius/segment_length)),1)
+	chords = arcs.chord_deltas(radius,0.0,sweep,segment_length)
+	assert len(chords) == n
+	assert float(arcs.arc_length(radius,sweep,segment_length)) == pytest.approx(np.hypot(chords[:,0],chords[:,1]).sum())
+	assert float(arcs.arc_length(radius,sweep,segment_length)) <= abs(sweep)*radius
+
+def test_full_circle_closes():
+	chords = arcs.chord_deltas(2.0,90.0,-2*math.pi,0.1)
+	assert chords.sum(axis=0).tolist() == [0.0,0.0]
+
+@pytest.mark.parametrize('radius,start,end,direction',[(2.0,180.0,None,'CW'),(3.0,0.0,90.0,'CCW'),(5.0,45.0,300.0,'CW')])
+def test_linearized_arc_emits_one_move_per_chord(radius,start,end,direction):
+	g = G(output=MemorySink(),include_header=False,diagnostics='off')
+	before = len(g.output.buffer)
+	g.arc_move(radius,start,end,e=1.0,direction=direction,linearize=True)
+	moves = [line for line in g.output.buffer[before:] if line.startswith('G1 X') or line.startswith('G1 Y')]
+	sweep = arcs.sweep_angle(start,end,direction)
+	assert len(moves) == int(arcs.segment_count(radius,sweep))
+	assert g.extrusion_distance == pytest.approx(1.0)
+
+def test_linearized_and_native_arcs_agree():
+	a = G(output=MemorySink(),diagnostics='off')
+	b = G(output=MemorySink(),diagnostics='off')
+	a.circular_move(4,'+Y',e=2)
+	b.circular_move(4,'+Y',e=2,linearize=True)
+	# the chords are rounded to whole steps one by one
+	assert b.travel_distance == pytest.approx(a.travel_distance,rel=1e-3)
+	assert b.print_time == pytest.approx(a.print_time,rel=1e-3)
+	assert b._current_position == a._current_position
+
+def test_chord_cache_is_bounded(monkeypatch):
+	monkeypatch.setattr(arcs,'CHORD_CACHE_SIZE',4)
+	monkeypatch.setattr(arcs,'_UNIT_CHORDS',arcs.OrderedDict())
+	first = arcs.unit_chords(8,0.0,math.pi)
+	for start in range(1,4):
+		arcs.unit_chords(8,float(start),math.pi)
+	assert arcs.unit_chords(8,0.0,math.pi) is first # hit, now the most recent
+	for start in range(4,20):
+		arcs.unit_chords(8,float(start),math.pi)
+	assert len(arcs._UNIT_CHORDS) == 4
+	assert arcs.unit_chords(8,0.0,math.pi) is not first
+	assert np.array_equal(arcs.unit_chords(8,0.0,math.pi),first)
@@ -0,0 +1,115 @@
+import numpy as np
+import pytest
+import batch
+import gcode_format
+from diagnostics import DIAGNOSTIC_LEVELS
+from main import G
+from sinks import FileSink,MemorySink,NullSink
+
+"""
+G.move_many must be indistinguishable from calling G.move for every element:
+same text, same totals (bit for bit), same position, history and toolpath.
+"""
+
+FORMATS = [{},{'minimal_output':True},{'step_coordinates':True},{'step_coordinates':True,'minimal_output':True}]
+TOTALS = ('extrusion_volume','travel_distance','extrusion_distance','print_time','max_e_position')
+
+def _moves(n=300,seed=1):
+	rng = np.random.RandomState(seed)
+	x = np.where(rng.rand(n) < 0.2,0.0,rng.uniform(-1,1,n))
+	y = rng.uniform(-1,1,n)
+	e = np.where(rng.rand(n) < 0.3,0.0,rng.uniform(-0.005,0.01,n)) # with retractions
+	return x,y,e
+
+def _assert_same(a,b):
+	assert b.output.buffer == a.output.buffer
+	for name in TOTALS:
+		assert getattr(b,name) == getattr(a,name), name
+	assert b._current_position == a._current_position
+	for axes in a.position_history:
+		assert list(b.position_history[axes]) == list(a.position_history[axes])
+
+@pytest.mark.parametrize('diagnostics',DIAGNOSTIC_LEVELS)
+@pytest.mark.parametrize('options',FORMATS)
+@pytest.mark.parametrize('absolute',[False,True])
+def test_batch_matches_scalar(monkeypatch,diagnostics,options,absolute):
+	monkeypatch.setattr(batch,'BATCH_CHUNK',97) # several chunks, the last one partial
+	x,y,e = _moves()
+	a = G(output=MemorySink(),diagnostics=diagnostics,**options)
+	b = G(output=MemorySink(),diagnostics=diagnostics,**options)
+	if absolute:
+		a.absolute()
+		b.absolute()
+	for k in range(len(x)):
+		a.move(x=x[k],y=y[k],e=e[k])
+	assert b.move_many(x=x,y=y,e=e) == len(x)
+	_assert_same(a,b)
+	if diagnostics == 'aggregate':
+		assert b.flow_statistics.lines(4) == a.flow_statistics.lines(4)
+
+@pytest.mark.parametrize('diagnostics',DIAGNOSTIC_LEVELS)
+def test_block_sinks(tmp_path,diagnostics):
+	# batches reach file and null sinks as one text per chunk
+	x,y,e = _moves()
+	a = G(output=MemorySink(),diagnostics=diagnostics)
+	for k in range(len(x)):
+		a.move(x=x[k],y=y[k],e=e[k])
+	b = G(output=NullSink(),diagnostics=diagnostics)
+	b.move_many(x=x,y=y,e=e)
+	assert (b.output.lines,b.output.bytes) == (a.output.lines,a.output.bytes)
+	path = str(tmp_path/'out.gcode')
+	with FileSink(path) as sink:
+		G(output=sink,diagnostics=diagnostics).move_many(x=x,y=y,e=e)
+	with open(path) as f:
+		assert f.read() == a.output.getvalue()
+	assert (sink.lines,sink.bytes) == (a.output.lines,a.output.bytes)
+
+@pytest.mark.parametrize('diagnostics',['off','full'])
+def test_recorded_batch_matches_scalar(diagnostics):
+	x,y,e = _moves()
+	a = G(output=MemorySink(),diagnostics=diagnostics,record=True)
+	b = G(output=MemorySink(),diagnostics=diagnostics,record=True)
+	for k in range(len(x)):
+		a.move(x=x[k],y=y[k],e=e[k])
+	b.move_many(x=x,y=y,e=e)
+	a.emit()
+	b.emit()
+	_assert_same(a,b)
+
+def test_scalar_axes_and_volume_units():
+	a = G(output=MemorySink())
+	b = G(output=MemorySink())
+	for k in range(20):
+		a.move(x=0.5,e=0.2,extrusionunit='uL')
+	b.move_many(x=0.5,e=[0.2]*20,extrusionunit='uL')
+	_assert_same(a,b)
+
+@pytest.mark.parametrize('digits',[0,1,2,4,6])
+@pytest.mark.parametrize('minimal',[False,True])
+def test_render_fixed_matches_percent(digits,minimal):
+	rng = np.random.RandomState(2)
+	values = np.concatenate((rng.normal(0,100,2000),rng.randint(-10**6,10**6,2000)/2.**rng.randint(0,20,2000),
+		[0.0,-0.0,0.03125,-0.03125,0.00005,-0.00004,0.5,2.5,-2.5,1e-300,123456.78905,9999.99995]))
+	fields = [batch.fixed_column(values,digits),batch.fixed_column(values[::-1],digits)]
+	lines = batch.render_fixed(['G1 X',' Y',''],fields,digits,minimal)
+	expected = ['G1 X{0} Y{1}'.format(gcode_format.format_number(u,digits,minimal),gcode_format.format_number(v,digits,minimal))
+		for u,v in zip(values.tolist(),values[::-1].tolist())]
+	assert lines == expected
+
+def test_fixed_column_leaves_huge_values_to_percent():
+	assert batch.fixed_column([1.0,3e12],4) is None
+	assert batch.fixed_column([1.0,float('nan')],4) is None
+	a = G(output=MemorySink())
+	b = G(output=MemorySink())
+	for v in (1.0,3e12,-3e12):
+		a.move(x=v)
+	b.move_many(x=[1.0,3e12,-3e12])
+	_assert_same(a,b)
+
+def test_quantize_relative_keeps_the_end_point():
+	g = G(output=MemorySink())
+	moves = np.full(1000,0.001)
+	quantized = batch.quantize_relative(g,'X',moves)
+	steps = quantized*g.mm_to_steps['X']
+	assert np.allclose(steps,np.round(steps))
+	assert abs(quantized.sum()-moves.sum()) <= 0.5/g.mm_to_steps['X']
@@ -0,0 +1,40 @@
+from benchmarks import runner
+
+"""
+The benchmark gate compares ratios measured in the same run, and absolute
+throughput only against baselines recorded on the same machine.
+"""
+
+def _result(units_per_second,scale=1.0):
+	return {'scale':scale,'units':1,'seconds':1./units_per_second,'units_per_second':units_per_second,
+		'output_lines':1,'output_bytes':100,'peak_memory':None}
+
+def _results(batch,scalar,scale=1.0):
+	return {runner.key(name,configuration):_result(rate,scale)
+		for name,rate in (('small_moves_batch',batch),('small_moves',scalar)) for configuration in runner.CONFIGURATIONS}
+
+def test_ratios():
+	ratios = runner.ratios(_results(1000.,100.))
+	assert ratios[runner.key('small_moves_batch','default')] == 10.
+	assert ratios[runner.key('small_moves','history')] == 1.
+	assert runner.ratios({runner.key('small_moves','default'):_result(1.)}) == {}
+
+def test_ratio_gate_ignores_machine_speed():
+	baselines = runner.update_baselines(runner.load_baselines('missing.json'),_results(1000.,100.))
+	assert runner.compare(_results(1000.,100.),baselines) == []
+	baselines['machine'] = 'elsewhere'
+	assert runner.compare(_results(100.,10.),baselines) == [] # a slower machine, same speedup
+	regressions = runner.compare(_results(500.,100.),baselines)
+	assert len(regressions) == len(runner.CONFIGURATIONS)
+	assert all('ratio' in message for message in regressions)
+	assert runner.compare(_results(500.,100.,scale=0.5),baselines) == []
+
+def test_throughput_gate_on_same_machine():
+	baselines = runner.update_baselines(runner.load_baselines('missing.json'),_results(1000.,100.))
+	regressions = runner.compare(_results(100.,10.),baselines)
+	assert regressions and all('throughput' in message for message in regressions)
+
+def test_run_default_configuration():
+	results = runner.run(['plate_96'],scale=0.01,repeat=1,memory=False)
+	assert sorted(results) == [runner.key('plate_96',configuration) for configuration in sorted(runner.CONFIGURATIONS)]
+	assert len(set(result['output_bytes'] for result in results.values())) == 1
@@ -0,0 +1,59 @@
+import io
+import pytest
+import binary_gcode
+from toolpath import Toolpath
+
+"""
+A binary program decodes to exactly the text G emits for the same toolpath.
+"""
+
+def _summary(g):
+	g.summary_report()
+
+def _text(make_g,program,**options):
+	g = make_g(program,_summary,record=True,**options)
+	g.emit()
+	return g.output.buffer
+
+def _binary(make_g,program,target,**options):
+	return make_g(program,_summary,record=True,**options).emit_binary(target)
+
+@pytest.mark.parametrize('options',[{},{'minimal_output':True},{'output_digits':2}])
+def test_round_trip_bytes(make_g,program,options):
+	stream = io.BytesIO()
+	size = _binary(make_g,program,stream,**options)
+	data = stream.getvalue()
+	assert size == len(data)
+	assert list(binary_gcode.decode_lines(data)) == _text(make_g,program,**options)
+	stream.seek(0)
+	assert list(binary_gcode.decode_lines(stream)) == _text(make_g,program,**options)
+
+@pytest.mark.parametrize('name',['program.gcb','program.gcb.gz'])
+def test_round_trip_file(make_g,program,tmp_path,name):
+	path = str(tmp_path/name)
+	_binary(make_g,program,path)
+	assert list(binary_gcode.decode_lines(path)) == _text(make_g,program)
+
+def test_encode_decode_toolpath(make_g,program):
+	tp = make_g(program,record=True)._toolpath
+	decoded,digits,minimal = binary_gcode.decode(binary_gcode.encode(tp,3,True))
+	assert (digits,minimal) == (3,True)
+	assert list(decoded.lines(3,True)) == list(tp.lines(3,True))
+
+def test_not_binary():
+	with pytest.raises(RuntimeError):
+		binary_gcode.decode(b'G1 X1\n')
+
+def test_start_tool(make_g,program):
+	tp = make_g(program,record=True)._toolpath
+	tp = Toolpath(tp.start_position,tp.start_steps_per_mm,tp.start_relative,tp.start_speed,tool=2)
+	decoded = binary_gcode.decode(binary_gcode.encode(tp))[0]
+	assert decoded.start_tool == 2
+
+def test_end_code_is_not_a_record():
+	flags = (binary_gcode._NEW_STRING,binary_gcode._NEW_FEED,binary_gcode._NEW_I,binary_gcode._NEW_J)
+	codes = set()
+	for op in range(8):
+		for k in range(16):
+			codes.add(op | sum(flag for n,flag in enumerate(flags) if k >> n & 1))
+	assert binary_gcode._END not in codes
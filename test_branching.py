@@ -0,0 +1,110 @@
+import pytest
+from sinks import MemorySink,NullSink,FileSink,GzipSink
+
+"""
+Snapshots and forks give the same program as generating each variant from
+scratch, and branches never see each other's changes.
+"""
+
+def _variant_a(g):
+	g.move(e=-2)
+	g.move(z=5)
+
+def _variant_b(g):
+	g.absolute()
+	g.move(x=0,y=0,e=3)
+
+def _state(g):
+	return (list(g.output.buffer),g._current_position,g.travel_distance,g.extrusion_volume,g.print_time,
+		g.max_e_position,g.speed,g.is_relative,list(g.position_history['X']))
+
+def test_restore_reproduces_output(make_g,program):
+	g = make_g(program)
+	checkpoint = g.snapshot()
+	_variant_a(g)
+	assert _state(g) == _state(make_g(program,_variant_a))
+	g.restore(checkpoint)
+	assert _state(g) == _state(make_g(program))
+	_variant_b(g)
+	assert _state(g) == _state(make_g(program,_variant_b))
+
+def test_fork_isolation(make_g,program):
+	g = make_g(program)
+	branch = g.fork()
+	_variant_b(branch)
+	assert _state(g) == _state(make_g(program))
+	_variant_a(g)
+	assert _state(branch) == _state(make_g(program,_variant_b))
+	assert _state(g) == _state(make_g(program,_variant_a))
+
+def test_fork_from_snapshot(make_g,program):
+	g = make_g(program)
+	checkpoint = g.snapshot()
+	_variant_a(g)
+	branch = g.fork(snapshot=checkpoint)
+	_variant_b(branch)
+	assert _state(branch) == _state(make_g(program,_variant_b))
+	assert _state(g) == _state(make_g(program,_variant_a))
+
+def test_snapshot_while_recording(make_g,program):
+	g = make_g(program,record=True)
+	checkpoint = g.snapshot()
+	_variant_a(g)
+	branch = g.fork(snapshot=checkpoint)
+	_variant_b(branch)
+	g.restore(checkpoint)
+	_variant_b(g)
+	expected = make_g(program,_variant_b,record=True)
+	for generator in (g,branch,expected):
+		generator.emit()
+	assert _state(g) == _state(expected)
+	assert _state(branch) == _state(expected)
+
+def test_null_sink_counts(make_g,program):
+	g = make_g(output=NullSink())
+	program(g)
+	lines = g.output.lines
+	checkpoint = g.snapshot()
+	_variant_a(g)
+	g.restore(checkpoint)
+	assert g.output.lines == lines
+
+def test_file_sinks(make_g,program,tmp_path):
+	path = str(tmp_path/'out.gcode')
+	with FileSink(path) as sink:
+		g = make_g(output=sink)
+		program(g)
+		checkpoint = g.snapshot()
+		_variant_a(g)
+		g.restore(checkpoint)
+		with pytest.raises(RuntimeError):
+			make_g().restore(checkpoint)
+		with pytest.raises(RuntimeError):
+			g.fork()
+	with open(path) as f:
+		assert f.read() == make_g(program).output.getvalue()
+	with GzipSink(str(tmp_path/'out.gcode.gz')) as sink:
+		g = make_g(output=sink)
+		with pytest.raises(RuntimeError):
+			g.restore(g.snapshot())
+		with pytest.raises(RuntimeError):
+			g.fork()
+		branch = g.fork(output=MemorySink())
+		_variant_a(branch)
+	expected = make_g()
+	written = len(expected.output.buffer)
+	_variant_a(expected)
+	assert branch.output.buffer == expected.output.buffer[written:]
+
+def test_flow_statistics_are_isolated(make_g,program):
+	g = make_g(program,diagnostics='aggregate')
+	statistics = g.flow_statistics
+	count,total = statistics.flow_rate.count,statistics.flow_rate.total
+	checkpoint = g.snapshot()
+	branch = g.fork()
+	_variant_b(branch)
+	_variant_b(g)
+	assert branch.flow_statistics.flow_rate.count == g.flow_statistics.flow_rate.count > count
+	g.restore(checkpoint)
+	assert (g.flow_statistics.flow_rate.count,g.flow_statistics.flow_rate.total) == (count,total)
+	assert g.flow_statistics.lines() == make_g(program,diagnostics='aggregate').flow_statistics.lines()
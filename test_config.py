@@ -0,0 +1,26 @@
+import config
+from main import G
+
+"""
+import * from config still exports the constants derived from the default
+printer and tip profiles, although they are computed on first use.
+"""
+
+DERIVED = ('MICROSTEPPING','STEPS_PER_REVOLUTION','DEFAULT_AXIS_STEPS_PER_MM','MM_PER_STEP',
+	'MOTOR_STEP_ANGLE','DEFAULT_MAX_ACCELERATION','DEFAULT_MAX_JERK','TIP_CROSS_SECTIONAL_DIAMETER','TIP_CROSS_SECTIONAL_AREA')
+
+def test_import_star_exports_derived_constants():
+	namespace = {}
+	exec('from config import *',namespace)
+	for name in DERIVED:
+		assert namespace[name] == getattr(config,name), name
+		assert name in dir(config)
+	assert namespace['MICROSTEPPING'] == config.printer_profile().microstepping
+	assert namespace['TIP_CROSS_SECTIONAL_AREA'] == config.tip_profile().cross_section
+	for name in ('PRINTER','TIP_ID','WELL_PLATE_PITCH','printer_profile','math','hardware'):
+		assert name in namespace, name
+
+def test_default_microstepping(make_g):
+	assert make_g().microstepping == config.MICROSTEPPING
+	assert make_g(microstepping=None).microstepping == make_g().printer.microstepping
+	assert make_g(microstepping=8).steps_per_rev == make_g().steps_per_rev/2
@@ -0,0 +1,63 @@
+import numpy as np
+import pytest
+import deposition
+from plate_layout import Layout
+
+"""
+The simulator deposits exactly what G extruded, tool by tool, and puts it
+where the head went.
+"""
+
+TOOLS = [('BD-1ml','JG24-1.25TTX'),('BD-3ml','JG22-1.25TTX')]
+
+def _tool_changes(g):
+	g.move(x=2,e=2)
+	g.move(e=-1)
+	g.select_tool(1)
+	g.move(x=2,e=1)
+	g.select_tool(0)
+	g.move(y=2,e=1.5)
+
+@pytest.mark.parametrize('dims',[2,3])
+def test_deposited_equals_extruded(make_g,program,dims):
+	g = make_g(program)
+	result = deposition.simulate(g,resolution=0.25,dims=dims)
+	assert result.dims == dims
+	assert result.total_volume == pytest.approx(g.extrusion_volume)
+	assert float(result.volume.sum()) == pytest.approx(g.extrusion_volume)
+	assert result.outside_volume == pytest.approx(0.0,abs=1e-9)
+
+def test_volumes_per_tool(make_g):
+	g = make_g(_tool_changes,tools=TOOLS)
+	history = g.position_history
+	volumes = deposition.move_volumes(history,g.steps_to_mm,[tool.syringe_cross_section for tool in g.tools])
+	tools = deposition.move_tools(history)
+	per_tool = [float(volumes[tools == k].sum()) for k in range(2)]
+	assert per_tool == [pytest.approx(v) for v in g.tool_volumes()]
+	result = deposition.simulate(g,resolution=0.5)
+	assert float(result.volume.sum()) == pytest.approx(g.extrusion_volume)
+
+def test_bounds_and_history_off(make_g,program):
+	g = make_g(program)
+	result = deposition.simulate(g,resolution=0.5,bounds=((0.0,3.0),(0.0,3.0)))
+	assert result.volume.shape == (6,6)
+	assert float(result.volume.sum()) + result.outside_volume == pytest.approx(g.extrusion_volume)
+	assert result.outside_volume > 0.0
+	with pytest.raises(RuntimeError):
+		deposition.simulate(make_g(program,history='off'))
+
+def test_well_volumes(make_g,tmp_path):
+	layout = Layout('96-well plate')
+	layout.add(25,rate=1,replicates=3)
+	layout.add(10,rate=1,wells='B2')
+	g = make_g(diagnostics='off')
+	layout.compile(g)
+	result = deposition.simulate(g,resolution=1.0)
+	volumes = result.well_volumes(layout)
+	step = g.steps_to_mm['E']*g.syringe_cross_section
+	assert volumes == dict((well,pytest.approx(volume,abs=step)) for well,volume in (('A1',25),('A2',25),('A3',25),('B2',10)))
+	path = str(tmp_path/'plate.npz')
+	result.save(path)
+	loaded = deposition.load(path)
+	assert np.array_equal(loaded.volume,result.volume)
+	assert (loaded.origin,loaded.resolution,loaded.total_volume) == (tuple(result.origin),result.resolution,result.total_volume)
@@ -0,0 +1,89 @@
+import math
+import re
+import numpy as np
+import pytest
+from diagnostics import DIAGNOSTIC_LEVELS,FlowStatistics,RunningStatistic,diagnostic_level,filament_width
+
+"""
+Each diagnostics level writes what it promises and no more, and the aggregate
+statistics summarize the same per-move values the 'full' comments report.
+"""
+
+def _comments(g):
+	return [line for line in g.output.buffer if line.startswith(';')]
+
+def test_levels(make_g,program):
+	off,summary,aggregate,full = [make_g(program,diagnostics=level) for level in DIAGNOSTIC_LEVELS]
+	for g in (off,summary,aggregate,full):
+		g.summary_report()
+	moves = [line for line in full.output.buffer if line.startswith('G')]
+	for g in (off,summary,aggregate):
+		assert [line for line in g.output.buffer if line.startswith('G')] == moves
+	assert not any(line.startswith(';Total') for line in off.output.buffer)
+	assert any(line.startswith(';Total extruded volume') for line in summary.output.buffer)
+	assert not any(line.startswith(';Extr.') for line in summary.output.buffer+aggregate.output.buffer)
+	assert any(line.startswith(';Flow rate (uL/s)') for line in aggregate.output.buffer)
+	assert not any(line.startswith(';Flow rate (uL/s)') for line in full.output.buffer)
+	assert any(line.startswith(';Extr. rate') for line in full.output.buffer)
+	with pytest.raises(RuntimeError):
+		diagnostic_level('verbose')
+
+def _no_arcs(g):
+	# arc moves (arc_move, print_disc) report their flow rate but not their
+	# filament width at 'full'
+	g.move(e=5)
+	g.move(x=5,y=5,e=1.01,extrusionunit='uL')
+	g.move_many(x=[1.0,1.0,-2.0],e=[0.1,0.2,0.3])
+	g.print_square(10,0.2)
+
+def test_aggregate_matches_full(make_g,program):
+	for steps in (program,_no_arcs):
+		full = make_g(steps,diagnostics='full')
+		aggregate = make_g(steps,diagnostics='aggregate').flow_statistics
+		lines = full.output.buffer
+		# the same comment announces a feedrate change, before its G1 F line
+		moves = [line for line,following in zip(lines,lines[1:]+['']) if not following.startswith('G1 F')]
+		rates = [float(m.group(1)) for m in (re.match(';Extr(?:. rate|usion rate): .* \\(?(\\S+) uL/s',line) for line in moves) if m]
+		tolerance = 10**-full.output_digits
+		assert aggregate.flow_rate.count == len(rates)
+		assert aggregate.flow_rate.minimum == pytest.approx(min(rates),abs=tolerance)
+		assert aggregate.flow_rate.maximum == pytest.approx(max(rates),abs=tolerance)
+		assert aggregate.flow_rate.mean == pytest.approx(np.mean(rates),abs=tolerance)
+	widths = [float(m.group(1)) for m in (re.match(';Filament width \\(elliptical assumption\\): (\\S+) mm',line) for line in full.output.buffer) if m]
+	assert aggregate.filament_width.count == len(widths)
+	assert aggregate.filament_width.minimum == pytest.approx(min(widths),abs=tolerance)
+	assert aggregate.filament_width.maximum == pytest.approx(max(widths),abs=tolerance)
+	assert aggregate.filament_width.mean == pytest.approx(np.mean(widths),abs=tolerance)
+
+def test_running_statistic():
+	values = np.array([3.0,-1.0,2.5,7.0])
+	one = RunningStatistic()
+	for v in values.tolist():
+		one.add(v)
+	many = RunningStatistic()
+	many.add_many(values[:1])
+	many.add_many(values[:0])
+	many.add_many(values[1:])
+	for stat in (one,many):
+		assert (stat.count,stat.minimum,stat.maximum) == (4,-1.0,7.0)
+		assert stat.mean == pytest.approx(values.mean())
+	assert RunningStatistic().mean is None
+	copy = one.copy()
+	one.add(100.0)
+	assert (copy.count,copy.maximum) == (4,7.0)
+
+def test_flow_statistics_lines():
+	statistics = FlowStatistics()
+	assert statistics.lines() == [';Flow rate: no moves',';Filament width: no moves']
+	statistics.add(2.0)
+	statistics.add(4.0,0.5)
+	lines = statistics.lines(2)
+	assert lines[0] == ';Flow rate (uL/s): min 2.00 | mean 3.00 | max 4.00 over 2 moves'
+	assert lines[1] == ';Filament width (mm): min 0.50 | mean 0.50 | max 0.50 over 1 moves'
+
+def test_filament_width():
+	# a filament of elliptical section, width w and height h, has an area pi*w*h/4
+	w,h,length = 0.4,0.2,10.0
+	assert filament_width(math.pi*w*h/4*length,length,h) == pytest.approx(w)
+	volumes = np.array([1.0,2.0])
+	assert filament_width(volumes,np.array([4.0,4.0]),h).tolist() == [filament_width(v,4.0,h) for v in volumes.tolist()]
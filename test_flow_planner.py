@@ -0,0 +1,58 @@
+import pytest
+import hardware
+from analyzer import GcodeAnalyzer
+from flow_planner import FlowLimiter,shear_limited_flow,wall_shear_rate
+
+"""
+The flow planner keeps every move within the flow and shear limits of its
+tool, and only slows down the moves that exceed them.
+"""
+
+def _plan(make_g,program,**kwargs):
+	g = make_g(program,record=True,diagnostics='off')
+	return g,g.plan_flow(**kwargs)
+
+def test_shear_conversions():
+	assert wall_shear_rate(shear_limited_flow(5000.0,0.41),0.41) == pytest.approx(5000.0)
+
+@pytest.mark.parametrize('limits',[{'max_flow':2.0},{'max_shear_rate':1000.0},{'max_flow':2.0,'max_shear_rate':1000.0}])
+def test_segments_within_limits(make_g,program,limits):
+	g,plan = _plan(make_g,program,**limits)
+	tip_ID = g.tools[0].tip_ID
+	assert plan.limited()
+	for segment in plan.segments:
+		assert segment.flow <= limits.get('max_flow',float('inf'))*(1+1e-9)
+		assert segment.shear_rate <= limits.get('max_shear_rate',float('inf'))*(1+1e-9)
+		assert segment.shear_rate == pytest.approx(wall_shear_rate(segment.flow,tip_ID))
+		if segment.limit == 'feed':
+			assert segment.feed == segment.requested_feed
+		else:
+			assert segment.feed < segment.requested_feed
+	assert plan.time > plan.requested_time
+
+def test_tip_profile_limits(make_g,program):
+	g,plan = _plan(make_g,program)
+	tip = g.tools[0].profile.tip
+	cap = min(tip.extra['max_flow'],shear_limited_flow(tip.extra['max_shear_rate'],tip.inner_diameter))
+	assert plan.limited()
+	assert max(segment.flow for segment in plan.segments) <= cap*(1+1e-9)
+
+def test_unlimited_moves_are_untouched(make_g,program):
+	g,plan = _plan(make_g,program,max_flow=1e9,max_shear_rate=1e12)
+	r = make_g(program,record=True,diagnostics='off')
+	r.emit()
+	# the planner writes each G1 F just before the move that needs it
+	assert [line for line in g.output.buffer if not line.startswith('G1 F')] == [line for line in r.output.buffer if not line.startswith('G1 F')]
+	assert GcodeAnalyzer().feed(g.output.buffer).summary() == GcodeAnalyzer().feed(r.output.buffer).summary()
+	assert plan.time == pytest.approx(plan.requested_time)
+
+def test_tool_without_limits_is_an_error():
+	hardware.register('tips','unrated',inner_diameter=0.3)
+	try:
+		tool = hardware.tool_profile('BD-1ml','unrated')
+		with pytest.raises(RuntimeError):
+			FlowLimiter([tool])
+		assert FlowLimiter([tool],max_flow=1.0)._caps[0][2] == 1.0
+	finally:
+		hardware.REGISTRY._registered['tips'].pop('unrated')
+		hardware.REGISTRY._reset()
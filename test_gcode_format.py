@@ -0,0 +1,67 @@
+from fractions import Fraction
+import random
+import pytest
+import gcode_format
+
+"""
+The integer step renderer is exact: it must match the decimal value of
+steps/steps_per_mm rounded half to even, and the float renderers must match a
+plain '%.*f' per value.
+"""
+
+STEPS_PER_MM = (80.0,400.0,853.3333333333334,2133.3333,1.0/3.0)
+
+def _reference(steps,steps_per_mm,digits):
+	value = Fraction(steps)/Fraction(repr(float(steps_per_mm)))*10**digits
+	q = abs(value)
+	number = int(q)
+	rest = q - number
+	if rest > Fraction(1,2) or (rest == Fraction(1,2) and number % 2 == 1):
+		number += 1
+	text = str(number).rjust(digits+1,'0')
+	if digits:
+		text = text[:-digits] + '.' + text[-digits:]
+	return ('-' if steps < 0 else '') + text
+
+@pytest.mark.parametrize('steps_per_mm',STEPS_PER_MM)
+@pytest.mark.parametrize('digits',[0,2,4,6])
+def test_format_steps_is_exact(steps_per_mm,digits):
+	rng = random.Random(3)
+	steps = [0,1,-1,2,-2,5,40,-40,10**9] + [rng.randint(-10**7,10**7) for k in range(500)]
+	for s in steps:
+		assert gcode_format.format_steps(s,steps_per_mm,digits) == _reference(s,steps_per_mm,digits)
+
+def test_format_steps_rounds_half_to_even():
+	# 1 step at 80 steps/mm is 0.0125 mm
+	assert gcode_format.format_steps(1,80.0,3) == '0.012'
+	assert gcode_format.format_steps(3,80.0,3) == '0.038'
+	assert gcode_format.format_steps(-1,80.0,3) == '-0.012'
+
+def test_format_steps_minimal():
+	assert gcode_format.format_steps(80,80.0,4,True) == '1'
+	assert gcode_format.format_steps(100,80.0,4,True) == '1.25'
+	assert gcode_format.format_steps(0,80.0,4,True) == '0'
+	assert gcode_format.format_steps(-1,80.0,1,True) == '0' # -0.0 rounds to zero
+
+@pytest.mark.parametrize('number,expected',[('1.2500','1.25'),('2.0000','2'),('-0.0000','0'),('0.0000','0'),('10','10'),('-3.1000','-3.1')])
+def test_strip_zeros(number,expected):
+	assert gcode_format.strip_zeros(number) == expected
+
+@pytest.mark.parametrize('minimal',[False,True])
+def test_rows_match_args(minimal):
+	rng = random.Random(4)
+	letters = ('X','Y','E')
+	columns = [[rng.uniform(-100,100) for k in range(200)] for letter in letters]
+	columns[0][:3] = [0.0,-0.0,2.5]
+	rows = gcode_format.format_rows(letters,columns,4,minimal,prefix='G1 ')
+	assert rows == ['G1 '+gcode_format.format_args(letters,values,4,minimal) for values in zip(*columns)]
+	assert gcode_format.format_column(columns[1],4,minimal) == [gcode_format.format_number(v,4,minimal) for v in columns[1]]
+
+def test_step_rows_match_step_args():
+	rng = random.Random(5)
+	letters = ('X','E')
+	steps_per_mm = (80.0,853.3333333333334)
+	columns = [[rng.randint(-10**5,10**5) for k in range(100)] for letter in letters]
+	rows = gcode_format.format_step_rows(letters,columns,steps_per_mm,4,True)
+	assert rows == [gcode_format.format_step_args(letters,steps,steps_per_mm,4,True) for steps in zip(*columns)]
+	assert gcode_format.format_table('A%d',[],0) == []
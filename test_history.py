@@ -0,0 +1,93 @@
+import numpy as np
+import pytest
+from history import PositionHistory
+
+"""
+The history keeps positions in chronological order in every mode, and reading
+a column does not copy it again until something new is recorded.
+"""
+
+AXES = ('X','E')
+
+def _record(history,start,stop,arcs=()):
+	for k in range(start,stop):
+		history.record({'X':k,'E':-k},feed=float(k),arc=(0.5,0.0,1.0) if k in arcs else None)
+
+def test_full():
+	h = PositionHistory(AXES)
+	_record(h,0,10)
+	h.record_many({'X':np.arange(10,15),'E':-np.arange(10,15)},feed=np.arange(10,15,dtype=float))
+	assert len(h) == 15
+	assert h.column('X').tolist() == list(range(15))
+	assert h.column('feed').tolist() == [float(k) for k in range(15)]
+	assert h.value('E',-1) == -14
+
+@pytest.mark.parametrize('maxlen',[1,4,7])
+def test_ring(maxlen):
+	h = PositionHistory(AXES,'ring',maxlen)
+	_record(h,0,3,arcs=(1,))
+	assert h.column('X').tolist() == list(range(3))[-maxlen:]
+	_record(h,3,20,arcs=(15,19))
+	h.record_many({'X':list(range(20,23)),'E':[0]*3})
+	assert len(h) == maxlen
+	assert h.recorded == 23
+	assert h.column('X').tolist() == list(range(23))[-maxlen:]
+	assert [h.value('X',k) for k in range(maxlen)] == list(range(23))[-maxlen:]
+	index = h.arcs()[0]
+	assert index == [k-(23-maxlen) for k in (15,19) if k >= 23-maxlen]
+
+def test_ring_snapshot():
+	h = PositionHistory(AXES,'ring',4)
+	_record(h,0,6)
+	state = h.snapshot()
+	_record(h,6,9)
+	fork = h.fork()
+	h.restore(state)
+	assert h.column('X').tolist() == [2,3,4,5]
+	assert fork.column('X').tolist() == [5,6,7,8]
+
+def test_off():
+	h = PositionHistory(AXES,'off')
+	_record(h,0,5,arcs=(2,))
+	h.record_tool(1)
+	assert len(h) == 0
+	assert h.recorded == 5
+	assert h.column('X').tolist() == []
+	assert h.arcs() == ([],[],[],[])
+	assert len(h.array('X')) == 0
+	with pytest.raises(IndexError):
+		h.value('X',0)
+
+def test_bad_modes():
+	with pytest.raises(RuntimeError):
+		PositionHistory(AXES,'sparse')
+	with pytest.raises(RuntimeError):
+		PositionHistory(AXES,'ring')
+
+@pytest.mark.parametrize('mode',['full','ring'])
+def test_columns_are_cached(mode):
+	h = PositionHistory(AXES,mode,8)
+	_record(h,0,5)
+	column = h.column('X')
+	values = np.asarray(h.view()['X'])
+	assert h.column('X') is column
+	assert np.asarray(h.view()['X']) is values
+	assert not values.flags.writeable
+	with pytest.raises(ValueError):
+		values[0] = 1
+	_record(h,5,6) # recording still works while the view is alive
+	assert h.column('X') is not column
+	assert np.asarray(h.view()['X']).tolist() == list(range(6))
+	assert values.tolist() == list(range(5))
+	assert np.asarray(h.view()['X'],dtype=float).dtype == np.float64
+
+def test_cache_after_restore():
+	h = PositionHistory(AXES)
+	_record(h,0,3)
+	state = h.snapshot()
+	_record(h,3,5)
+	h.restore(state)
+	_record(h,10,12)
+	assert np.asarray(h.view()['X']).tolist() == [0,1,2,10,11]
+	h.restore(state)
+	assert h.column('X').tolist() == [0,1,2]
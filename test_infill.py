@@ -0,0 +1,39 @@
+import numpy as np
+import pytest
+import infill
+
+"""
+Infill covers the outline, and a layer deposits its volume once whatever the
+number of redundant passes: the passes share it.
+"""
+
+L_SHAPE = [(0,0),(6,0),(6,2),(2,2),(2,6),(0,6)]
+
+def test_path_volumes_add_up():
+	for redundancy in (1,2,3):
+		paths = infill.layer_paths(L_SHAPE,0.25,redundancy)
+		volumes = infill.path_volumes(paths,12.0)
+		assert sum(float(v.sum()) for v in volumes) == pytest.approx(12.0)
+
+def test_segments_inside():
+	starts,ends,line = infill.scan_segments(L_SHAPE,0.25,30.0)
+	assert len(line)
+	assert infill.points_inside(L_SHAPE,np.vstack((starts,ends,(starts+ends)/2.)),1e-6).all()
+
+@pytest.mark.parametrize('redundancy',[1,2,3])
+def test_layer_volume_is_conserved(make_g,redundancy):
+	g = make_g(diagnostics='off')
+	g.print_polygon(L_SHAPE,0.2,0.25,redundancy)
+	volume = infill.polygon_area(L_SHAPE)*0.2
+	step = g.steps_to_mm['E']*g.syringe_cross_section # uL per E step
+	assert g.extrusion_volume == pytest.approx(volume,abs=step)
+	assert g._current_position['X'] == g._current_position['Y'] == 0
+
+def test_passes_share_the_volume(make_g):
+	one = make_g(lambda g: g.print_square(10,0.2,redundancy=1),diagnostics='off')
+	two = make_g(lambda g: g.print_square(10,0.2,redundancy=2),diagnostics='off')
+	full = make_g(lambda g: g.print_polygon(infill.rectangle(10,10),0.2,redundancy=2,volume=2*10*10*0.2),diagnostics='off')
+	step = one.steps_to_mm['E']*one.syringe_cross_section
+	assert one.extrusion_volume == pytest.approx(20.0,abs=step)
+	assert two.extrusion_volume == pytest.approx(20.0,abs=step)
+	assert full.extrusion_volume == pytest.approx(40.0,abs=step)
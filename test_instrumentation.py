@@ -0,0 +1,48 @@
+import json
+import pytest
+tracemalloc = pytest.importorskip('tracemalloc')
+from instrumentation import DEFAULT_METHODS
+
+"""
+Instrumentation counts the calls of the wrapped methods and the lines written,
+and leaves tracemalloc as it found it.
+"""
+
+def test_counts(make_g,program):
+	g = make_g()
+	profile = g.instrument()
+	program(g)
+	g.print_polygon([(0,0),(4,0),(4,4),(0,4)],0.2,spacing=1.0)
+	report = profile.detach().report()
+	# print_square of the program fills a polygon too
+	for name in ('print_polygon','print_scaffold','_format_step_args'):
+		assert name in DEFAULT_METHODS
+	assert report['methods']['print_polygon']['calls'] == 2
+	assert report['methods']['move']['calls'] > 0
+	assert report['output']['written_lines'] == report['output']['lines']
+	assert 'move' not in g.__dict__
+
+def test_profile_stops_tracing(make_g,program,tmp_path):
+	assert not tracemalloc.is_tracing()
+	path = str(tmp_path/'profile.json')
+	g = make_g(program,profile=path)
+	assert tracemalloc.is_tracing()
+	g.summary_report()
+	assert not tracemalloc.is_tracing()
+	with open(path) as f:
+		report = json.load(f)
+	assert report['methods']['summary_report']['calls'] == 1
+	assert report['memory']['peak_bytes'] > 0
+	assert [snapshot['label'] for snapshot in report['memory']['snapshots']] == ['end']
+	calls = g.instrumentation.calls['move']
+	g.move(x=1) # still timed after the dump
+	assert g.instrumentation.calls['move'] == calls + 1
+
+def test_foreign_tracing_is_left_running(make_g):
+	tracemalloc.start()
+	try:
+		g = make_g()
+		g.instrument().detach()
+		assert tracemalloc.is_tracing()
+	finally:
+		tracemalloc.stop()
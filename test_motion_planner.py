@@ -0,0 +1,21 @@
+import pytest
+
+"""
+The acceleration-aware estimate is never shorter than the constant feedrate
+time, and needs the position history.
+"""
+
+def test_estimate_at_least_constant_feedrate(make_g,program):
+	g = make_g(program,planner_estimate=True)
+	times = g.report_planner_time()
+	assert len(times) == len(g.position_history['X']) - 1
+	assert times.sum() >= g.print_time*(1-1e-9)
+	g.summary_report()
+	assert g.output.buffer[-1].startswith(';Estimated print time (acceleration model)')
+
+def test_history_off(make_g,program):
+	g = make_g(program,history='off',planner_estimate=True)
+	with pytest.raises(RuntimeError,match='history is off'):
+		g.report_planner_time()
+	with pytest.raises(RuntimeError,match='history is off'):
+		g.summary_report()
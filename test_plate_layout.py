@@ -0,0 +1,36 @@
+import pytest
+from plate_layout import Layout,PlateGeometry
+
+"""
+The vectorized compile path writes the same program and leaves G in the same
+state as the call-by-call reference, for every visit order and diagnostics level.
+"""
+
+def _layout():
+	layout = Layout('96-well plate')
+	layout.add(25,rate=1,replicates=5,label='control')
+	layout.add(10,rate=0.5,wells='B3:C6',label='low rate')
+	layout.add(5,replicates=3,tool=1)
+	layout.add(20,rate=300,rate_unit='mm/min',wells=['H12','A12'])
+	return layout
+
+def _state(g):
+	return (g.output.buffer,g._current_position,g.travel_distance,g.extrusion_volume,g.print_time,
+		g.max_e_position,g.speed,g.active_tool,g.tool_volumes())
+
+@pytest.mark.parametrize('order',['serpentine','rows','input','schedule'])
+@pytest.mark.parametrize('diagnostics',['full','aggregate','off'])
+def test_fast_matches_reference(make_g,order,diagnostics):
+	states = []
+	for fast in (False,True):
+		g = make_g(num_extruder=2,diagnostics=diagnostics)
+		_layout().compile(g,order=order,fast=fast)
+		g.summary_report()
+		states.append(_state(g))
+	assert states[0] == states[1]
+
+def test_pitch():
+	# the plate profile uses the SBS standard pitch, 96wellDepositionExperiment.py its own 9.1 mm
+	plate = PlateGeometry('96-well plate')
+	assert plate.pitch == 9.0
+	assert Layout(plate).offset('B2') == (-9.0,-9.0)
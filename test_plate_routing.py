@@ -0,0 +1,52 @@
+import numpy as np
+import pytest
+from config import *
+from plate_routing import plan_route,run_route,serpentine_order
+
+"""
+Planned routes are never slower than the serpentine over the rows, and every
+dispense runs at its own rate rather than at the travel feedrate.
+"""
+
+def _grid(rows,columns,pitch):
+	return np.array([(c*pitch,-r*pitch) for r in range(rows) for c in range(columns)])
+
+def _serpentine_time(wells,**options):
+	return plan_route(wells[serpentine_order(wells)],optimize=False,**options).travel_time
+
+@pytest.mark.parametrize('return_home',[True,False])
+def test_shuffled_plate_not_worse_than_serpentine(return_home):
+	wells = _grid(16,24,4.5)
+	wells = wells[np.random.RandomState(0).permutation(len(wells))]
+	route = plan_route(wells,return_home=return_home)
+	assert sorted(route.order) == list(range(len(wells)))
+	assert route.travel_time <= _serpentine_time(wells,return_home=return_home) + 1e-9
+	assert route.lifts()[1:].count(True) == 0 # every well next to the previous one
+
+@pytest.mark.parametrize('seed',range(3))
+def test_subsets_not_worse_than_serpentine(seed):
+	rng = np.random.RandomState(seed)
+	wells = _grid(8,12,9.0)
+	wells = wells[rng.choice(len(wells),40,replace=False)]
+	route = plan_route(wells,start=(-20.,10.))
+	assert route.travel_time <= _serpentine_time(wells,start=(-20.,10.)) + 1e-9
+	assert route.travel_time <= route.naive_time + 1e-9
+
+def test_serpentine_order():
+	wells = _grid(2,3,1.0)[::-1]
+	assert wells[serpentine_order(wells)].tolist() == [[0,0],[1,0],[2,0],[2,-1],[1,-1],[0,-1]]
+	assert wells[serpentine_order(wells,reverse_rows=True,reverse_first=True)].tolist() == [[2,-1],[1,-1],[0,-1],[0,0],[1,0],[2,0]]
+
+def test_run_route_dispense_rates(make_g):
+	wells = _grid(1,3,9.0)
+	route = plan_route(wells,optimize=False)
+	g = make_g(diagnostics='off')
+	run_route(g,route,[{'volume':5},{'volume':5,'rate':10},{'volume':5,'rate':200,'rate_unit':'uL/min'}])
+	feeds = []
+	for unit,rate in (('mL/min',DISPENSE_RATE),('mL/min',10),('uL/min',200)):
+		r = make_g(diagnostics='off')
+		r.set_feedrate(rate,extrusionunit=unit)
+		feeds.append(r.output.buffer[-1])
+	lines = g.output.buffer
+	dispenses = [k for k,line in enumerate(lines) if line.startswith('G1 E')]
+	assert [lines[k-1] for k in dispenses] == feeds
@@ -0,0 +1,74 @@
+import asyncio
+import pytest
+from fake_printer import FakePrinter
+from serial_host import SerialHost,_resend_number,checksum,clean_command,number_line,open_serial,stream_program
+
+"""
+SerialHost against the simulated printer: every command arrives once and in
+order whatever the window, corrupted lines are resent, and replies that take
+longer to arrive are overlapped by a window larger than 1.
+"""
+
+def _commands(g):
+	for i in range(40):
+		g.move(x=1 if i % 2 == 0 else -1,e=0.1)
+
+def _send(window,lines=None,build=_commands,**printer_options):
+	async def run():
+		async with FakePrinter(**printer_options) as printer:
+			connection = await open_serial(printer.port)
+			host = SerialHost(connection,window=window,timeout=5.0)
+			try:
+				if lines is None:
+					stats = await stream_program(host,build,diagnostics='off')
+				else:
+					stats = await host.send(lines)
+			finally:
+				connection.close()
+			return stats,printer
+	return asyncio.run(run())
+
+def _expected(make_g):
+	g = make_g(_commands,diagnostics='off')
+	return [clean_command(line) for line in g.output.buffer if clean_command(line)]
+
+def test_line_format():
+	line = number_line(12,'G1 X1')
+	text,_,check = line.rpartition('*')
+	assert text == 'N12 G1 X1'
+	assert int(check) == checksum(text)
+	assert [_resend_number(reply) for reply in ('Resend: 12','Resend:7','rs N3','ok')] == [12,7,3,None]
+
+@pytest.mark.parametrize('window',[1,4])
+def test_every_command_in_order(make_g,window):
+	stats,printer = _send(window,buffer_size=4)
+	expected = _expected(make_g)
+	assert printer.received == expected
+	assert stats['resends'] == 0
+	assert stats['lines'] == len(expected) + 1 # and M110
+	assert stats['acknowledged'] == stats['lines']
+
+@pytest.mark.parametrize('window',[1,2,4])
+def test_resend_on_checksum_error(make_g,window):
+	stats,printer = _send(window,corrupt_lines=(5,20,30))
+	assert printer.received == _expected(make_g)
+	# the lines in flight behind a corrupted one are rejected too, one resend each time
+	assert printer.errors >= 3
+	assert stats['resends'] == 3
+	assert stats['lines'] >= len(printer.received) + 1 + 3
+
+def test_window_overlaps_latency(make_g):
+	lines = ['G1 X{}'.format(i % 2) for i in range(30)]
+	one,printer = _send(1,lines,latency=0.01)
+	assert printer.received == lines
+	several,printer = _send(4,lines,latency=0.01,buffer_size=4)
+	assert printer.received == lines
+	for stats in (one,several):
+		assert stats['mean_latency'] >= 0.01
+		assert stats['max_latency'] >= stats['mean_latency']
+	# ping-pong waits a full round trip per line, a window of 4 overlaps them
+	assert several['elapsed'] < 0.6*one['elapsed']
+
+def test_bad_window():
+	with pytest.raises(RuntimeError):
+		SerialHost(None,window=0)
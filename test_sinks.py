@@ -0,0 +1,52 @@
+# -*- coding: utf-8 -*-
+import io
+import os
+import subprocess
+import sys
+import pytest
+from sinks import FileSink,GzipSink,MemorySink,NullSink,StdoutSink
+
+"""
+Every sink counts the lines and the UTF-8 bytes it was given, and buffered
+sinks deliver everything once flushed.
+"""
+
+LINES = [u'G91',u'G1 X1.0000 E0.5000',u';Extr. volume 2.0000 µL',u'']
+
+@pytest.mark.parametrize('sink',[MemorySink,NullSink])
+def test_counts(sink):
+	a = sink()
+	b = sink()
+	for line in LINES:
+		a.write(line)
+	b.write_lines(LINES)
+	size = len(u'\n'.join(LINES).encode('utf-8')) + 1
+	assert (a.lines,a.bytes) == (b.lines,b.bytes) == (len(LINES),size)
+
+@pytest.mark.parametrize('sink,name',[(FileSink,'out.gcode'),(GzipSink,'out.gcode.gz')])
+def test_file_bytes(tmp_path,sink,name):
+	path = str(tmp_path/name)
+	with sink(path,flush_size=2) as out:
+		out.write_lines(LINES[:2])
+		for line in LINES[2:]:
+			out.write(line)
+	if sink is FileSink:
+		assert os.path.getsize(path) == out.bytes
+	else:
+		import gzip
+		with gzip.open(path,'rb') as f:
+			assert len(f.read()) == out.bytes
+
+def test_stdout_is_buffered(monkeypatch):
+	stream = io.StringIO()
+	monkeypatch.setattr(sys,'stdout',stream)
+	out = StdoutSink(flush_size=3)
+	out.write_lines(LINES[:2])
+	assert stream.getvalue() == u''
+	out.write(LINES[2])
+	assert stream.getvalue() == u'\n'.join(LINES[:3]) + u'\n'
+
+def test_stdout_flushed_at_exit():
+	script = 'from main import G\ng = G()\ng.move(x=1)\n'
+	output = subprocess.check_output([sys.executable,'-c',script],cwd=os.path.dirname(os.path.abspath(__file__)))
+	assert output.decode('utf-8').splitlines()[-1] == 'G1 X1.0000'
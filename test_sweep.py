@@ -0,0 +1,39 @@
+import os
+from sweep import G_PARAMETERS,parameter_grid,run_sweep
+
+"""
+Sweeps give every G constructor argument to G, and the same files and table
+whatever the number of workers.
+"""
+
+def dispense(g,rate,volume=25):
+	g.set_feedrate(rate,extrusionunit='mL/min')
+	g.move(e=volume,extrusionunit='uL')
+	g.move(x=9.0)
+	g.move(e=volume,extrusionunit='uL')
+
+def test_g_parameters():
+	for name in ('microstepping','syringe','record','history','printer','tools'):
+		assert name in G_PARAMETERS
+	assert 'output' not in G_PARAMETERS and 'self' not in G_PARAMETERS
+
+def _files(rows):
+	contents = []
+	for row in rows:
+		with open(row['file']) as f:
+			contents.append((os.path.basename(row['file']),f.read()))
+	return contents
+
+def test_deterministic_across_workers(tmp_path):
+	grid = parameter_grid(rate=[1,5],syringe=['BD-1ml','BD-3ml'],record=[False,True])
+	one = run_sweep(dispense,grid,str(tmp_path/'one'),workers=1)
+	two = run_sweep(dispense,grid,str(tmp_path/'two'),workers=2)
+	assert _files(one) == _files(two)
+	for a,b in zip(one,two):
+		assert dict(a,file=None) == dict(b,file=None)
+	for row in one:
+		# recorded programs are emitted: same totals as written ones
+		twin = [r for r in one if r['rate'] == row['rate'] and r['syringe'] == row['syringe']]
+		assert len(set(r['extrusion_volume'] for r in twin)) == 1
+		assert 'G1 E' in open(row['file']).read()
+	assert os.path.exists(str(tmp_path/'one'/'summary.csv'))
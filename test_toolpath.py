@@ -0,0 +1,105 @@
+import pytest
+import toolpath
+from analyzer import GcodeAnalyzer
+
+"""
+The optimization passes must not change what the printer does: the optimized
+program, read back by the analyzer, ends at the same position with the same
+totals as the program G writes directly.
+"""
+
+def _analyze(lines):
+	a = GcodeAnalyzer(initial_feedrate=100.0,relative=True)
+	a.feed(lines)
+	return a
+
+def _direct(make_g,program,**options):
+	g = make_g(program,include_header=False,diagnostics='off',**options)
+	return g,_analyze(g.output.buffer)
+
+def _recorded(make_g,program,passes=None):
+	g = make_g(program,include_header=False,diagnostics='off',record=True)
+	tp = g.emit(passes)
+	return g,tp,_analyze(g.output.buffer)
+
+def _assert_same_motion(a,b):
+	assert b.position == a.position
+	for name in ('travel_distance','extrusion_distance','extrusion_volume','print_time'):
+		assert getattr(b,name) == pytest.approx(getattr(a,name),rel=1e-9), name
+
+@pytest.mark.parametrize('passes',[(),toolpath.DEFAULT_PASSES]+[(p,) for p in toolpath.DEFAULT_PASSES])
+def test_passes_preserve_motion(make_g,program,passes):
+	g,direct = _direct(make_g,program)
+	r,tp,recorded = _recorded(make_g,program,passes)
+	_assert_same_motion(direct,recorded)
+	assert r._current_position == g._current_position
+
+def test_unoptimized_recording_matches_direct_output(make_g,program):
+	# recorded moves are rendered from their step counts, like step_coordinates
+	# does for G1 (G2/G3 are written with the values passed in)
+	g,direct = _direct(make_g,program,step_coordinates=True)
+	r,tp,recorded = _recorded(make_g,program,())
+	assert len(r.output.buffer) == len(g.output.buffer)
+	for a,b in zip(r.output.buffer,g.output.buffer):
+		if a[:3] in ('G2 ','G3 '):
+			assert a[:3] == b[:3]
+		else:
+			assert a == b
+
+def test_optimization_removes_lines(make_g,program):
+	g,tp,recorded = _recorded(make_g,program,())
+	r,optimized,after = _recorded(make_g,program)
+	assert len(optimized) < len(tp)
+	lines = [line for line in r.output.buffer if line[:1] == 'G']
+	for a,b in zip(lines,lines[1:]):
+		assert not (a in ('G90','G91') and b in ('G90','G91'))
+		assert not (a.startswith('G1 F') and b.startswith('G1 F'))
+
+@pytest.mark.parametrize('p',toolpath.DEFAULT_PASSES)
+def test_passes_do_not_mutate_their_input(make_g,program,p):
+	tp = make_g(program,include_header=False,diagnostics='off',record=True)._toolpath
+	before = list(tp.lines())
+	p(tp)
+	assert list(tp.lines()) == before
+
+def _sub_step_program(g):
+	g.move(x=1,e=0.5)
+	for k in range(20):
+		g.move(x=0.001,e=0.0001) # below one step on X and E
+		g.move(x=0.001,e=0.001) # E only: a dispense in place
+	g.move(e=0.002)
+	g.move(e=0.002)
+	g.move(x=1,e=0.5)
+	g.move(x=1,e=0.5)
+
+def _e_steps(tp):
+	return sum(tp.delta['E'])
+
+@pytest.mark.parametrize('p',toolpath.DEFAULT_PASSES)
+def test_passes_keep_e_steps(make_g,program,p):
+	for steps in (program,_sub_step_program):
+		tp = make_g(steps,include_header=False,diagnostics='off',record=True)._toolpath
+		assert _e_steps(p(tp)) == _e_steps(tp)
+
+def test_sub_step_moves(make_g):
+	g,direct = _direct(make_g,_sub_step_program,step_coordinates=True)
+	r,tp,recorded = _recorded(make_g,_sub_step_program)
+	_assert_same_motion(direct,recorded)
+	assert recorded.extrusion_volume > 0.0
+	# the dispenses in place merge into one, the two last moves into one
+	assert len([line for line in r.output.buffer if line.startswith('G1')]) < len([line for line in g.output.buffer if line.startswith('G1')])
+
+def test_take(make_g,program):
+	tp = make_g(program,include_header=False,record=True)._toolpath
+	rows = [k for k in range(len(tp)) if k % 3 != 1]
+	out = tp.take(rows,{rows[2]:dict((axes,7) for axes in toolpath.AXES)},{rows[2]:15})
+	assert len(out) == len(rows)
+	for n,k in enumerate(rows):
+		assert out.op[n] == tp.op[k]
+		assert out.feed[n] == tp.feed[k]
+		assert out.mask[n] == (15 if n == 2 else tp.mask[k])
+		assert out.delta['X'][n] == (7 if n == 2 else tp.delta['X'][k])
+		assert (out.aux[n] < 0) == (tp.aux[k] < 0)
+		if tp.aux[k] >= 0:
+			assert out.extra[out.aux[n]] == tp.extra[tp.aux[k]]
+	assert len(tp.take([])) == 0
@@ -0,0 +1,59 @@
+import numpy as np
+import pytest
+from tools import make_tools
+from plate_routing import plan_schedule
+
+"""
+Every tool accounts for the volume its own syringe delivered across T changes,
+a tool resumes its retraction where it left it, and the scheduler selects every
+tool once.
+"""
+
+TOOLS = [('BD-1ml','JG24-1.25TTX'),('BD-3ml','JG22-1.25TTX')]
+
+def _changes(g):
+	g.move(e=2)
+	g.move(e=-1) # tool 0 retracted by 1 mm
+	g.select_tool(1)
+	g.move(x=1,e=1)
+	g.select_tool(0)
+	g.move(e=0.5) # pushes half of the retraction back: nothing extruded
+	g.move_many(x=[1.0,1.0],e=[0.5,1.0])
+
+def test_volumes_across_tool_changes(make_g):
+	g = make_g(_changes,tools=TOOLS)
+	cross_sections = [tool.syringe_cross_section for tool in g.tools]
+	volumes = g.tool_volumes()
+	assert volumes[0] == pytest.approx(3.0*cross_sections[0])
+	assert volumes[1] == pytest.approx(1.0*cross_sections[1])
+	assert sum(volumes) == pytest.approx(g.extrusion_volume)
+	assert [line for line in g.output.buffer if line.startswith('T')] == ['T1','T0']
+	# reading the volumes twice does not count them twice
+	assert g.tool_volumes() == volumes
+
+def test_tool_change_time(make_g):
+	one = make_g(lambda g: g.move(x=1),tools=TOOLS)
+	two = make_g(lambda g: g.select_tool(1),lambda g: g.select_tool(1),lambda g: g.move(x=1),tools=TOOLS)
+	assert two.print_time == pytest.approx(one.print_time + two.tool_change_time)
+	with pytest.raises(RuntimeError):
+		two.select_tool(2)
+
+def test_make_tools():
+	tools = make_tools(tools=[{'tip':'JG22-1.25TTX'},('BD-3ml','JG24-1.25TTX')])
+	assert [(t.index,t.syringe,t.tip) for t in tools] == [(0,'BD-1ml','JG22-1.25TTX'),(1,'BD-3ml','JG24-1.25TTX')]
+	assert len(make_tools(3)) == 3
+	with pytest.raises(RuntimeError):
+		make_tools(3,tools=TOOLS)
+	with pytest.raises(RuntimeError):
+		make_tools(tools=[])
+
+def test_schedule_selects_every_tool_once():
+	wells = [(-9.0*(k%6),-9.0*(k//6)) for k in range(24)]
+	tools = [k % 3 for k in range(24)]
+	schedule = plan_schedule(wells,tools,current_tool=1)
+	assert sorted(schedule.order) == list(range(24))
+	sequence = [tools[k] for k in schedule.order]
+	assert sequence[0] == 1
+	assert schedule.tool_changes == 2 < schedule.naive_tool_changes
+	assert [t for k,t in enumerate(sequence) if k == 0 or t != sequence[k-1]] == sorted(set(tools),key=sequence.index)
+	assert schedule.time < schedule.naive_time
@@ -0,0 +1,65 @@
+import pytest
+from sinks import FileSink
+from validation import check,find_violation,move_line
+
+"""
+Validation reports the first point that leaves the limits or enters a keep-out
+box, with the line of the program that moves there.
+"""
+
+def _program(g):
+	g.move(x=5,e=1)
+	g.set_feedrate(1,'mL/min')
+	g.move(y=4,e=1) # enters the box (4,6) x (2,3) at y=2
+	g.move(x=5,e=1) # leaves X <= 8 at x=8
+	g.move(z=-3)
+
+BOX = ((4.0,6.0),(2.0,3.0),(-1.0,1.0))
+
+def _line(g,number):
+	# line number of the number-th G1 with an axis word
+	moves = [k+1 for k,line in enumerate(g.output.buffer) if line.startswith('G1') and not line.startswith('G1 F')]
+	return moves[number-1]
+
+def test_first_violation(make_g):
+	g = make_g(_program)
+	violation = g.validate({'X':(-1,8)})
+	assert (violation.move,violation.rule) == (3,'X > 8')
+	assert violation.point == pytest.approx((8.0,4.0,0.0))
+	assert violation.line == _line(g,3)
+	assert g.output.buffer[violation.line-1].startswith('G1 X5')
+	assert violation.message().startswith('line {}: X > 8 at X8.0000 Y4.0000'.format(violation.line))
+	# the box is entered before the limit is crossed
+	violation = g.validate({'X':(-1,8)},[BOX])
+	assert (violation.move,violation.rule,violation.line) == (2,'keep-out box 0',_line(g,2))
+	assert violation.point == pytest.approx((5.0,2.0,0.0))
+	# in machine coordinates
+	assert g.validate({'X':(-6,8)},origin=(-5.0,0.0,0.0)) is None
+	assert g.validate({'Z':(-2.5,0)}).point == pytest.approx((10.0,4.0,-2.5))
+
+def test_file_source(make_g,tmp_path):
+	path = str(tmp_path/'out.gcode')
+	with FileSink(path) as sink:
+		g = make_g(_program,output=sink)
+		violation = g.validate({'Y':(0,1)})
+	assert violation.move == 2
+	with open(path) as f:
+		lines = f.read().splitlines()
+	assert violation.line == move_line(lines,2) == move_line(path,2)
+	assert lines[violation.line-1].startswith('G1 Y4')
+
+def test_start_out_of_bounds_and_check(make_g):
+	g = make_g(_program)
+	violation = find_violation(g,{'X':(1,8)})
+	assert (violation.move,violation.line) == (0,None)
+	with pytest.raises(RuntimeError) as error:
+		check(g,{'Z':(-1,1)})
+	assert 'Z < -1' in str(error.value)
+	with pytest.raises(RuntimeError):
+		make_g(_program,history='off').validate({'X':(0,1)})
+
+def test_ring_history_numbers(make_g):
+	g = make_g(lambda g: [g.move(x=1) for k in range(20)],history='ring',history_size=5)
+	violation = g.validate({'X':(-1,17.5)})
+	assert violation.move == 18
+	assert violation.line == _line(g,18)
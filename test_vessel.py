@@ -0,0 +1,63 @@
+import math
+import numpy as np
+import pytest
+from vessel_math import Vessel
+from sinks import MemorySink
+
+"""
+Vessels deposit their volume along a closed path in both modes, streaming the
+turns in chunks does not change the program, and reports go through G or a
+sink, never straight to stdout.
+"""
+
+def _vessel(mode,chunk_turns=50):
+	def step(g):
+		g.print_vessel(2.0,500,0.25,mode=mode,chunk_turns=chunk_turns)
+	return step
+
+@pytest.mark.parametrize('mode',['helix','rings'])
+def test_modes(make_g,mode):
+	g = make_g(_vessel(mode),diagnostics='off')
+	vessel = Vessel(2.0,500,g=g,verbose=False)
+	step = g.steps_to_mm['E']*g.syringe_cross_section # uL per E step
+	assert g.extrusion_volume == pytest.approx(vessel.volume,abs=step*len(vessel.shell_radii())*vessel.turn_count(0.25))
+	# the tip ends one layer height per turn up (negative Z), above its start
+	z = g.steps_to_mm['Z']*g._current_position['Z']
+	radii = vessel.shell_radii()
+	x = g.steps_to_mm['X']*g._current_position['X']
+	if mode == 'helix' and len(radii) % 2 == 0:
+		assert z == pytest.approx(0.0,abs=1e-2)
+	else:
+		assert z == pytest.approx(-(2.0-0.25),abs=1e-2)
+	assert x == pytest.approx(-(radii[-1]-vessel.ID/2.),abs=1e-2)
+
+@pytest.mark.parametrize('mode',['helix','rings'])
+def test_chunks(make_g,mode):
+	whole = make_g(_vessel(mode,chunk_turns=1000))
+	for chunk_turns in (1,3):
+		assert make_g(_vessel(mode,chunk_turns=chunk_turns)).output.buffer == whole.output.buffer
+
+def test_toolpath_chunks():
+	vessel = Vessel(2.0,500,verbose=False)
+	blocks = [block for block in vessel.toolpath(0.25,'helix',chunk_turns=3) if block[0] == 'print']
+	turns = vessel.turn_count(0.25)
+	assert len(blocks) == len(vessel.shell_radii())*int(math.ceil(turns/3.))
+	total = sum(float(np.sum(block[4])) for block in blocks)
+	assert total == pytest.approx(vessel.path_length(0.25,'helix'))
+	with pytest.raises(RuntimeError):
+		next(vessel.toolpath(0.25,'spiral'))
+
+def test_reports(make_g,capsys):
+	sink = MemorySink()
+	vessel = Vessel(2.0,500,output_digits=4,output=sink)
+	assert sink.buffer[0] == 'Printer settings:'
+	assert sink.buffer[-1] == vessel.volume_lines()[0]
+	g = make_g()
+	written = len(g.output.buffer)
+	Vessel(2.0,500,g=g)
+	assert g.output.buffer[written:] == [';'+line for line in sink.buffer]
+	quiet = make_g(diagnostics='off')
+	written = len(quiet.output.buffer)
+	Vessel(2.0,500,g=quiet)
+	assert len(quiet.output.buffer) == written
+	assert capsys.readouterr().out == ''
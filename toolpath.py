@@ -0,0 +1,340 @@
+from array import array
+from config import *
+from history import _int64_array,_extend
+import gcode_format
+
+"""
+Toolpath intermediate representation (IR) for the G object.
+
+While G is recording, commands are captured here instead of being written as
+text. Each row holds an op code, the axis deltas in motor steps, the feedrate
+that was active, the arc offsets (I/J) and an index into a side table of text
+(comments, raw lines) or parameters. The rows are stored column-wise in typed
+arrays. Before emission the toolpath is run through a pass pipeline, then
+rendered to text in one go (moves are rendered from their step counts).
+"""
+
+# ---------- Op codes ---------- #
+OP_RAW = 0 		# verbatim line (comments, headers, M-codes, blank lines)
+OP_MOVE = 1 	# G1 with axis deltas
+OP_ARC_CW = 2 	# G2
+OP_ARC_CCW = 3 	# G3
+OP_FEED = 4 	# G1 F
+OP_RELATIVE = 5 	# G91
+OP_ABSOLUTE = 6 	# G90
+OP_STEPS = 7 	# M92
+
+MOTION_OPS = (OP_MOVE,OP_ARC_CW,OP_ARC_CCW)
+AXIS_BITS = dict((axes,1 << i) for i,axes in enumerate(AXES))
+
+class Toolpath(object):
+	def __init__(self,position,steps_per_mm,is_relative=True,speed=None,tool=0):
+		"""
+		Parameters
+		-----------
+		position : dict
+			Position (in steps) when recording started
+		steps_per_mm : dict
+			Axis steps/mm when recording started
+		is_relative : bool (default: True)
+			Positioning mode when recording started (None if not yet sent to the printer)
+		speed : float (default: None)
+			Feedrate (mm/min) active on the printer when recording started (None if unknown)
+		tool : int (default: 0)
+			Tool (T index) active when recording started
+		"""
+		self.start_position = dict(position)
+		self.start_steps_per_mm = dict(steps_per_mm)
+		self.start_relative = is_relative
+		self.start_speed = speed
+		self.start_tool = tool
+		self.op = array('b')
+		self.mask = array('b') # bit per axis that was specified
+		self.delta = dict((axes,_int64_array()) for axes in AXES)
+		self.feed = array('d')
+		self.i = array('d')
+		self.j = array('d')
+		self.aux = array('l') # index into self.extra, -1 if unused
+		self.extra = []
+
+	def __len__(self):
+		return len(self.op)
+
+	def _append(self,op,feed,mask=0,deltas=None,i=0.0,j=0.0,extra=None):
+		self.op.append(op)
+		self.mask.append(mask)
+		for axes in AXES:
+			self.delta[axes].append(deltas.get(axes,0) if deltas else 0)
+		self.feed.append(feed)
+		self.i.append(i)
+		self.j.append(j)
+		if extra is None:
+			self.aux.append(-1)
+		else:
+			self.aux.append(len(self.extra))
+			self.extra.append(extra)
+
+	# ---------- Recording ---------- #
+	def raw(self,line,feed=0.0):
+		self._append(OP_RAW,feed,extra=line)
+
+	def move(self,diffs,feed):
+		mask = 0
+		for axes in diffs:
+			mask |= AXIS_BITS[axes]
+		self._append(OP_MOVE,feed,mask,diffs)
+
+	def arc(self,clockwise,diffs,feed,i=0.0,j=0.0):
+		mask = 0
+		for axes in diffs:
+			mask |= AXIS_BITS[axes]
+		self._append(OP_ARC_CW if clockwise else OP_ARC_CCW,feed,mask,diffs,i,j)
+
+	def move_many(self,letters,columns,feed,comments=None):
+		""" Record a batch of G1 moves at once (requires NumPy)
+		Parameters
+		-----------
+		letters : tuple
+			Moved axes
+		columns : list of arrays
+			Step deltas of every move, one column per letter
+		feed : float
+			Feedrate of the batch (mm/min)
+		comments : tuple (default: None)
+			(positions, lines): raw lines recorded among the moves, positions
+			being their rows counted from the start of the batch
+		"""
+		import numpy as np
+		positions,lines = comments if comments is not None else ((),[])
+		total = len(columns[0]) + len(lines)
+		op = np.full(total,OP_MOVE,dtype=np.int8)
+		op[np.asarray(positions,dtype=np.int64)] = OP_RAW
+		moves = op == OP_MOVE
+		mask = 0
+		for axes in letters:
+			mask |= AXIS_BITS[axes]
+		_extend(self.op,op)
+		_extend(self.mask,np.where(moves,mask,0))
+		for axes in AXES:
+			column = np.zeros(total,dtype=np.int64)
+			if axes in letters:
+				column[moves] = columns[letters.index(axes)]
+			_extend(self.delta[axes],column)
+		_extend(self.feed,np.full(total,float(feed)))
+		_extend(self.i,np.zeros(total))
+		_extend(self.j,np.zeros(total))
+		aux = np.full(total,-1,dtype=np.int64)
+		aux[np.asarray(positions,dtype=np.int64)] = len(self.extra) + np.arange(len(lines))
+		_extend(self.aux,aux)
+		self.extra.extend(lines)
+
+	def set_feed(self,feed):
+		self._append(OP_FEED,feed)
+
+	def set_relative(self,relative,feed=0.0):
+		self._append(OP_RELATIVE if relative else OP_ABSOLUTE,feed)
+
+	def set_steps_per_mm(self,values,comment=None,feed=0.0):
+		""" values is a dict of axis -> steps/mm for the axes being changed """
+		self._append(OP_STEPS,feed,extra=(dict(values),comment))
+
+	def mark(self):
+		""" The current end of the toolpath, to copy up to it later (see copy)
+
+		Recording only ever appends rows, so the rows before a mark do not change.
+		"""
+		return (len(self.op),len(self.extra))
+
+	def copy(self,mark=None):
+		""" An independent copy (the columns are copied as typed arrays), of the rows before mark if given """
+		rows,extras = self.mark() if mark is None else mark
+		out = Toolpath(self.start_position,self.start_steps_per_mm,self.start_relative,self.start_speed,self.start_tool)
+		out.op = self.op[:rows]
+		out.mask = self.mask[:rows]
+		out.delta = dict((axes,column[:rows]) for axes,column in self.delta.items())
+		out.feed = self.feed[:rows]
+		out.i = self.i[:rows]
+		out.j = self.j[:rows]
+		out.aux = self.aux[:rows]
+		out.extra = self.extra[:extras]
+		return out
+
+	# ---------- Transformation ---------- #
+	def take(self,rows,deltas=None,masks=None):
+		""" Return a new toolpath made of the given rows (optionally with new deltas/masks) """
+		import numpy as np
+		out = Toolpath(self.start_position,self.start_steps_per_mm,self.start_relative,self.start_speed,self.start_tool)
+		rows = np.asarray(rows,dtype=np.int64)
+		if len(rows) == 0:
+			return out
+		def pick(column):
+			return np.frombuffer(column,dtype=np.dtype(column.typecode))[rows]
+		where = np.empty(len(self),dtype=np.int64) # row of the output of every input row taken
+		where[rows] = np.arange(len(rows))
+		mask = pick(self.mask)
+		if masks:
+			keys = np.array(list(masks),dtype=np.int64)
+			mask[where[keys]] = [masks[k] for k in keys.tolist()]
+		_extend(out.mask,mask)
+		for axes in AXES:
+			column = pick(self.delta[axes])
+			if deltas:
+				keys = np.array(list(deltas),dtype=np.int64)
+				column[where[keys]] = [deltas[k][axes] for k in keys.tolist()]
+			_extend(out.delta[axes],column)
+		for name in ('op','feed','i','j'):
+			_extend(getattr(out,name),pick(getattr(self,name)))
+		aux = pick(self.aux)
+		used = aux >= 0
+		out.extra = [self.extra[k] for k in aux[used].tolist()]
+		aux[used] = np.arange(len(out.extra))
+		_extend(out.aux,aux)
+		return out
+
+	def optimize(self,passes=None):
+		""" Run the pass pipeline and return the optimized toolpath """
+		if passes is None:
+			passes = DEFAULT_PASSES
+		toolpath = self
+		for p in passes:
+			toolpath = p(toolpath)
+		return toolpath
+
+	# ---------- Emission ---------- #
+	def lines(self,digits=4,minimal=False):
+		""" Yield the G-code lines of the toolpath """
+		position = dict(self.start_position)
+		steps_per_mm = dict(self.start_steps_per_mm)
+		relative = self.start_relative is not False
+		delta = self.delta
+		for k in range(len(self.op)):
+			op = self.op[k]
+			if op == OP_RAW:
+				yield self.extra[self.aux[k]]
+			elif op == OP_MOVE:
+				letters = tuple(axes for axes in AXES if self.mask[k] & AXIS_BITS[axes])
+				for axes in letters:
+					position[axes] += delta[axes][k]
+				steps = [delta[axes][k] if relative else position[axes] for axes in letters]
+				yield 'G1 ' + gcode_format.format_step_args(letters,steps,[steps_per_mm[axes] for axes in letters],digits,minimal)
+			elif op == OP_ARC_CW or op == OP_ARC_CCW:
+				letters = tuple(axes for axes in AXES if self.mask[k] & AXIS_BITS[axes])
+				for axes in letters:
+					position[axes] += delta[axes][k]
+				steps = [delta[axes][k] if relative else position[axes] for axes in letters]
+				args = [gcode_format.format_step_args(letters,steps,[steps_per_mm[axes] for axes in letters],digits,minimal)] if letters else []
+				if self.i[k] != 0.0:
+					args.append('I'+gcode_format.format_number(self.i[k],digits,minimal))
+				if self.j[k] != 0.0:
+					args.append('J'+gcode_format.format_number(self.j[k],digits,minimal))
+				yield ('G2 ' if op == OP_ARC_CW else 'G3 ') + ' '.join(args)
+			elif op == OP_FEED:
+				yield 'G1 ' + gcode_format.format_args(('F',),(self.feed[k],),digits,minimal)
+			elif op == OP_RELATIVE:
+				relative = True
+				yield 'G91'
+			elif op == OP_ABSOLUTE:
+				relative = False
+				yield 'G90'
+			elif op == OP_STEPS:
+				values,comment = self.extra[self.aux[k]]
+				letters = tuple(axes for axes in AXES if axes in values)
+				steps_per_mm.update(values)
+				line = 'M92 ' + gcode_format.format_args(letters,tuple(values[axes] for axes in letters),digits,minimal)
+				if comment is not None:
+					line += ' ;' + comment
+				yield line
+
+# ========== Optimization passes ========== #
+def drop_redundant_feedrates(toolpath):
+	""" Remove G1 F lines that do not change the active feedrate """
+	keep = []
+	active = toolpath.start_speed
+	pending = None # last feed change not yet followed by motion
+	for k in range(len(toolpath)):
+		op = toolpath.op[k]
+		if op == OP_FEED:
+			# a later feed change before any motion overrides this one
+			pending = k
+			continue
+		if op in MOTION_OPS and pending is not None:
+			if toolpath.feed[pending] != active:
+				keep.append(pending)
+				active = toolpath.feed[pending]
+			pending = None
+		keep.append(k)
+	if pending is not None and toolpath.feed[pending] != active:
+		keep.append(pending)
+	keep.sort()
+	return toolpath.take(keep)
+
+def elide_mode_toggles(toolpath):
+	""" Remove G90/G91 lines that are overridden before any motion or change nothing """
+	keep = []
+	state = toolpath.start_relative
+	pending = None
+	for k in range(len(toolpath)):
+		op = toolpath.op[k]
+		if op == OP_RELATIVE or op == OP_ABSOLUTE:
+			pending = k
+			continue
+		if op in MOTION_OPS and pending is not None:
+			relative = toolpath.op[pending] == OP_RELATIVE
+			if relative != state:
+				keep.append(pending)
+				state = relative
+			pending = None
+		keep.append(k)
+	if pending is not None and (toolpath.op[pending] == OP_RELATIVE) != state:
+		keep.append(pending)
+	keep.sort()
+	return toolpath.take(keep)
+
+def _collinear(a,b):
+	# same direction in step space (including E, so the extrusion ratio matches too)
+	dot = sum(x*y for x,y in zip(a,b))
+	if dot <= 0:
+		return False
+	n = len(a)
+	for p in range(n):
+		for q in range(p+1,n):
+			if a[p]*b[q] != a[q]*b[p]:
+				return False
+	return True
+
+def merge_collinear_moves(toolpath):
+	""" Merge consecutive G1 moves in the same direction at the same feedrate
+
+	Merged moves add up their steps, so the E steps of the toolpath (and the
+	volume) are kept exactly.
+	"""
+	keep = []
+	merged = {}
+	masks = {}
+	last = None # index of the previous kept move if it can still be extended
+	for k in range(len(toolpath)):
+		op = toolpath.op[k]
+		if op != OP_MOVE:
+			if op != OP_FEED:
+				last = None
+			keep.append(k)
+			continue
+		d = tuple(toolpath.delta[axes][k] for axes in AXES)
+		if not any(d):
+			# no axis moves by a whole step, E included: there is no travel or
+			# extrusion to fold into a neighbour, the row only restates the position
+			continue
+		# a sub-step travel with E (a dispense in place) is kept, and only merged
+		# with neighbouring moves that extrude in place at the same feedrate
+		if last is not None and toolpath.feed[last] == toolpath.feed[k]:
+			prev = merged.get(last)
+			prev = tuple(prev[axes] for axes in AXES) if prev else tuple(toolpath.delta[axes][last] for axes in AXES)
+			if _collinear(prev,d):
+				merged[last] = dict((axes,prev[n]+d[n]) for n,axes in enumerate(AXES))
+				masks[last] = masks.get(last,toolpath.mask[last]) | toolpath.mask[k]
+				continue
+		keep.append(k)
+		last = k
+	return toolpath.take(keep,merged,masks)
+
+DEFAULT_PASSES = (drop_redundant_feedrates,elide_mode_toggles,merge_collinear_moves)
@@ -0,0 +1,70 @@
+from config import *
+import hardware
+
+"""
+Extruders (tools) of a multi-syringe printer.
+
+Every tool carries its own syringe and tip, and its own extrusion accounting:
+the plunger of a syringe only moves while its tool is active, so the volume it
+delivered and how far it was retracted (max_e_position) are kept per tool. G
+selects a tool with a T command; E stays one logical axis, as in the firmware,
+and a tool picks up its retraction where it left it when it is selected again.
+"""
+
+class Tool(object):
+	"""Syringe and tip mounted on one extruder"""
+	def __init__(self,index,syringe="BD-1ml",tip=TIP):
+		"""
+		Parameters
+		-----------
+		index : int
+			Extruder number (T index)
+		syringe : str (default: "BD-1ml")
+			Syringe profile name (see hardware.py)
+		tip : str (default: TIP)
+			Tip profile name (see hardware.py)
+		"""
+		profile = hardware.tool_profile(syringe,tip) # shared, computed once per pair
+		self.index = index
+		self.profile = profile
+		self.syringe = syringe
+		self.syringe_diameter = profile.syringe_diameter # mm
+		self.syringe_cross_section = profile.syringe_cross_section # uL/mm
+		self.tip = tip
+		self.tip_ID = profile.tip_ID # mm
+		self.tip_cross_section = profile.tip_cross_section # mm^2
+		self.waste_volume = profile.waste_volume # mL
+		###===== Extrusion accounting (in steps, logical E coordinates) =====###
+		self.e_position = 0 # E position when the tool was last deselected
+		self.max_e_position = 0 # max_e_position when the tool was last deselected
+		self.extrusion_volume = 0 # uL delivered by this tool
+
+	def line(self,digits=4):
+		""" One-line description, used in the header """
+		return ';Tool {0}: {1} syringe ({2:.{digits}f} uL/mm) | {3} tip ({4} mm)'.format(self.index,self.syringe,self.syringe_cross_section,self.tip,self.tip_ID,digits=digits)
+
+def make_tools(num_extruder=1,syringe="BD-1ml",tip=TIP,tools=None):
+	""" Tools of a printer
+	Parameters
+	-----------
+	num_extruder : int (default: 1)
+		Number of extruders, all with the same syringe and tip when tools is None
+	syringe, tip : str
+		Default syringe and tip
+	tools : list (default: None)
+		Per-extruder (syringe, tip) pairs or dicts with 'syringe' and 'tip' keys
+		(missing keys take the defaults). Its length is the number of extruders.
+	"""
+	if tools is None:
+		return [Tool(k,syringe,tip) for k in range(num_extruder)]
+	if num_extruder != 1 and num_extruder != len(tools):
+		raise RuntimeError('num_extruder is {} but {} tools were given.'.format(num_extruder,len(tools)))
+	if not tools:
+		raise RuntimeError('At least one tool is needed.')
+	result = []
+	for k,spec in enumerate(tools):
+		if isinstance(spec,dict):
+			result.append(Tool(k,spec.get('syringe',syringe),spec.get('tip',tip)))
+		else:
+			result.append(Tool(k,*spec))
+	return result
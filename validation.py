@@ -0,0 +1,194 @@
+import numpy as np
+from config import *
+from deposition import path_segments
+
+"""
+Soft limits and keep-out zones for generated programs.
+
+The whole trajectory of a G (its step-domain position history, with circular
+moves split into the chords the firmware follows) is checked at once:
+- every point must stay within the per-axis limits (the build volume, and the
+  plate surface through the Z limit: positive Z is down on this machine)
+- no segment may enter a keep-out box (plate walls, clamps), tested exactly
+  with a vectorized slab intersection, not by sampling
+
+Limits and boxes are in machine coordinates; origin is the machine position of
+the head when G started (the history is relative to it). The first violation
+is reported with the number of the move and, when the program text is
+available, its line number.
+
+Example
+-------
+limits = {'X':(0,200),'Y':(0,200),'Z':(-50,12.5)} # Z 12.5 is the plate surface
+clamps = [((-5,0),(0,85),(-10,20))]
+violation = g.validate(limits,clamps,origin=(100,80,0))
+if violation is not None:
+	print(violation.message())
+"""
+
+class Violation(object):
+	"""First point of a trajectory that breaks a limit or enters a keep-out box"""
+	def __init__(self,move,point,rule,line=None):
+		self.move = move # move number (1 for the first move of the program)
+		self.point = point # (x, y, z) in machine coordinates (mm)
+		self.rule = rule # e.g. "Z > 12.5" or "keep-out box 0"
+		self.line = line # line number in the program text, if known
+
+	def message(self,digits=4):
+		point = ' '.join('{0}{1:.{digits}f}'.format(axes,value,digits=digits) for axes,value in zip(MOTION_AXES,self.point))
+		where = 'line {}'.format(self.line) if self.line is not None else 'move {}'.format(self.move)
+		return '{0}: {1} at {2}'.format(where,self.rule,point)
+
+	def __repr__(self):
+		return 'Violation({})'.format(self.message())
+
+def _limit_violations(start,end,limits):
+	# first segment leaving the bounds, per rule (-1 if the head starts out of bounds)
+	found = []
+	for k,axes in enumerate(MOTION_AXES):
+		if axes not in limits:
+			continue
+		low,high = limits[axes]
+		for outside,first,rule in ((end[:,k] < low,start[0,k] < low,'{0} < {1}'.format(axes,low)),
+				(end[:,k] > high,start[0,k] > high,'{0} > {1}'.format(axes,high))):
+			if first:
+				found.append((-1,0.0,rule))
+				continue
+			index = np.flatnonzero(outside)
+			if len(index):
+				# where the segment crosses the bound
+				i = int(index[0])
+				bound = low if end[i,k] < low else high
+				found.append((i,(bound-start[i,k])/(end[i,k]-start[i,k]),rule))
+	return found
+
+def _box_violations(start,end,boxes):
+	# first segment crossing the inside of each box (slab method, boundaries excluded)
+	found = []
+	if len(start) == 0:
+		return found
+	d = end - start
+	for b,box in enumerate(boxes):
+		low = np.array([float(box[k][0]) for k in range(3)])
+		high = np.array([float(box[k][1]) for k in range(3)])
+		with np.errstate(divide='ignore',invalid='ignore'):
+			t1 = (low-start)/d
+			t2 = (high-start)/d
+		# axes the segment does not move along: inside the slab for all t, or never
+		still = d == 0.0
+		inside = (start > low) & (start < high)
+		tmin = np.where(still,np.where(inside,-np.inf,np.inf),np.minimum(t1,t2)).max(axis=1)
+		tmax = np.where(still,np.where(inside,np.inf,-np.inf),np.maximum(t1,t2)).min(axis=1)
+		hit = (tmin < tmax) & (tmax > 0.0) & (tmin < 1.0)
+		index = np.flatnonzero(hit)
+		if len(index):
+			found.append((int(index[0]),max(float(tmin[index[0]]),0.0),'keep-out box {}'.format(b)))
+	return found
+
+def find_violation(g,limits=None,keepouts=(),origin=(0.0,0.0,0.0),segment_length=ARC_SEGMENT_LENGTH,source=None):
+	""" First point of the trajectory of g outside the limits or inside a keep-out box
+	Parameters
+	-----------
+	g : G
+		Generator with a 'full' (or 'ring', checking the recent moves) position history
+	limits : dict (default: None)
+		Axis -> (low, high) in mm, for any of X, Y and Z
+	keepouts : sequence (default: ())
+		Boxes ((xmin,xmax),(ymin,ymax),(zmin,zmax)) the tip must not enter (mm)
+	origin : tuple (default: (0,0,0))
+		Machine coordinates of the head when G started (mm)
+	segment_length : float (default: ARC_SEGMENT_LENGTH)
+		Length of the chords of circular moves (mm)
+	source : str, list or None (default: None)
+		Program text used to find the line number: a path or a list of lines. By
+		default the buffer of a MemorySink or the file of a FileSink.
+
+	Returns a Violation or None.
+	"""
+	limits = limits or {}
+	history = g.position_history
+	if len(history[AXES[0]]) == 0:
+		raise RuntimeError('The position history is off: nothing to validate.')
+	start,end,move = path_segments(history,g.steps_to_mm,segment_length)
+	if len(start) == 0:
+		# no moves: only the start position can be out of bounds
+		positions = np.array([[history[axes][0]*g.steps_to_mm[axes] for axes in MOTION_AXES]])
+		start = end = positions
+		move = np.zeros(1,dtype=np.int64)
+	offset = np.asarray(origin,dtype=float)
+	start = start + offset
+	end = end + offset
+	found = _limit_violations(start,end,limits) + _box_violations(start,end,keepouts)
+	if not found:
+		return None
+	segment,t,rule = min(found,key=lambda item: (item[0],item[1]))
+	if segment < 0:
+		return Violation(0,tuple(start[0].tolist()),rule,None)
+	point = start[segment] + t*(end[segment]-start[segment])
+	# moves recorded before the history window (ring mode) come first
+	number = int(move[segment]) + g._history.recorded - len(g._history)
+	line = move_line(_source(g) if source is None else source,number)
+	return Violation(number,tuple(point.tolist()),rule,line)
+
+def check(g,limits=None,keepouts=(),**kwargs):
+	""" Raise a RuntimeError describing the first violation, see find_violation """
+	violation = find_violation(g,limits,keepouts,**kwargs)
+	if violation is not None:
+		raise RuntimeError('Toolpath violation, {}'.format(violation.message(g.output_digits)))
+
+def _source(g):
+	buffer = getattr(g.output,'buffer',None)
+	if isinstance(buffer,list):
+		return buffer
+	name = getattr(getattr(g.output,'stream',None),'name',None)
+	if isinstance(name,str) and not name.startswith('<'):
+		g.flush()
+		return name
+	return None
+
+def _is_move(line):
+	# G0/G1 with an axis word, or any G2/G3 (a full circle only has I and J)
+	i = line.find(';')
+	if i >= 0:
+		line = line[:i]
+	words = line.split()
+	if words and words[0][0] == 'N':
+		words = words[1:]
+	if not words:
+		return False
+	cmd = words[0].upper()
+	if cmd == 'G2' or cmd == 'G3':
+		return True
+	if cmd == 'G1' or cmd == 'G0':
+		return any(word[0].upper() in AXES for word in words[1:])
+	return False
+
+def move_line(source,number):
+	""" Line number (1-based) of the number-th move of a program, None if unknown
+	Parameters
+	-----------
+	source : str, list or None
+		Path of the program (.gz is decompressed) or its lines
+	number : int
+		Move number (1 for the first move)
+	"""
+	if source is None or number < 1:
+		return None
+	if isinstance(source,str):
+		if source.endswith('.gz'):
+			import gzip
+			f = gzip.open(source,'rt')
+		else:
+			f = open(source)
+		with f:
+			return _count_moves(f,number)
+	return _count_moves(source,number)
+
+def _count_moves(lines,number):
+	count = 0
+	for k,line in enumerate(lines):
+		if _is_move(line):
+			count += 1
+			if count == number:
+				return k+1
+	return None
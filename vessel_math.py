@@ -1,19 +1,81 @@
+import numpy as np
 from config import *
+import hardware
+import arcs
+
+"""
+Vessels: hollow cylinders printed around a pipet used as a mandrel.
+
+The inner diameter of the vessel is the outer diameter of the pipet (PIPET_OD)
+and the wall is built from `shells` concentric layers of filament, each one
+tip inner diameter wide. Paths are generated as relative moves, with the tip
+starting against the left side of the pipet (its axis at +X) at the bottom end
+of the vessel, and negative Z going up, as in the rest of the project:
+- 'helix': every shell is one continuous helix climbing one layer height per
+  turn; shells alternate between climbing and descending so they follow each
+  other without travel moves
+- 'rings': layer after layer, concentric rings from the inner to the outer
+  shell, then one layer up and back to the inner shell
+"""
+
+VESSEL_MODES = ('helix','rings')
 
 class Vessel(object):
-	"""docstring for Vessel"""
-	def __init__(self, length,thickness,ID=PIPET_OD[PIPET],output_digits=3):
+	"""Geometry and volume of a vessel, with the syringe and tip it is printed with"""
+	def __init__(self,length,thickness,ID=None,output_digits=3,syringe="BD-1ml",tip=TIP,pipet=PIPET,g=None,verbose=True,output=None):
+		"""
+		Parameters
+		-----------
+		length : float
+			Vessel length (mm)
+		thickness : float
+			Wall thickness (um)
+		ID : float (default: None)
+			Inner diameter (mm), by default the outer diameter of the pipet
+		output_digits : int (default: 3)
+			Digits of the reports
+		syringe : str (default: "BD-1ml")
+			Syringe type, ignored when g is given
+		tip : str (default: TIP)
+			Tip type, ignored when g is given
+		pipet : str (default: PIPET)
+			Pipet profile name (see hardware.py)
+		g : G (default: None)
+			Generator whose syringe, tip, microstepping and output digits are used
+		verbose : bool (default: True)
+			Report the settings and volume: as comments through g (unless its
+			diagnostics are 'off') when g is given, else to output
+		output : Sink (default: None)
+			Sink of the reports without g, by default a StdoutSink
+		"""
 		super(Vessel, self).__init__()
+		if g is not None:
+			syringe = g.syringe
+			tip = g.tip
+			output_digits = g.output_digits
 		self.length = length # mm
 		self.thickness = thickness # um
-		self.ID = ID
+		self.pipet = pipet
+		self.ID = hardware.pipet(pipet).outer_diameter if ID is None else ID
 		self.output_digits = output_digits
+		self.g = g
+		self.output = output
+		self.microstepping = g.microstepping if g is not None else printer_profile().microstepping
+		self.steps_per_rev = g.steps_per_rev if g is not None else printer_profile().steps_per_revolution
+		self.syringe = syringe
+		self.tip = tip
+		self.tool = hardware.tool_profile(syringe,tip)
+		self.syringe_diameter = self.tool.syringe_diameter # mm
+		self.syringe_cross_section = self.tool.syringe_cross_section # uL/mm
+		self.tip_ID = self.tool.tip_ID # mm
+		self.tip_cross_section = self.tool.tip_cross_section # mm^2
 		# calculate vessel volume
 		self._calculate_vessel_volume()
-		# report necessary volume
-		self._report_current_settings()
-		# report vessel statistics
-		self._report_volume()
+		if verbose:
+			# report necessary volume
+			self._report_current_settings()
+			# report vessel statistics
+			self._report_volume()
 
 	def _calculate_vessel_volume(self):
 		""" From Mathematica - Volume of a hollow cylinder
@@ -22,37 +84,118 @@ class Vessel(object):
 		thickness = self.thickness/1000. # mm
 		self.volume = math.pi*self.length*thickness*(self.ID+thickness)
 
-	def _report_volume(self):
+	def volume_lines(self):
 		d = self.output_digits
-		msg = "Vessel volume: {:.{digits}f} uL".format(self.volume,digits=d)
-		print(msg)
+		return ["Vessel volume: {:.{digits}f} uL".format(self.volume,digits=d)]
 
-	def _report_current_settings(self):
+	def settings_lines(self):
 		d = self.output_digits
-		msg = """Printer settings:
-		Microstepping: {microstepping}X
-		Steps per revolution: {stepsperrev}
-		Syringe type: {syringe}
-		Syringe ID: {syringediameter} mm
-		Syringe cross-section: {syringecrosssection:.{digits}f} uL/mm
-		Syringe void volume: {syringevoidvolume} mL
-		Tip type: {tip}
-		Tip ID: {tipdiameter} mm
-		Tip cross-section: {tipcrosssection:.{digits}f} mm^2
-		Tip void volume: {tipvoidvolume} mL
-		Pipet type: {pipettype}
-		Pipet OD: {pipetdiameter} mm
-		""".format(digits=d,microstepping=MICROSTEPPING,stepsperrev=STEPS_PER_REVOLUTION,
-			syringe=SYRINGE,syringediameter=SYRINGE_CROSS_SECTIONAL_DIAMETER,
-			syringecrosssection=SYRINGE_CROSS_SECTIONAL_AREA,syringevoidvolume=SYRINGE_WASTE_SPACE[SYRINGE],
-			tip=TIP,tipdiameter=TIP_CROSS_SECTIONAL_DIAMETER,tipcrosssection=TIP_CROSS_SECTIONAL_AREA,
-			tipvoidvolume=TIP_VOID_VOLUME[TIP],pipettype=PIPET,pipetdiameter=PIPET_OD[PIPET])
-		print(msg)
+		return ["Printer settings:",
+			"Microstepping: {}X".format(self.microstepping),
+			"Steps per revolution: {}".format(self.steps_per_rev),
+			"Syringe type: {}".format(self.syringe),
+			"Syringe ID: {} mm".format(self.syringe_diameter),
+			"Syringe cross-section: {:.{digits}f} uL/mm".format(self.syringe_cross_section,digits=d),
+			"Syringe void volume: {} mL".format(self.tool.syringe.waste_volume),
+			"Tip type: {}".format(self.tip),
+			"Tip ID: {} mm".format(self.tip_ID),
+			"Tip cross-section: {:.{digits}f} mm^2".format(self.tip_cross_section,digits=d),
+			"Tip void volume: {} mL".format(self.tool.tip.void_volume),
+			"Pipet type: {}".format(self.pipet),
+			"Pipet OD: {} mm".format(self.ID)]
+
+	def _report(self,lines):
+		if self.g is not None:
+			from diagnostics import SUMMARY
+			if self.g._diagnostic_level >= SUMMARY:
+				for line in lines:
+					self.g.write(';'+line)
+			return
+		if self.output is None:
+			from sinks import StdoutSink
+			self.output = StdoutSink(flush_size=1)
+		self.output.write_lines(lines)
+
+	def _report_volume(self):
+		self._report(self.volume_lines())
+
+	def _report_current_settings(self):
+		lines = self.settings_lines()
+		self._report(lines[:1] + ['\t'+line for line in lines[1:]])
 
 	def _set_output_digits(self,digits):
 		self.output_digits = digits
 
+	# ---------- Toolpath ---------- #
+	def shell_count(self):
+		""" Number of filament shells (one tip ID wide) that make up the wall """
+		return max(1,int(math.ceil(self.thickness/1000./self.tip_ID - 1e-9)))
+
+	def shell_radii(self):
+		""" Radius (mm) of the centre line of every shell, inner first """
+		shells = self.shell_count()
+		thickness = self.thickness/1000.
+		return self.ID/2. + thickness*(np.arange(shells)+0.5)/shells
+
+	def turn_count(self,layer_height):
+		""" Number of turns (layers) along the length, at least one """
+		return max(1,int(round(self.length/layer_height)))
+
+	def path_length(self,layer_height,mode='helix',segment_length=ARC_SEGMENT_LENGTH):
+		""" Total extruding path length (mm), used to spread the volume """
+		turns = self.turn_count(layer_height)
+		pitch = self.length/turns
+		total = 0.0
+		for r in self.shell_radii().tolist():
+			n = int(arcs.segment_count(r,2*math.pi,segment_length))
+			chords = arcs.chord_deltas(r,180.0,-2*math.pi,segment_length)
+			dz = pitch/n if mode == 'helix' else 0.0
+			total += turns*float(np.sqrt((chords**2).sum(axis=1)+dz**2).sum())
+		return total
+
+	def toolpath(self,layer_height,mode='helix',segment_length=ARC_SEGMENT_LENGTH,chunk_turns=50):
+		""" Generate the vessel as blocks of relative moves
+
+		Yields (kind, x, y, z, weight) blocks: kind is 'print' (arrays of moves,
+		weight is the path length of every move) or 'travel' (one move, weight None).
+		Printing blocks hold at most chunk_turns turns, so long vessels are
+		streamed instead of built in memory at once.
+		"""
+		if mode not in VESSEL_MODES:
+			raise RuntimeError('Vessel mode must be one of {}.'.format(', '.join(VESSEL_MODES)))
+		turns = self.turn_count(layer_height)
+		pitch = self.length/turns
+		radii = self.shell_radii().tolist()
+		# start from the pipet surface out to the first shell
+		yield ('travel',-(radii[0]-self.ID/2.),0.0,0.0,None)
+		if mode == 'helix':
+			for k,r in enumerate(radii):
+				chords = arcs.chord_deltas(r,180.0,-2*math.pi,segment_length)
+				n = len(chords)
+				# even shells climb (negative Z is up), odd shells come back down
+				dz = (-pitch if k % 2 == 0 else pitch)/n
+				lengths = np.sqrt((chords**2).sum(axis=1)+dz**2)
+				for first in range(0,turns,chunk_turns):
+					count = min(chunk_turns,turns-first)
+					yield ('print',np.tile(chords[:,0],count),np.tile(chords[:,1],count),np.full(n*count,dz),np.tile(lengths,count))
+				if k != len(radii)-1:
+					# every shell ends where it started in XY: step out to the next one
+					yield ('travel',-(radii[k+1]-r),0.0,0.0,None)
+		else:
+			rings = [arcs.chord_deltas(r,180.0,-2*math.pi,segment_length) for r in radii]
+			steps = [-(b-a) for a,b in zip(radii[:-1],radii[1:])]
+			for layer in range(turns):
+				for k,chords in enumerate(rings):
+					yield ('print',chords[:,0],chords[:,1],np.zeros(len(chords)),np.sqrt((chords**2).sum(axis=1)))
+					if k != len(rings)-1:
+						yield ('travel',steps[k],0.0,0.0,None)
+				if layer != turns-1 and len(radii) > 1:
+					# one layer up, then back to the inner shell
+					yield ('travel',0.0,0.0,-pitch,None)
+					yield ('travel',radii[-1]-radii[0],0.0,0.0,None)
+				elif layer != turns-1:
+					yield ('travel',0.0,0.0,-pitch,None)
+
 if __name__ == "__main__":
 
 	vessel = Vessel(16,3000)
-